@@ -12,6 +12,8 @@ const FinancialAIAgent = () => {
     const [transactions, setTransactions] = useState([]);
 
     const API_BASE = "http://localhost:8000";
+    // How often refreshData checks on its background refresh job
+    const REFRESH_POLL_MS = 1000;
 
     // Early Payment Configuration
     const earlyPaymentConfig = {
@@ -164,10 +166,28 @@ const FinancialAIAgent = () => {
             setLoading(true);
             const response = await fetch(`${API_BASE}/refresh_data`, { method: 'POST' });
             const data = await response.json();
-            
-            if (data.success) {
+
+            if (!data.success) {
+                console.error('Error queueing refresh:', data.message);
+                return;
+            }
+
+            // The refresh runs in the background; wait for the job to finish
+            let job = data;
+            while (!['succeeded', 'failed', 'cancelled'].includes(job.status)) {
+                await new Promise(resolve => setTimeout(resolve, REFRESH_POLL_MS));
+                const jobResponse = await fetch(`${API_BASE}/refresh_jobs/${data.job_id}`);
+                if (!jobResponse.ok) {
+                    throw new Error(`Refresh job ${data.job_id} lookup failed: ${jobResponse.status}`);
+                }
+                job = await jobResponse.json();
+            }
+
+            if (job.status === 'succeeded') {
                 await loadDashboard();
                 console.log('Data refreshed successfully');
+            } else {
+                console.error(`Refresh ${job.status}:`, job.error);
             }
         } catch (error) {
             console.error('Error refreshing data:', error);
@@ -0,0 +1,155 @@
+from recurring import is_detected_adjustment, is_subscription_like
+
+
+def _cents(amount):
+    return int(round(amount * 100))
+
+
+class InsightsAggregator:
+    """
+    Running totals behind /generate_insights, kept up to date as transactions
+    are added, modified or removed.
+
+    Amounts are summed in integer cents so adding and later subtracting the
+    same transaction always returns a group to exactly where it was. Each
+    group keeps [cents, count] and disappears once its count drops to zero.
+
+    is_recurring(transaction_id) says whether a transaction belongs to a
+    detected recurring series; recurring charges that look like
+    subscriptions are counted as such. Postings moved by a configured rule
+    (adjusted_count) and by the recurring detector (recurring_adjusted_count)
+    are counted apart.
+    """
+
+    def __init__(self, is_recurring=lambda transaction_id: False):
+        self.is_recurring = is_recurring
+        self.reset()
+
+    def reset(self, rules_version=None):
+        self.rules_version = rules_version
+        self.transaction_count = 0
+        self.total_spending = 0
+        self.total_income = 0
+        self.adjusted_count = 0
+        self.recurring_adjusted_count = 0
+        self.subscription_count = 0
+        self.by_category = {}
+        self.by_month = {}
+        self.by_merchant = {}
+        # Every month with any transaction in it, spending or not
+        self.active_months = {}
+        self._contributions = {}
+
+    def rebuild(self, adjusted_transactions, rules_version=None):
+        """Recompute everything from an already adjusted transaction list"""
+        self.reset(rules_version)
+        for transaction in adjusted_transactions:
+            self._add(transaction["transaction_id"], self._contribution(transaction))
+
+    def apply(self, upserts=(), removed_ids=()):
+        """
+        Fold removed transactions and adjusted added/modified ones into the
+        running totals. Upserting a transaction already counted replaces it.
+        """
+        for transaction_id in removed_ids:
+            self._remove(transaction_id)
+        for transaction in upserts:
+            transaction_id = transaction["transaction_id"]
+            self._remove(transaction_id)
+            self._add(transaction_id, self._contribution(transaction))
+
+    def _contribution(self, transaction):
+        amount = transaction['amount']
+        month = transaction['date'][:7]  # YYYY-MM format, using adjusted dates
+        spending = amount > 0
+        adjusted = bool(transaction.get('date_adjusted'))
+        detected = adjusted and is_detected_adjustment(transaction)
+        return (
+            _cents(amount),
+            transaction['category'][0] if spending and transaction['category'] else None,
+            month if spending else None,
+            transaction['merchant_name'] if spending and transaction['merchant_name'] else None,
+            month,
+            adjusted and not detected,
+            detected,
+            spending and self.is_recurring(transaction['transaction_id']) and is_subscription_like(transaction),
+        )
+
+    def _add(self, transaction_id, contribution):
+        self._contributions[transaction_id] = contribution
+        self._fold(contribution, 1)
+
+    def _remove(self, transaction_id):
+        contribution = self._contributions.pop(transaction_id, None)
+        if contribution is not None:
+            self._fold(contribution, -1)
+
+    def _fold(self, contribution, sign):
+        cents, category, spending_month, merchant, month, adjusted, detected, subscription = contribution
+        self.transaction_count += sign
+        if cents > 0:
+            self.total_spending += sign * cents
+        elif cents < 0:
+            self.total_income += sign * -cents
+        self.adjusted_count += sign * adjusted
+        self.recurring_adjusted_count += sign * detected
+        self.subscription_count += sign * subscription
+        _bump(self.active_months, month, 0, sign)
+        if cents > 0:
+            _bump(self.by_category, category, cents, sign)
+            _bump(self.by_month, spending_month, cents, sign)
+            _bump(self.by_merchant, merchant, cents, sign)
+
+    # Read side
+
+    def spending_by_category(self):
+        return {k: v[0] / 100 for k, v in self.by_category.items()}
+
+    def monthly_spending(self):
+        return {k: v[0] / 100 for k, v in self.by_month.items()}
+
+    def merchant_spending(self):
+        return {k: v[0] / 100 for k, v in self.by_merchant.items()}
+
+    def state(self):
+        """Comparable snapshot of every aggregate, used by the consistency check"""
+        return {
+            "transaction_count": self.transaction_count,
+            "total_spending": self.total_spending,
+            "total_income": self.total_income,
+            "adjusted_count": self.adjusted_count,
+            "recurring_adjusted_count": self.recurring_adjusted_count,
+            "subscription_count": self.subscription_count,
+            "by_category": {k: tuple(v) for k, v in self.by_category.items()},
+            "by_month": {k: tuple(v) for k, v in self.by_month.items()},
+            "by_merchant": {k: tuple(v) for k, v in self.by_merchant.items()},
+            "active_months": {k: tuple(v) for k, v in self.active_months.items()},
+        }
+
+    def verify(self, adjusted_transactions):
+        """
+        Compare the running totals against a full recompute.
+
+        Returns the names of the aggregates that disagree (empty when
+        consistent).
+        """
+        expected = InsightsAggregator(self.is_recurring)
+        expected.rebuild(adjusted_transactions)
+        return self.differences(expected)
+
+    def differences(self, expected):
+        """Names of the aggregates that disagree with another aggregator's"""
+        actual_state, expected_state = self.state(), expected.state()
+        return [name for name in expected_state if actual_state[name] != expected_state[name]]
+
+
+def _bump(groups, key, cents, sign):
+    if key is None:
+        return
+    group = groups.get(key)
+    if group is None:
+        group = groups[key] = [0, 0]
+    group[0] += sign * cents
+    group[1] += sign
+    if group[1] == 0:
+        del groups[key]
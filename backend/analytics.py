@@ -0,0 +1,298 @@
+import asyncio
+import ctypes
+import multiprocessing
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor, ThreadPoolExecutor
+
+from aggregates import InsightsAggregator
+from early_payments import detect_early_payments
+from logs import get_logger
+from metrics import ANALYTICS_JOB_DURATION, ANALYTICS_JOBS
+from recurring import RecurringDetector
+from txtable import TransactionTable
+
+log = get_logger("analytics")
+
+# Worker processes for analytics jobs; 0 runs them on one thread in this process instead
+ANALYTICS_WORKERS = int(os.getenv("ANALYTICS_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Seconds a job may take, queueing included, before it is cancelled
+ANALYTICS_TIMEOUT = float(os.getenv("ANALYTICS_TIMEOUT", "60"))
+# Finished results kept for reuse, keyed by the data version they were computed from
+ANALYTICS_CACHE_SIZE = int(os.getenv("ANALYTICS_CACHE_SIZE", "16"))
+# Jobs queued or running at once that can still be cancelled; beyond this they run to completion
+MAX_CANCELLABLE_JOBS = 64
+# Transactions folded into the aggregates between cancellation checks
+CHECK_EVERY = 50_000
+# Entries per pickled piece of a job's result; loading one must not stall the event loop
+STATE_PIECE_ENTRIES = 10_000
+
+
+class JobCancelled(Exception):
+    """Raised inside a job (and to its callers) once it is cancelled or past its deadline"""
+
+
+# Set in every worker by _init_worker: one flag per cancellable job slot
+_cancel_flags = None
+
+
+def _init_worker(flags):
+    global _cancel_flags
+    _cancel_flags = flags
+
+
+class Checkpoint:
+    """Handed to jobs; calling it raises JobCancelled once the job should stop"""
+
+    def __init__(self, slot, deadline):
+        self.slot = slot
+        self.deadline = deadline
+
+    def __call__(self):
+        if self.slot is not None and _cancel_flags[self.slot]:
+            raise JobCancelled("cancelled")
+        if time.time() > self.deadline:
+            raise JobCancelled("deadline exceeded")
+
+
+def _call(fn, slot, deadline, args):
+    checkpoint = Checkpoint(slot, deadline)
+    # Jobs cancelled while still queued stop here
+    checkpoint()
+    return fn(checkpoint, *args)
+
+
+class AnalyticsPool:
+    """
+    Runs CPU-heavy analytics jobs off the event loop, in worker processes.
+
+    A job is a module-level function called as fn(checkpoint, *args) in a
+    worker; it should call checkpoint() between steps so cancel() and
+    timeouts stop it promptly instead of letting it run on. Results are
+    cached under the caller's key, which should include the data version
+    they were computed from, and callers asking for a key already running
+    share that run. The workers are only spawned by the first job, so
+    startup stays as fast as before.
+    """
+
+    def __init__(self, workers=ANALYTICS_WORKERS, timeout=ANALYTICS_TIMEOUT, cache_size=ANALYTICS_CACHE_SIZE):
+        self.workers = workers
+        self.timeout = timeout
+        self.cache_size = cache_size
+        self._executor = None
+        self._flags = None
+        self._slots_lock = threading.Lock()
+        self._free_slots = []
+        # key -> task running the job
+        self._running = {}
+        # key -> cancellation slot of the job, while it is queued or running
+        self._slots = {}
+        self._results = OrderedDict()
+
+    def _start(self):
+        if self.workers > 0:
+            methods = multiprocessing.get_all_start_methods()
+            # Never fork the server itself: it has threads and open databases
+            context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+            if context.get_start_method() == "forkserver":
+                # Workers fork from a server that already imported the jobs
+                context.set_forkserver_preload([__name__])
+            self._flags = context.RawArray(ctypes.c_bool, MAX_CANCELLABLE_JOBS)
+            self._executor = ProcessPoolExecutor(
+                self.workers, mp_context=context, initializer=_init_worker, initargs=(self._flags,),
+            )
+        else:
+            self._flags = bytearray(MAX_CANCELLABLE_JOBS)
+            _init_worker(self._flags)
+            self._executor = ThreadPoolExecutor(1, thread_name_prefix="analytics")
+        self._free_slots = list(range(MAX_CANCELLABLE_JOBS))
+        log.info("analytics_pool_started", workers=self.workers)
+
+    async def run(self, key, fn, *args, timeout=None):
+        """
+        fn's result for key: cached, shared with a run already in flight, or
+        computed in a worker. Raises JobCancelled when the job is cancelled
+        and asyncio.TimeoutError when it takes longer than timeout.
+        """
+        job = fn.__name__
+        if key in self._results:
+            self._results.move_to_end(key)
+            ANALYTICS_JOBS.inc(job=job, outcome="cached")
+            return self._results[key]
+        task = self._running.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._run(key, fn, args, timeout or self.timeout))
+            self._running[key] = task
+            task.add_done_callback(lambda _: self._running.pop(key, None))
+        # A caller disconnecting must not cancel the job other callers wait on
+        return await asyncio.shield(task)
+
+    async def _run(self, key, fn, args, timeout):
+        if self._executor is None:
+            self._start()
+        job = fn.__name__
+        flags, free_slots = self._flags, self._free_slots
+        with self._slots_lock:
+            slot = free_slots.pop() if free_slots else None
+        if slot is not None:
+            self._slots[key] = slot
+        start = time.perf_counter()
+        future = self._executor.submit(_call, fn, slot, time.time() + timeout, args)
+        # The slot is free again once the worker is really done with the job
+        future.add_done_callback(lambda _: self._release(slot, flags, free_slots))
+        outcome = "failed"
+        try:
+            result = await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+            outcome = "ok"
+        except asyncio.TimeoutError:
+            outcome = "timeout"
+            self._signal(slot)
+            log.warning("analytics_job_timeout", job=job, timeout=timeout)
+            raise
+        except JobCancelled:
+            outcome = "cancelled"
+            raise
+        except Exception as e:
+            log.error("analytics_job_failed", job=job, error=str(e))
+            if isinstance(e, BrokenExecutor):
+                # A worker died (e.g. killed for memory); start a fresh pool for the next job
+                self.shutdown()
+            raise
+        finally:
+            self._slots.pop(key, None)
+            ANALYTICS_JOBS.inc(job=job, outcome=outcome)
+            ANALYTICS_JOB_DURATION.observe(time.perf_counter() - start, job=job)
+        if self.cache_size > 0:
+            self._results[key] = result
+            while len(self._results) > self.cache_size:
+                self._results.popitem(last=False)
+        return result
+
+    def _signal(self, slot):
+        if slot is not None and self._flags is not None:
+            self._flags[slot] = True
+
+    def _release(self, slot, flags, free_slots):
+        # flags and free_slots are those of the pool the job ran in, which a restart replaces
+        if slot is None:
+            return
+        with self._slots_lock:
+            flags[slot] = False
+            free_slots.append(slot)
+
+    def cancel(self, match):
+        """Cancel every queued or running job whose key satisfies match(key); returns how many"""
+        cancelled = [key for key in self._slots if match(key)]
+        for key in cancelled:
+            self._signal(self._slots[key])
+        return len(cancelled)
+
+    def forget(self, match):
+        """Drop cached results whose key satisfies match(key)"""
+        for key in [key for key in self._results if match(key)]:
+            del self._results[key]
+
+    def running(self):
+        return len(self._running)
+
+    def shutdown(self):
+        """Cancel every job and stop the workers without waiting for them"""
+        if self._executor is None:
+            return
+        for slot in range(MAX_CANCELLABLE_JOBS):
+            self._flags[slot] = True
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+        self._results.clear()
+
+
+# Moving large derived state out of a worker. Unpickling it in one go would
+# hold the GIL (and so the event loop) for as long as the job saved, so dicts
+# and sets are split into pieces, loaded with a pause after each.
+
+def pack_state(obj, skip=()):
+    """obj's attributes as a list of pickled pieces for unpack_state()"""
+    pieces = []
+
+    def emit(name, kind, entries):
+        pieces.append(pickle.dumps((name, kind, entries), protocol=pickle.HIGHEST_PROTOCOL))
+
+    for name, value in vars(obj).items():
+        if name in skip:
+            continue
+        if isinstance(value, dict) and value and all(isinstance(v, dict) for v in value.values()):
+            # A dict of dicts goes as (key, some of its items) runs, so one huge
+            # inner dict cannot make a huge piece either
+            batch, size = [], 0
+            for key, group in value.items():
+                items = list(group.items())
+                for start in range(0, max(len(items), 1), STATE_PIECE_ENTRIES):
+                    run = items[start:start + STATE_PIECE_ENTRIES]
+                    batch.append((key, run))
+                    size += len(run) + 1
+                    if size >= STATE_PIECE_ENTRIES:
+                        emit(name, "nested", batch)
+                        batch, size = [], 0
+            if batch:
+                emit(name, "nested", batch)
+        elif isinstance(value, (dict, set)):
+            entries = list(value.items()) if isinstance(value, dict) else list(value)
+            kind = "dict" if isinstance(value, dict) else "set"
+            for start in range(0, max(len(entries), 1), STATE_PIECE_ENTRIES):
+                emit(name, kind, entries[start:start + STATE_PIECE_ENTRIES])
+        else:
+            emit(name, "value", value)
+    return pieces
+
+
+async def unpack_state(obj, pieces):
+    """Load pack_state() pieces into obj's attributes, yielding to the event loop between pieces"""
+    state = {}
+    for piece in pieces:
+        name, kind, entries = pickle.loads(piece)
+        if kind == "value":
+            state[name] = entries
+        elif kind == "nested":
+            groups = state.setdefault(name, {})
+            for key, run in entries:
+                groups.setdefault(key, {}).update(run)
+        elif kind == "dict":
+            state.setdefault(name, {}).update(entries)
+        else:
+            state.setdefault(name, set()).update(entries)
+        await asyncio.sleep(0)
+    vars(obj).update(state)
+    return obj
+
+
+# Jobs
+
+def build_aggregates(checkpoint, snapshot, known_payments):
+    """
+    Build what /generate_insights needs from scratch: the recurring payment
+    detector, the early payment adjustment pass over it and the insight
+    aggregates, from TransactionTable.snapshot() pieces. Returns both packed
+    for restore_aggregates().
+    """
+    table = TransactionTable.from_snapshot(snapshot)
+    recurring = RecurringDetector()
+    recurring.rebuild(table)
+    checkpoint()
+    adjusted = detect_early_payments(table, known_payments, detected=recurring.adjustments)
+    checkpoint()
+    aggregator = InsightsAggregator(recurring.is_recurring)
+    for start in range(0, len(adjusted), CHECK_EVERY):
+        aggregator.apply(adjusted[start:start + CHECK_EVERY])
+        checkpoint()
+    return pack_state(recurring), pack_state(aggregator, skip=("is_recurring",))
+
+
+async def restore_aggregates(packed, is_recurring):
+    """(detector, aggregator) from a build_aggregates() result, without stalling the event loop"""
+    recurring_state, aggregator_state = packed
+    recurring = await unpack_state(RecurringDetector(), recurring_state)
+    aggregator = await unpack_state(InsightsAggregator(is_recurring), aggregator_state)
+    return recurring, aggregator
@@ -0,0 +1,105 @@
+"""
+Throughput of detect_early_payments against the original per-row implementation.
+
+    python benchmarks/bench_early_payments.py [sizes...]
+
+Defaults to 10k, 100k and 1M transactions. The legacy loop is skipped above
+100k rows because it takes minutes; results are checked for equality wherever
+both run.
+"""
+import os
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from early_payments import detect_early_payments  # noqa: E402
+from synthetic import EARLY_PAYMENT_RULES  # noqa: E402
+
+LEGACY_LIMIT = 100_000
+
+NAMES = [
+    "Starbucks", "Uber 063015 SF**POOL**", "Amazon Marketplace", "Netflix Monthly",
+    "Wells Fargo Home Mtg", "Quicken Loans Payment", "Shell Oil", "Payroll Deposit",
+    "Spotify Subscription", "Whole Foods", "Home Loan Servicing", "Car Payment Auto Loan",
+]
+
+
+def legacy_is_early_payment(transaction, config):
+    amount_match = abs(transaction['amount'] - config['amount']) <= config.get('tolerance', 0)
+    name_lower = transaction['name'].lower()
+    keyword_match = any(keyword in name_lower for keyword in config['keywords'])
+    transaction_date = datetime.strptime(transaction['date'], '%Y-%m-%d')
+    days_in_month = (datetime(transaction_date.year, transaction_date.month % 12 + 1, 1) - timedelta(days=1)).day
+    is_end_of_month = transaction_date.day >= (days_in_month - config['days_early'])
+    return amount_match and keyword_match and is_end_of_month
+
+
+def legacy_detect_early_payments(transactions, known_payments):
+    """The pre-compiled implementation, minus its per-row print"""
+    adjusted_transactions = []
+    for transaction in transactions:
+        adjusted_transaction = transaction.copy()
+        for payment_type, config in known_payments.items():
+            if legacy_is_early_payment(transaction, config):
+                original_date = datetime.strptime(transaction['date'], '%Y-%m-%d')
+                adjusted_date = original_date + timedelta(days=config['days_early'])
+                adjusted_transaction['date'] = adjusted_date.strftime('%Y-%m-%d')
+                adjusted_transaction['original_date'] = transaction['date']
+                adjusted_transaction['payment_type'] = payment_type
+                adjusted_transaction['date_adjusted'] = True
+                break
+        adjusted_transactions.append(adjusted_transaction)
+    return adjusted_transactions
+
+
+def make_transactions(n, seed=42):
+    rng = random.Random(seed)
+    start = date(2020, 1, 1)
+    transactions = []
+    for i in range(n):
+        name = rng.choice(NAMES)
+        if "mtg" in name.lower() or "loan" in name.lower():
+            amount = round(3416.03 + rng.uniform(-12, 12), 2)
+        else:
+            amount = round(rng.uniform(-2500, 400), 2)
+        transactions.append({
+            "transaction_id": f"tx_{i}",
+            "account_id": f"acc_{i % 5}",
+            "amount": amount,
+            "date": (start + timedelta(days=rng.randrange(2000))).isoformat(),
+            "name": name,
+            "category": ["General"],
+            "merchant_name": None,
+        })
+    return transactions
+
+
+def bench(sizes):
+    configs = dict(EARLY_PAYMENT_RULES)
+    configs["car_payment"] = {"amount": 450.00, "keywords": ["auto loan", "car payment"], "days_early": 3, "tolerance": 3500}
+    devnull = open(os.devnull, "w")
+    for n in sizes:
+        transactions = make_transactions(n)
+
+        stdout, sys.stdout = sys.stdout, devnull
+        start = time.perf_counter()
+        result = detect_early_payments(transactions, configs)
+        compiled_s = time.perf_counter() - start
+        sys.stdout = stdout
+
+        line = f"{n:>9,} rows  compiled {compiled_s:8.3f}s  {n / compiled_s:>12,.0f} rows/s"
+        if n <= LEGACY_LIMIT:
+            start = time.perf_counter()
+            expected = legacy_detect_early_payments(transactions, configs)
+            legacy_s = time.perf_counter() - start
+            assert result == expected, "compiled engine output differs from legacy"
+            line += f"  legacy {legacy_s:8.3f}s  {n / legacy_s:>12,.0f} rows/s  speedup {legacy_s / compiled_s:5.1f}x"
+        print(line)
+
+
+if __name__ == "__main__":
+    bench([int(arg) for arg in sys.argv[1:]] or [10_000, 100_000, 1_000_000])
@@ -0,0 +1,74 @@
+"""
+Requests/sec for the read endpoints the dashboard polls.
+
+    python benchmarks/bench_endpoints.py [transactions] [seconds]
+
+Seeds a throwaway SQLite store with synthetic accounts and transactions,
+imports the app against it and hammers /accounts and /dashboard in-process
+through the ASGI test client.
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from bench_early_payments import make_transactions  # noqa: E402
+from storage import TransactionStore  # noqa: E402
+
+ENDPOINTS = ["/accounts", "/dashboard"]
+
+
+def seed(path, n_transactions):
+    accounts = [
+        {"account_id": f"acc_{i}", "name": f"Account {i}", "type": "depository",
+         "subtype": "checking", "balance": 1000.0 * i, "access_token": "access-bench"}
+        for i in range(5)
+    ]
+    store = TransactionStore(path)
+    store.import_user_data({
+        "access_tokens": ["access-bench"],
+        "accounts": accounts,
+        "transactions": make_transactions(n_transactions),
+        "insights": [],
+    })
+    store.close()
+
+
+def requests_per_second(client, path, seconds):
+    client.get(path)  # warm caches
+    count = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        response = client.get(path)
+        assert response.status_code == 200
+        count += 1
+    return count / seconds
+
+
+def main(n_transactions=50_000, seconds=3.0):
+    workdir = tempfile.mkdtemp()
+    db_path = os.path.join(workdir, "bench.db")
+    seed(db_path, n_transactions)
+    os.environ["USER_DATA_DB"] = db_path
+    # The seeded database is the default user's, which TestClient may act as
+    os.environ["DEFAULT_USER_HOSTS"] = "testclient"
+    os.chdir(workdir)
+
+    from fastapi.testclient import TestClient
+    import main as app_module
+
+    devnull = open(os.devnull, "w")
+    client = TestClient(app_module.app)
+    for path in ENDPOINTS:
+        stdout, sys.stdout = sys.stdout, devnull
+        rps = requests_per_second(client, path, seconds)
+        sys.stdout = stdout
+        print(f"{path:<14} {n_transactions:>8,} transactions  {rps:>8,.0f} req/s")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    main(int(args[0]) if args else 50_000, float(args[1]) if len(args) > 1 else 3.0)
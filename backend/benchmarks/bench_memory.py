@@ -0,0 +1,58 @@
+"""
+Memory footprint of the transaction history: list of dicts vs TransactionTable.
+
+    python benchmarks/bench_memory.py [sizes...]
+
+Rows go through a JSON round trip first so every string is its own object,
+the way they look after loading from disk. Also compares the adjusted view:
+copied dicts from detect_early_payments on a list vs the overlay on a table.
+"""
+import gc
+import json
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from bench_early_payments import make_transactions  # noqa: E402
+from early_payments import detect_early_payments  # noqa: E402
+from synthetic import EARLY_PAYMENT_RULES  # noqa: E402
+from txtable import TransactionTable  # noqa: E402
+
+
+def measure(build):
+    """Bytes still allocated by whatever build() returns"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, after - before
+
+
+def bench(sizes):
+    devnull = open(os.devnull, "w")
+    for n in sizes:
+        text = json.dumps(make_transactions(n))
+
+        dicts, dict_bytes = measure(lambda: json.loads(text))
+        table, table_bytes = measure(lambda: TransactionTable(json.loads(text)))
+
+        stdout, sys.stdout = sys.stdout, devnull
+        _, copied_bytes = measure(lambda: detect_early_payments(dicts, EARLY_PAYMENT_RULES))
+        _, overlay_bytes = measure(lambda: detect_early_payments(table, EARLY_PAYMENT_RULES))
+        sys.stdout = stdout
+
+        print(
+            f"{n:>9,} rows  dicts {dict_bytes / n:6.0f} B/row  table {table_bytes / n:6.0f} B/row"
+            f"  ({dict_bytes / table_bytes:4.1f}x smaller)"
+            f"  | adjusted view: list {copied_bytes / n:5.1f} B/row  overlay {overlay_bytes / n:5.1f} B/row"
+        )
+
+
+if __name__ == "__main__":
+    bench([int(arg) for arg in sys.argv[1:]] or [10_000, 100_000, 500_000])
@@ -0,0 +1,149 @@
+"""
+Load test for the analytics pool: /health and /accounts latency while
+/generate_insights keeps rebuilding its aggregates from scratch.
+
+    python benchmarks/bench_offload.py [--months 600] [--seconds 10] [--budget-ms 50]
+
+Starts uvicorn on a seeded store twice: with the analytics worker pool, and
+with ANALYTICS_WORKERS=0, which runs the same jobs on a thread inside the
+server, for comparison. Each run probes both endpoints back to back, first
+idle and then while a client loops POST /generate_insights with
+consistency_check=true; the result cache is disabled, so every call is a full
+recompute. Exits 1 when, with the pool, either endpoint's p99 under load is
+more than the budget above its idle p99.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from bench_startup import _environment, _free_port  # noqa: E402
+from synthetic import generate_household  # noqa: E402
+
+PROBED = ("/health", "/accounts")
+# Pause between probe rounds, so the probes themselves are not the load
+PROBE_INTERVAL = 0.005
+
+
+def seed(workdir, months):
+    from storage import TransactionStore
+
+    household = generate_household(seed=3, months=months, access_token="access-bench")
+    store = TransactionStore(os.path.join(workdir, "user_data.db"))
+    store.import_user_data(household)
+    store.close()
+    return len(household["transactions"])
+
+
+@contextmanager
+def server(workdir, workers, timeout=60.0):
+    """Base URL of a uvicorn serving the seeded store, once it answers /health"""
+    port = _free_port()
+    base = f"http://127.0.0.1:{port}"
+    env = dict(_environment(workdir), ANALYTICS_WORKERS=str(workers), ANALYTICS_CACHE_SIZE="0")
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "--app-dir", BACKEND_DIR, "main:app",
+         "--port", str(port), "--log-level", "warning"],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        deadline = time.perf_counter() + timeout
+        while True:
+            try:
+                with urllib.request.urlopen(base + "/health", timeout=1):
+                    break
+            except OSError:
+                if process.poll() is not None or time.perf_counter() > deadline:
+                    raise RuntimeError("uvicorn did not come up")
+                time.sleep(0.05)
+        yield base
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def generate_insights(base):
+    request = urllib.request.Request(base + "/generate_insights?consistency_check=true", data=b"", method="POST")
+    with urllib.request.urlopen(request, timeout=300) as response:
+        response.read()
+
+
+def probe(base, seconds):
+    """{path: [latency seconds]} from requesting every probed path in turn for `seconds`"""
+    samples = {path: [] for path in PROBED}
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        for path in PROBED:
+            start = time.perf_counter()
+            with urllib.request.urlopen(base + path, timeout=30) as response:
+                response.read()
+            samples[path].append(time.perf_counter() - start)
+        time.sleep(PROBE_INTERVAL)
+    return samples
+
+
+def run(workdir, workers, seconds):
+    """(idle samples, loaded samples, insight calls completed under load)"""
+    with server(workdir, workers) as base:
+        # Loads the partition and starts the pool, so neither lands in a measurement
+        generate_insights(base)
+        idle = probe(base, seconds)
+
+        stop, completed = threading.Event(), []
+
+        def load():
+            while not stop.is_set():
+                generate_insights(base)
+                completed.append(1)
+        worker = threading.Thread(target=load)
+        worker.start()
+        try:
+            loaded = probe(base, seconds)
+        finally:
+            stop.set()
+            worker.join()
+    return idle, loaded, len(completed)
+
+
+def p99(samples):
+    return statistics.quantiles(samples, n=100)[98]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--months", type=int, default=600, help="history length of the seeded household")
+    parser.add_argument("--seconds", type=float, default=10.0, help="length of each probe phase")
+    parser.add_argument("--budget-ms", type=float, default=50.0, help="max p99 rise under load, with the pool")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        rows = seed(workdir, args.months)
+        print(f"{rows:,} transactions")
+        over = False
+        for label, workers in (("pool", os.cpu_count() and min(4, os.cpu_count())), ("in-process", 0)):
+            idle, loaded, completed = run(workdir, workers, args.seconds)
+            print(f"{label} ({completed} insight rebuilds under load)")
+            for path in PROBED:
+                idle_p99, loaded_p99 = p99(idle[path]) * 1000, p99(loaded[path]) * 1000
+                print(f"  {path:<10} p99 idle {idle_p99:8.1f} ms  loaded {loaded_p99:8.1f} ms"
+                      f"  max loaded {max(loaded[path]) * 1000:8.1f} ms")
+                if workers and loaded_p99 - idle_p99 > args.budget_ms:
+                    over = True
+        if over:
+            print("p99 under load is over budget")
+    return 1 if over else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
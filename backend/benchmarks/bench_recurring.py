@@ -0,0 +1,44 @@
+"""
+Scaling of the recurring-series detector on synthetic histories.
+
+    python benchmarks/bench_recurring.py [sizes...]
+
+Defaults to 10k, 100k and 1M transactions. Reports a full rebuild and an
+incremental apply() of one sync-sized batch; per-row rebuild cost should
+stay roughly flat as the history grows.
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from recurring import RecurringDetector  # noqa: E402
+from synthetic import generate_household, generate_transactions  # noqa: E402
+from txtable import TransactionTable  # noqa: E402
+
+
+def bench(sizes):
+    batch = generate_household(seed=9, months=1)["transactions"][:50]
+    for n in sizes:
+        table = TransactionTable(generate_transactions(n, seed=1))
+        detector = RecurringDetector()
+
+        start = time.perf_counter()
+        detector.rebuild(table)
+        rebuild_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        detector.apply(batch)
+        apply_s = time.perf_counter() - start
+
+        print(
+            f"{n:>9,} rows  rebuild {rebuild_s:8.3f}s  {n / rebuild_s:>10,.0f} rows/s"
+            f"  {rebuild_s / n * 1e6:6.2f} us/row  apply({len(batch)}) {apply_s * 1000:8.2f} ms"
+            f"  series {len(detector.series()):>3}  adjusted {len(detector.adjustments):>5,}"
+        )
+
+
+if __name__ == "__main__":
+    bench([int(arg) for arg in sys.argv[1:]] or [10_000, 100_000, 1_000_000])
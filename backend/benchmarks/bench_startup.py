@@ -0,0 +1,105 @@
+"""
+Cold-start cost of the API: how long `import main` takes in a fresh
+interpreter, and how long from spawning uvicorn until /health answers.
+
+    python benchmarks/bench_startup.py [--repeat 5] [--import-budget 1.0] [--health-budget 2.5]
+
+Every run uses a new process and an empty data directory, so nothing is
+warm except the OS page cache. Exits 1 when a median is over its budget,
+so CI can keep startup from creeping up.
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_SCRIPT = (
+    "import sys, time; sys.path.insert(0, sys.argv[1]); start = time.perf_counter(); import main; "
+    "print(time.perf_counter() - start, 'plaid' in sys.modules)"
+)
+
+
+def _environment(workdir):
+    return dict(
+        os.environ,
+        USER_DATA_DB=os.path.join(workdir, "user_data.db"),
+        USER_DATA_DIR=os.path.join(workdir, "users"),
+        ITEM_REGISTRY_DB=os.path.join(workdir, "plaid_items.db"),
+        REFRESH_INTERVAL="0",
+        LOG_LEVEL="WARNING",
+    )
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def measure_import():
+    """(seconds to import main, whether that imported the Plaid SDK)"""
+    with tempfile.TemporaryDirectory() as workdir:
+        output = subprocess.run(
+            [sys.executable, "-c", IMPORT_SCRIPT, BACKEND_DIR],
+            cwd=workdir, env=_environment(workdir), capture_output=True, text=True, check=True,
+        ).stdout.split()
+    return float(output[0]), output[1] == "True"
+
+
+def measure_first_health(timeout=30.0):
+    """Seconds from spawning uvicorn until GET /health returns 200"""
+    port = _free_port()
+    url = f"http://127.0.0.1:{port}/health"
+    with tempfile.TemporaryDirectory() as workdir:
+        start = time.perf_counter()
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "--app-dir", BACKEND_DIR, "main:app",
+             "--port", str(port), "--log-level", "warning"],
+            cwd=workdir, env=_environment(workdir), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            while time.perf_counter() - start < timeout:
+                try:
+                    with urllib.request.urlopen(url, timeout=1) as response:
+                        if response.status == 200:
+                            return time.perf_counter() - start
+                except OSError:
+                    pass
+                if server.poll() is not None:
+                    raise RuntimeError(f"uvicorn exited with {server.returncode} before /health answered")
+                time.sleep(0.005)
+            raise TimeoutError(f"/health did not answer within {timeout}s")
+        finally:
+            server.terminate()
+            server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--import-budget", type=float, default=1.0, help="max median seconds for import main")
+    parser.add_argument("--health-budget", type=float, default=2.5, help="max median seconds to first /health")
+    args = parser.parse_args()
+
+    imports = [measure_import() for _ in range(args.repeat)]
+    import_s = statistics.median(seconds for seconds, _ in imports)
+    health_s = statistics.median(measure_first_health() for _ in range(args.repeat))
+
+    print(f"import main       median {import_s * 1000:8.1f} ms  budget {args.import_budget * 1000:8.1f} ms"
+          f"  plaid imported: {any(plaid for _, plaid in imports)}")
+    print(f"first /health     median {health_s * 1000:8.1f} ms  budget {args.health_budget * 1000:8.1f} ms")
+    over = import_s > args.import_budget or health_s > args.health_budget
+    if over:
+        print("startup is over budget")
+    return 1 if over else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,194 @@
+"""
+In-process stand-in for plaid_api.PlaidApi, for benchmarks and offline runs.
+
+    fake = FakePlaid(latency=0.05, page_size=100)
+    main.set_plaid_client(fake)
+
+Implements the calls the backend makes: link_token_create,
+item_public_token_exchange, accounts_get, transactions_sync,
+transactions_get and institutions_get. Exchanging a public token creates an
+Item backed by a synthetic household seeded from the token, so the same
+token always yields the same data. Every call sleeps for `latency` seconds
+(plus up to `jitter`), the way a blocking SDK call would on a worker thread;
+a `slow_fraction` of them take `slow_latency` instead, a long tail to hedge
+against. With `rate_limit` set, an Item sent more than that many calls in
+any one second gets 429 RATE_LIMIT_EXCEEDED errors, as Plaid would answer.
+
+Each Item keeps an append-only change log; /transactions/sync cursors are
+positions in it, so update_item() can add, modify or remove transactions
+and the next sync only returns those changes.
+"""
+import random
+import threading
+import time
+import zlib
+from collections import Counter, deque
+from datetime import date
+from types import SimpleNamespace
+
+from synthetic import generate_household
+
+
+def _transaction(t):
+    return SimpleNamespace(
+        transaction_id=t["transaction_id"],
+        account_id=t["account_id"],
+        amount=t["amount"],
+        date=date.fromisoformat(t["date"]),
+        name=t["name"],
+        category=t["category"],
+        merchant_name=t["merchant_name"],
+    )
+
+
+def _rate_limit_error():
+    from plaid.exceptions import ApiException
+
+    error = ApiException(status=429, reason="Too Many Requests")
+    error.body = '{"error_type": "RATE_LIMIT_EXCEEDED", "error_code": "TRANSACTIONS_LIMIT"}'
+    return error
+
+
+class FakeItem:
+    def __init__(self, item_id, household):
+        self.item_id = item_id
+        self.accounts = household["accounts"]
+        self.transactions = {t["transaction_id"]: t for t in household["transactions"]}
+        # (kind, payload): ("added"|"modified", transaction) or ("removed", transaction_id)
+        self.changes = [("added", t) for t in household["transactions"]]
+
+
+class FakePlaid:
+    def __init__(self, latency=0.0, jitter=0.0, page_size=500, months=12, card_tx_per_day=3.0,
+                 institutions=2000, seed=0, slow_fraction=0.0, slow_latency=0.0, rate_limit=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.slow_fraction = slow_fraction
+        self.slow_latency = slow_latency
+        self.rate_limit = rate_limit
+        self.page_size = page_size
+        self.months = months
+        self.card_tx_per_day = card_tx_per_day
+        self.institution_count = institutions
+        self.items = {}
+        self.calls = Counter()
+        self.rate_limited = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        # access token -> times of its recent calls
+        self._recent = {}
+
+    def _call(self, name, access_token=None):
+        with self._lock:
+            self.calls[name] += 1
+            if self.rate_limit and access_token:
+                now = time.monotonic()
+                recent = self._recent.setdefault(access_token, deque())
+                while recent and recent[0] <= now - 1.0:
+                    recent.popleft()
+                if len(recent) >= self.rate_limit:
+                    self.rate_limited += 1
+                    raise _rate_limit_error()
+                recent.append(now)
+            if self.slow_fraction and self._rng.random() < self.slow_fraction:
+                delay = self.slow_latency
+            else:
+                delay = self.latency + (self._rng.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            time.sleep(delay)
+
+    def _item(self, request):
+        return self.items[request.access_token]
+
+    # Test hooks
+
+    def add_item(self, access_token, seed=0):
+        household = generate_household(
+            seed=seed, months=self.months, card_tx_per_day=self.card_tx_per_day, access_token=access_token,
+        )
+        item = self.items[access_token] = FakeItem(f"item-{access_token}", household)
+        return item
+
+    def update_item(self, access_token, added=(), modified=(), removed_ids=()):
+        """Record changes that the next /transactions/sync will return"""
+        item = self.items[access_token]
+        with self._lock:
+            for t in added:
+                item.transactions[t["transaction_id"]] = t
+                item.changes.append(("added", t))
+            for t in modified:
+                item.transactions[t["transaction_id"]] = t
+                item.changes.append(("modified", t))
+            for transaction_id in removed_ids:
+                item.transactions.pop(transaction_id, None)
+                item.changes.append(("removed", transaction_id))
+
+    # Plaid API
+
+    def link_token_create(self, request):
+        self._call("link_token_create")
+        return SimpleNamespace(link_token=f"link-fake-{self.calls['link_token_create']}")
+
+    def item_public_token_exchange(self, request):
+        self._call("item_public_token_exchange")
+        access_token = f"access-fake-{request.public_token}"
+        if access_token not in self.items:
+            self.add_item(access_token, seed=zlib.crc32(request.public_token.encode()))
+        return SimpleNamespace(access_token=access_token, item_id=self.items[access_token].item_id)
+
+    def _accounts(self, item):
+        return [
+            SimpleNamespace(
+                account_id=a["account_id"], name=a["name"], type=a["type"], subtype=a["subtype"],
+                balances=SimpleNamespace(current=a["balance"]),
+            )
+            for a in item.accounts
+        ]
+
+    def accounts_get(self, request):
+        self._call("accounts_get", request.access_token)
+        return SimpleNamespace(accounts=self._accounts(self._item(request)))
+
+    def transactions_sync(self, request):
+        self._call("transactions_sync", request.access_token)
+        item = self._item(request)
+        start = int(getattr(request, "cursor", None) or 0)
+        count = min(getattr(request, "count", None) or 100, self.page_size)
+        page = item.changes[start:start + count]
+        end = start + len(page)
+        return SimpleNamespace(
+            added=[_transaction(t) for kind, t in page if kind == "added"],
+            modified=[_transaction(t) for kind, t in page if kind == "modified"],
+            removed=[SimpleNamespace(transaction_id=tid) for kind, tid in page if kind == "removed"],
+            accounts=self._accounts(item),
+            next_cursor=str(end),
+            has_more=end < len(item.changes),
+        )
+
+    def transactions_get(self, request):
+        self._call("transactions_get", request.access_token)
+        item = self._item(request)
+        start_date, end_date = str(request.start_date), str(request.end_date)
+        matching = sorted(
+            (t for t in item.transactions.values() if start_date <= t["date"] <= end_date),
+            key=lambda t: (t["date"], t["transaction_id"]), reverse=True,
+        )
+        options = getattr(request, "options", None)
+        offset = getattr(options, "offset", 0) if options is not None else 0
+        count = min(getattr(options, "count", 100) if options is not None else 100, self.page_size)
+        return SimpleNamespace(
+            total_transactions=len(matching),
+            transactions=[_transaction(t) for t in matching[offset:offset + count]],
+        )
+
+    def institutions_get(self, request):
+        self._call("institutions_get")
+        offset, count = request.offset, min(request.count, self.page_size)
+        end = min(self.institution_count, offset + count)
+        return SimpleNamespace(
+            total=self.institution_count,
+            institutions=[
+                SimpleNamespace(institution_id=f"ins_{i}", name=f"Fake Bank {i}", products=["transactions"])
+                for i in range(offset, end)
+            ],
+        )
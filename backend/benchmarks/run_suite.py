@@ -0,0 +1,458 @@
+"""
+Reproducible benchmark suite for the backend.
+
+    python benchmarks/run_suite.py --output results.json
+    python benchmarks/run_suite.py --size 20000 --only dashboard,fetch
+    python benchmarks/run_suite.py --output new.json --compare old.json
+
+Everything runs in-process against a throwaway data directory: synthetic
+households from synthetic.py, Plaid replaced by fake_plaid.FakePlaid with
+configurable latency and page size. Each benchmark reports min / median /
+p95 / mean seconds over --repeat runs (after one warm-up), and rows/s where
+that makes sense. Results go to --output as JSON together with the git
+revision, interpreter and JSON encoder (orjson is optional), so runs from
+different versions can be compared with --compare.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import date, datetime, timezone
+from functools import partial
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from schemas import JSON_ENCODER  # noqa: E402
+from synthetic import EARLY_PAYMENT_RULES, generate_household, generate_transactions  # noqa: E402
+
+# Slower than this much vs the comparison run is flagged
+REGRESSION_THRESHOLD = 1.10
+
+
+def summarize(samples, rows=None):
+    ordered = sorted(samples)
+    median = statistics.median(ordered)
+    result = {
+        "runs": len(ordered),
+        "min_s": ordered[0],
+        "median_s": median,
+        "p95_s": ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))],
+        "mean_s": statistics.fmean(ordered),
+    }
+    if rows:
+        result["rows"] = rows
+        result["rows_per_s"] = rows / median if median else None
+    return result
+
+
+def timed(fn, repeat, setup=None):
+    """Run setup() (untimed) then fn() repeat times after one warm-up"""
+    samples = []
+    for i in range(repeat + 1):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        if i:
+            samples.append(elapsed)
+    return samples
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Suite:
+    def __init__(self, size, repeat, tokens, latency, page_size):
+        self.size = size
+        self.repeat = repeat
+        self.tokens = tokens
+        self.latency = latency
+        self.page_size = page_size
+        self.results = {}
+        self.workdir = tempfile.mkdtemp(prefix="bench-suite-")
+        # Before any backend module is imported, since they read these at import time
+        os.environ.update({
+            "USER_DATA_DB": os.path.join(self.workdir, "user_data.db"),
+            "USER_DATA_DIR": os.path.join(self.workdir, "users"),
+            "ITEM_REGISTRY_DB": os.path.join(self.workdir, "plaid_items.db"),
+            "REFRESH_INTERVAL": "0",
+            "STORE_JOURNAL_FSYNC": "0",
+            "LOG_LEVEL": "WARNING",
+            # Requests without X-User-Id are the default user's, as from a local frontend
+            "DEFAULT_USER_HOSTS": "testclient",
+        })
+        os.chdir(self.workdir)
+
+    def record(self, name, samples, rows=None, **extra):
+        self.results[name] = {**summarize(samples, rows), **extra}
+        r = self.results[name]
+        rate = f"  {r['rows_per_s']:>12,.0f} rows/s" if rows else ""
+        print(f"{name:<34} median {r['median_s'] * 1000:9.2f} ms  p95 {r['p95_s'] * 1000:9.2f} ms{rate}")
+
+    # Fresh processes
+
+    def bench_startup(self):
+        from bench_startup import measure_first_health, measure_import
+
+        imports = [measure_import() for _ in range(self.repeat)]
+        self.record("startup.import", [seconds for seconds, _ in imports],
+                    plaid_imported=any(plaid for _, plaid in imports))
+        self.record("startup.first_health", [measure_first_health() for _ in range(self.repeat)])
+
+    # Pure functions
+
+    def bench_early_payments(self):
+        from early_payments import detect_early_payments
+        from search_index import SearchIndex
+        from txtable import TransactionTable
+
+        transactions = generate_transactions(self.size, seed=1)
+        table = TransactionTable(transactions)
+        rules = EARLY_PAYMENT_RULES
+        self.record("early_payments.table", timed(lambda: detect_early_payments(table, rules), self.repeat), self.size)
+        index = SearchIndex()
+        index.rebuild(table)
+        self.record("early_payments.indexed", timed(
+            lambda: detect_early_payments(table, rules, index=index), self.repeat), self.size)
+        self.record("early_payments.list", timed(lambda: detect_early_payments(transactions, rules), self.repeat),
+                    self.size)
+
+    def bench_recurring(self):
+        from recurring import RecurringDetector
+        from txtable import TransactionTable
+
+        table = TransactionTable(generate_transactions(self.size, seed=1))
+        detector = RecurringDetector()
+        self.record("recurring.rebuild", timed(lambda: detector.rebuild(table), self.repeat), self.size)
+        # One day of new card spend plus a bill, as a sync would deliver it
+        batch = generate_household(seed=9, months=1)["transactions"][:20]
+        self.record("recurring.apply", timed(lambda: detector.apply(batch), self.repeat), len(batch))
+
+    def bench_forecast(self):
+        from forecast import FORECAST_MAX_DAYS, build_forecast
+        from recurring import RecurringDetector
+        from txtable import TransactionTable
+
+        # Forecast from the last day of the history, so its series are all live
+        end = date(2025, 6, 30)
+        household = generate_household(seed=4, months=max(1, self.size // 95), end=end)
+        table = TransactionTable(household["transactions"])
+        detector = RecurringDetector()
+        detector.rebuild(table)
+        as_of = end.toordinal()
+        self.record(
+            f"forecast.build_{FORECAST_MAX_DAYS}d",
+            timed(lambda: build_forecast(household["accounts"], table, detector, as_of), self.repeat),
+            accounts=len(household["accounts"]), series=len(detector.series()),
+        )
+
+    def bench_insights_history(self):
+        from datetime import timedelta
+        from insights_history import InsightsHistory
+
+        # A year of snapshots every two hours, downsampled as it goes
+        months = [f"{2020 + m // 12}-{m % 12 + 1:02d}" for m in range(max(1, self.size // 95 // 30))]
+        history = InsightsHistory()
+        times = (datetime(2024, 1, 1) + timedelta(hours=2 * i) for i in itertools.count())
+
+        def append():
+            at = next(times)
+            history.append({
+                "total_spending": at.hour * 10.0,
+                "spending_by_category": {f"category {i}": float(i + at.day) for i in range(20)},
+                "monthly_spending": {month: float(len(month) + at.day) for month in months},
+                "generated_at": at.isoformat(),
+            })
+
+        for _ in range(365 * 12):
+            append()
+        self.record("insights_history.append", timed(append, self.repeat), snapshots=len(history))
+        self.record("insights_history.recent_5", timed(lambda: history.recent(5), self.repeat))
+        self.record("insights_history.range_all", timed(lambda: history.range(fields=["total_spending"]), self.repeat),
+                    len(history))
+
+    def bench_store(self):
+        from journal import JournaledStore
+        from storage import TransactionStore
+
+        household = generate_household(seed=2, months=max(1, self.size // 95))
+        rows = len(household["transactions"])
+        paths = iter(os.path.join(self.workdir, f"store-{i}.db") for i in range(self.repeat + 1))
+
+        def import_fresh():
+            store = TransactionStore(next(paths))
+            store.import_user_data(household)
+            store.close()
+        self.record("store.import", timed(import_fresh, self.repeat), rows)
+
+        store = TransactionStore(os.path.join(self.workdir, "store-load.db"))
+        store.import_user_data(household)
+        self.record("store.load", timed(store.load, self.repeat), rows)
+
+        # Journaled writes: a 1000-row upsert batch journaled (what commit() waits for), then flushed
+        journaled = JournaledStore(store, os.path.join(self.workdir, "store-load.db.journal"))
+        batch = household["transactions"][:1000]
+        append = partial(journaled.apply_transaction_changes, batch, [])
+
+        def append_and_write():
+            append()
+            journaled._write_unwritten()
+        with _flusher_running(journaled):
+            self.record("store.journal_append", timed(append_and_write, self.repeat, setup=journaled.flush),
+                        len(batch))
+            self.record("store.flush", timed(journaled.flush, self.repeat, setup=append), len(batch))
+        journaled.close()
+
+    # Endpoints
+
+    def start_app(self):
+        household = generate_household(seed=3, months=max(1, self.size // 95), access_token="access-bench")
+        db_path = os.environ["USER_DATA_DB"]
+        from storage import TransactionStore
+        store = TransactionStore(db_path)
+        store.import_user_data(household)
+        store.close()
+
+        from fastapi.testclient import TestClient
+        from fake_plaid import FakePlaid
+        import main
+
+        self.main = main
+        self.fake = FakePlaid(latency=self.latency, page_size=self.page_size, months=max(1, self.size // 95))
+        main.set_plaid_client(self.fake)
+        self.client = TestClient(main.app)
+        self.client.__enter__()
+        self.client.get("/accounts")
+        self.partition = main.partitions.peek(main.DEFAULT_USER_ID)
+        return len(household["transactions"])
+
+    def get(self, path, **params):
+        response = self.client.get(path, params=params)
+        assert response.status_code == 200, (path, response.status_code)
+        return response
+
+    def bench_insights(self, rows):
+        partition = self.partition
+
+        def generate():
+            assert self.client.post("/generate_insights").status_code == 200
+        self.record("generate_insights.incremental", timed(generate, self.repeat), rows)
+
+        def cold():
+            # A new data version, so the analytics pool cannot answer from its cache either
+            partition.aggregator.reset()
+            partition.versions.bump("transactions")
+        self.record("generate_insights.rebuild", timed(generate, self.repeat, setup=cold), rows)
+
+    def bench_dashboard(self, rows):
+        invalidate = self.partition.versions.bump
+        self.record("dashboard.cold", timed(lambda: self.get("/dashboard"), self.repeat, setup=invalidate), rows)
+        self.record("dashboard.cached", timed(lambda: self.get("/dashboard"), self.repeat))
+
+    def bench_rollups(self, rows):
+        self.record("rollups.rebuild", timed(
+            lambda: self.partition.rollup_store(), self.repeat, setup=lambda: self.partition.rollups.reset()), rows)
+        self.record("rollups.month_by_category", timed(
+            lambda: self.get("/rollups", granularity="month", group_by="category"), self.repeat))
+        self.record("rollups.week_range", timed(
+            lambda: self.get("/rollups", granularity="week", start_date="2024-01-03", end_date="2025-02-17"),
+            self.repeat))
+        self.record("rollups.daily_merchant", timed(
+            lambda: self.get("/rollups", granularity="day", merchant="Starbucks", start_date="2025-01-01"),
+            self.repeat))
+
+    def bench_search(self, rows):
+        self.record("search.rebuild", timed(
+            lambda: self.partition.search(), self.repeat, setup=lambda: self.partition.search_index.reset()), rows)
+        for name, query in (("exact", "starbucks"), ("prefix", "sta"), ("fuzzy", "starbuks"), ("words", "whole foods")):
+            self.record(f"search.{name}", timed(lambda: self.get("/search", q=query, limit=50), self.repeat))
+
+    def bench_import(self, rows):
+        import json
+
+        body = "\n".join(json.dumps(t) for t in generate_transactions(self.size, seed=2)).encode()
+        users = iter(range(self.repeat + 1))
+        current = {}
+
+        def fresh_user():
+            current["headers"] = {"X-User-Id": f"bench-import-{next(users)}"}
+
+        def post():
+            response = self.client.post("/import_transactions", content=body, headers=current["headers"])
+            assert response.status_code == 200 and response.json()["added"] == self.size
+
+        self.record("import.ndjson", timed(post, self.repeat, setup=fresh_user), self.size)
+        self.record("export.csv", timed(
+            lambda: self.get("/transactions_adjusted", format="csv"), self.repeat), rows)
+
+    def bench_transactions_adjusted(self, rows):
+        invalidate = self.partition.versions.bump
+        self.record("transactions_adjusted.full_cold", timed(
+            lambda: self.get("/transactions_adjusted"), self.repeat, setup=invalidate), rows)
+        self.record("transactions_adjusted.full_cached", timed(
+            lambda: self.get("/transactions_adjusted"), self.repeat), rows)
+        self.record("transactions_adjusted.page_100", timed(
+            lambda: self.get("/transactions_adjusted", limit=100), self.repeat))
+        self.record("transactions_adjusted.filtered_page", timed(
+            lambda: self.get("/transactions_adjusted", limit=100, category="Restaurants"), self.repeat))
+        self.record("transactions_adjusted.ndjson", timed(
+            lambda: self.get("/transactions_adjusted", format="ndjson"), self.repeat), rows)
+
+    def bench_fetch(self):
+        """First sync of --tokens Items for a fresh user, through the fake Plaid API"""
+        users = iter(range(self.repeat + 1))
+        current = {}
+
+        def link_items():
+            user = f"bench-fetch-{next(users)}"
+            headers = {"X-User-Id": user}
+            for i in range(self.tokens):
+                response = self.client.post(
+                    "/exchange_public_token", json={"public_token": f"{user}-{i}"}, headers=headers,
+                )
+                assert response.status_code == 200
+            current["headers"] = headers
+
+        def fetch():
+            response = self.client.post("/fetch_transactions", headers=current["headers"])
+            assert response.status_code == 200
+            current["count"] = response.json()["count"]
+
+        before = self.fake.calls["transactions_sync"]
+        samples = timed(fetch, self.repeat, setup=link_items)
+        pages = (self.fake.calls["transactions_sync"] - before) / (self.repeat + 1)
+        self.record(f"fetch_transactions.sync_{self.tokens}_items", samples, current["count"],
+                    items=self.tokens, latency_s=self.latency, pages_per_run=pages)
+
+    def run(self, only):
+        def wanted(name):
+            return not only or any(name.startswith(o) for o in only)
+
+        if wanted("startup"):
+            self.bench_startup()
+        if wanted("early_payments"):
+            self.bench_early_payments()
+        if wanted("recurring"):
+            self.bench_recurring()
+        if wanted("forecast"):
+            self.bench_forecast()
+        if wanted("insights_history"):
+            self.bench_insights_history()
+        if wanted("store"):
+            self.bench_store()
+        if any(wanted(n) for n in ("generate_insights", "dashboard", "rollups", "search", "import", "export",
+                                   "transactions_adjusted", "fetch")):
+            rows = self.start_app()
+            if wanted("generate_insights"):
+                self.bench_insights(rows)
+            if wanted("dashboard"):
+                self.bench_dashboard(rows)
+            if wanted("rollups"):
+                self.bench_rollups(rows)
+            if wanted("search"):
+                self.bench_search(rows)
+            if wanted("import") or wanted("export"):
+                self.bench_import(rows)
+            if wanted("transactions_adjusted"):
+                self.bench_transactions_adjusted(rows)
+            if wanted("fetch"):
+                self.bench_fetch()
+            self.client.__exit__(None, None, None)
+
+        return {
+            "meta": {
+                "revision": git_revision(),
+                "timestamp": datetime.now(timezone.utc).isoformat(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                # Serialization-heavy results depend on whether orjson is installed
+                "json_encoder": JSON_ENCODER,
+                "size": self.size,
+                "repeat": self.repeat,
+                "tokens": self.tokens,
+                "latency_s": self.latency,
+                "page_size": self.page_size,
+            },
+            "results": self.results,
+        }
+
+
+@contextmanager
+def _flusher_running(journaled):
+    """Make writes queue up as they do under the background flusher, without starting it"""
+    journaled._task, journaled._wake = True, asyncio.Event()
+    try:
+        yield
+    finally:
+        journaled._task = journaled._wake = None
+
+
+def compare(current, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nvs {baseline_path} (revision {baseline['meta'].get('revision')})")
+    baseline_encoder = baseline["meta"].get("json_encoder")
+    if baseline_encoder and baseline_encoder != current["meta"]["json_encoder"]:
+        print(f"warning: JSON encoder differs ({baseline_encoder} -> {current['meta']['json_encoder']}); "
+              f"serialization timings are not comparable")
+    regressions = 0
+    for name, result in current["results"].items():
+        old = baseline["results"].get(name)
+        if not old:
+            continue
+        ratio = result["median_s"] / old["median_s"] if old["median_s"] else float("inf")
+        flag = "  REGRESSION" if ratio > REGRESSION_THRESHOLD else ""
+        regressions += bool(flag)
+        print(f"{name:<34} {old['median_s'] * 1000:9.2f} ms -> {result['median_s'] * 1000:9.2f} ms  "
+              f"x{ratio:5.2f}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=50_000, help="transactions per dataset")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--tokens", type=int, default=4, help="Items synced by the fetch benchmark")
+    parser.add_argument("--latency", type=float, default=0.02, help="fake Plaid latency per call, seconds")
+    parser.add_argument("--page-size", type=int, default=500, help="fake Plaid page size cap")
+    parser.add_argument("--only", default="", help="comma-separated benchmark name prefixes")
+    parser.add_argument("--output", help="write results JSON here")
+    parser.add_argument("--compare", help="earlier results JSON to compare against")
+    args = parser.parse_args()
+
+    only = [o for o in args.only.split(",") if o]
+    # The suite chdirs into its scratch directory
+    output = args.output and os.path.abspath(args.output)
+    baseline = args.compare and os.path.abspath(args.compare)
+    suite = Suite(args.size, args.repeat, args.tokens, args.latency, args.page_size)
+    print(f"JSON encoder: {JSON_ENCODER}" + ("" if JSON_ENCODER == "orjson" else " (orjson not installed)"))
+    results = suite.run(only)
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nWrote {output}")
+    if baseline:
+        sys.exit(1 if compare(results, baseline) else 0)
+
+
+if __name__ == "__main__":
+    main()
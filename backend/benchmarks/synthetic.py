@@ -0,0 +1,172 @@
+"""
+Seeded synthetic households for benchmarks and local runs.
+
+    from synthetic import generate_household
+    household = generate_household(seed=7, months=24)
+
+Transactions follow Plaid's sign convention (positive = money out) and look
+like a real checking/credit card history: biweekly payroll, a mortgage due
+on the 1st that posts on the last business day of the previous month when
+the 1st falls on a weekend (or occasionally a day or two early anyway),
+monthly subscriptions and bills, and daily card spending across a fixed
+merchant list. The same seed always produces the same household.
+"""
+import calendar
+import random
+from datetime import date, timedelta
+
+# (merchant, category, typical amount, spread)
+MERCHANTS = [
+    ("Starbucks", ["Food and Drink", "Restaurants", "Coffee Shop"], 6.5, 3.0),
+    ("Whole Foods", ["Shops", "Supermarkets and Groceries"], 85.0, 40.0),
+    ("Trader Joe's", ["Shops", "Supermarkets and Groceries"], 60.0, 25.0),
+    ("Shell", ["Travel", "Gas Stations"], 48.0, 15.0),
+    ("Uber", ["Travel", "Taxi"], 22.0, 12.0),
+    ("Amazon", ["Shops", "Digital Purchase"], 45.0, 35.0),
+    ("Target", ["Shops", "Department Stores"], 70.0, 40.0),
+    ("Chipotle", ["Food and Drink", "Restaurants"], 14.0, 4.0),
+    ("CVS Pharmacy", ["Shops", "Pharmacies"], 25.0, 15.0),
+    ("Home Depot", ["Shops", "Hardware Store"], 110.0, 80.0),
+    ("Delta Air Lines", ["Travel", "Airlines and Aviation Services"], 420.0, 150.0),
+    ("AMC Theatres", ["Recreation", "Arts and Entertainment"], 32.0, 10.0),
+]
+
+# (name, merchant, category, amount, day of month)
+MONTHLY_BILLS = [
+    ("Netflix Monthly Subscription", "Netflix", ["Service", "Subscription"], 15.49, 5),
+    ("Spotify Subscription", "Spotify", ["Service", "Subscription"], 10.99, 12),
+    ("PG&E Utility Bill", "PG&E", ["Service", "Utilities"], 140.0, 18),
+    ("Comcast Internet", "Comcast", ["Service", "Cable"], 79.99, 21),
+    ("State Farm Auto Insurance", "State Farm", ["Service", "Insurance"], 128.0, 9),
+]
+
+MORTGAGE_AMOUNT = 3416.03
+MORTGAGE_NAMES = ["Wells Fargo Home Mtg", "Quicken Loans Payment", "Mortgage Payment"]
+
+# Early payment rules matching the synthetic mortgage (the default configuration),
+# spelled out so benchmarks don't change when the default does
+EARLY_PAYMENT_RULES = {
+    "mortgage": {
+        "amount": MORTGAGE_AMOUNT,
+        "keywords": ["mortgage", "loan", "mtg", "home loan", "wells fargo home", "quicken"],
+        "days_early": 2,
+        "tolerance": 10.00,
+    },
+}
+
+
+def _month_starts(start, months):
+    year, month = start.year, start.month
+    for _ in range(months):
+        yield year, month
+        month += 1
+        if month > 12:
+            year, month = year + 1, 1
+
+
+def generate_household(seed=0, months=24, card_tx_per_day=3.0, accounts=3, end=date(2025, 6, 30),
+                       access_token="access-synthetic"):
+    """
+    Return {"access_tokens", "accounts", "transactions", "insights"} in the
+    shape the store imports. Roughly 30 * card_tx_per_day + 10 transactions
+    per month.
+    """
+    rng = random.Random(seed)
+    first = end.year * 12 + end.month - 1 - (months - 1)
+    start = date(first // 12, first % 12 + 1, 1)
+    prefix = f"s{seed}"
+
+    account_list = [
+        {"account_id": f"{prefix}_checking", "name": "Plaid Checking", "type": "depository",
+         "subtype": "checking", "balance": round(rng.uniform(2000, 15000), 2), "access_token": access_token},
+        {"account_id": f"{prefix}_credit", "name": "Plaid Credit Card", "type": "credit",
+         "subtype": "credit card", "balance": round(rng.uniform(200, 4000), 2), "access_token": access_token},
+    ]
+    for i in range(2, accounts):
+        account_list.append({
+            "account_id": f"{prefix}_savings{i}", "name": f"Plaid Saving {i}", "type": "depository",
+            "subtype": "savings", "balance": round(rng.uniform(5000, 50000), 2), "access_token": access_token,
+        })
+    checking, credit = account_list[0]["account_id"], account_list[1]["account_id"]
+
+    transactions = []
+
+    def add(day, amount, name, merchant, category, account_id):
+        if day > end:
+            return
+        transactions.append({
+            "transaction_id": f"{prefix}_tx_{len(transactions)}",
+            "account_id": account_id,
+            "amount": round(amount, 2),
+            "date": day.isoformat(),
+            "name": name,
+            "category": list(category),
+            "merchant_name": merchant,
+        })
+
+    # Biweekly payroll into checking
+    payday = start + timedelta(days=rng.randrange(14))
+    salary = round(rng.uniform(2500, 4500), 2)
+    while payday <= end:
+        add(payday, -salary, "Payroll Deposit ACME Corp", None, ["Transfer", "Payroll"], checking)
+        payday += timedelta(days=14)
+
+    mortgage_name = rng.choice(MORTGAGE_NAMES)
+    for year, month in _month_starts(start, months):
+        days_in_month = calendar.monthrange(year, month)[1]
+
+        # Mortgage due on the 1st; a weekend due date (or, now and then, the
+        # payer) pulls it into the last days of the previous month
+        mortgage_day = date(year, month, 1)
+        if mortgage_day.weekday() >= 5:
+            mortgage_day -= timedelta(days=mortgage_day.weekday() - 4)
+        elif rng.random() < 0.1:
+            mortgage_day -= timedelta(days=rng.randrange(1, 3))
+        if mortgage_day >= start:
+            add(mortgage_day, MORTGAGE_AMOUNT + rng.uniform(-5, 5), mortgage_name, None,
+                ["Payment", "Mortgage"], checking)
+
+        for name, merchant, category, amount, day in MONTHLY_BILLS:
+            add(date(year, month, min(day, days_in_month)), amount, name, merchant, category, credit)
+
+        # Daily card spending
+        for d in range(days_in_month):
+            day = date(year, month, d + 1)
+            for _ in range(_poisson(rng, card_tx_per_day)):
+                merchant, category, typical, spread = rng.choice(MERCHANTS)
+                amount = max(1.0, rng.gauss(typical, spread / 2))
+                add(day, amount, merchant.upper() + f" #{rng.randrange(1000, 9999)}", merchant, category, credit)
+
+        # Occasional refund
+        if rng.random() < 0.3:
+            merchant, category, typical, _ = rng.choice(MERCHANTS)
+            add(date(year, month, rng.randrange(1, days_in_month + 1)), -typical, f"{merchant} Refund",
+                merchant, category, credit)
+
+    return {
+        "access_tokens": [access_token],
+        "accounts": account_list,
+        "transactions": transactions,
+        "insights": [],
+    }
+
+
+def _poisson(rng, mean):
+    # Knuth's method; fine for the small means used here
+    threshold, k, p = pow(2.718281828459045, -mean), 0, 1.0
+    while True:
+        p *= rng.random()
+        if p <= threshold:
+            return k
+        k += 1
+
+
+def generate_transactions(n, seed=0):
+    """About n transactions from one household, trimmed to exactly n"""
+    # A month averages just under 100 rows; aim a little high so one pass is enough
+    months = max(1, round(n / 95) + 1)
+    transactions = generate_household(seed=seed, months=months)["transactions"]
+    while len(transactions) < n:
+        months = int(months * n / max(1, len(transactions))) + 1
+        transactions = generate_household(seed=seed, months=months)["transactions"]
+    return transactions[:n]
@@ -0,0 +1,242 @@
+import codecs
+import csv
+import hashlib
+import io
+import json
+import math
+import os
+from datetime import date, datetime
+
+IMPORT_FORMATS = ("ndjson", "csv")
+# Parsed transactions are applied in chunks of this many
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "5000"))
+# Rows without an account column are filed under this account
+DEFAULT_IMPORT_ACCOUNT = "imported"
+# Rejected rows beyond this many are counted but not described
+MAX_IMPORT_ERRORS = 20
+# Larger amounts are rejected as garbage; far bigger ones would overflow the cent totals
+MAX_IMPORT_AMOUNT = 1e12
+
+# Field -> accepted column names, first non-empty wins. Covers our own
+# exports, common bank CSVs and OFX statements converted to CSV.
+COLUMN_ALIASES = {
+    "transaction_id": ("transaction_id", "id", "fitid"),
+    "account_id": ("account_id", "account"),
+    # original_date first, so re-importing an export keeps the posted date
+    "date": ("original_date", "date", "posted_date", "posting_date", "transaction_date", "dtposted"),
+    "amount": ("amount", "trnamt"),
+    "debit": ("debit", "withdrawal"),
+    "credit": ("credit", "deposit"),
+    "name": ("name", "description", "payee", "memo"),
+    "merchant_name": ("merchant_name", "merchant"),
+    "category": ("category", "categories"),
+}
+
+
+def _first(record, field):
+    for column in COLUMN_ALIASES[field]:
+        value = record.get(column)
+        if value not in (None, ""):
+            return value
+    return None
+
+
+def _valid_amount(amount):
+    return math.isfinite(amount) and abs(amount) < MAX_IMPORT_AMOUNT
+
+
+def parse_amount(value):
+    """12.5, "1,234.56", "$12.50" or "(12.50)" (negative) -> float; raises ValueError for nan, inf and absurd sizes"""
+    if isinstance(value, bool):
+        raise ValueError(f"invalid amount {value!r}")
+    if isinstance(value, (int, float)):
+        amount = float(value)
+    elif isinstance(value, str):
+        text = value.strip().replace(",", "").replace("$", "")
+        if text.startswith("(") and text.endswith(")"):
+            text = "-" + text[1:-1]
+        amount = float(text)
+    else:
+        raise ValueError(f"invalid amount {value!r}")
+    # float() takes "nan" and "inf" (and json.loads NaN/Infinity), which no store or total can hold
+    if not _valid_amount(amount):
+        raise ValueError(f"invalid amount {value!r}")
+    return amount
+
+
+def parse_date(value, date_format=None):
+    """YYYY-MM-DD (or a datetime starting with it), OFX YYYYMMDD..., or date_format -> YYYY-MM-DD"""
+    text = value.strip()
+    if date_format:
+        return datetime.strptime(text, date_format).date().isoformat()
+    if len(text) >= 8 and text[:8].isdigit():
+        return date(int(text[:4]), int(text[4:6]), int(text[6:8])).isoformat()
+    return date.fromisoformat(text[:10]).isoformat()
+
+
+def parse_category(value):
+    if not value:
+        return []
+    if isinstance(value, list):
+        return [str(c) for c in value]
+    if not isinstance(value, str):
+        raise ValueError(f"invalid category {value!r}")
+    return [part.strip() for part in value.split(";") if part.strip()]
+
+
+def content_id(content, occurrence):
+    """
+    Stable id for a row without one, from its content digest. Identical rows
+    in one file (two coffees on the same day) are told apart by their
+    occurrence number, so importing the same file twice yields the same ids
+    and nothing is duplicated.
+    """
+    return "import-" + hashlib.sha1(content + str(occurrence).encode()).hexdigest()[:24]
+
+
+class RecordParser:
+    """
+    Incremental parser for uploaded transaction files.
+
+    feed() takes bytes (UTF-8) or text as it arrives and returns the
+    transactions completed by it, so nothing but the current partial record
+    is buffered. NDJSON has one JSON object per line; CSV needs a header row
+    and may have quoted fields spanning lines. Each row becomes a transaction
+    dict in the shape Plaid syncs produce (positive amounts are money out;
+    negate=True flips files where spending is negative). Bad rows are counted
+    and the first MAX_IMPORT_ERRORS described in errors, without stopping the
+    import.
+    """
+
+    def __init__(self, format="ndjson", account_id=DEFAULT_IMPORT_ACCOUNT, date_format=None, negate=False):
+        if format not in IMPORT_FORMATS:
+            raise ValueError(f"format must be one of {', '.join(IMPORT_FORMATS)}")
+        self.format = format
+        self.account_id = account_id
+        self.date_format = date_format
+        self.negate = negate
+        self.records = 0
+        self.rejected = 0
+        self.errors = []
+        self._decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+        self._buffer = ""
+        self._header = None
+        # Content digest of rows without an id -> how many were seen, for occurrence numbers
+        self._occurrences = {}
+
+    def feed(self, data):
+        self._buffer += self._decoder.decode(data) if isinstance(data, bytes) else data
+        end = self._complete_end(self._buffer)
+        if end == 0:
+            return []
+        complete, self._buffer = self._buffer[:end], self._buffer[end:]
+        return self._parse(complete)
+
+    def close(self):
+        """Parse whatever is left once the input ends"""
+        rest, self._buffer = self._buffer + self._decoder.decode(b"", final=True), ""
+        return self._parse(rest) if rest.strip() else []
+
+    def _complete_end(self, buffer):
+        """Length of the prefix of buffer made of whole records"""
+        if self.format == "ndjson":
+            return buffer.rfind("\n") + 1
+        # A CSV record ends at a newline outside quotes: an even number of quotes so far
+        end, offset, quoted = 0, 0, False
+        for line in buffer.split("\n")[:-1]:
+            offset += len(line) + 1
+            if line.count('"') % 2:
+                quoted = not quoted
+            if not quoted:
+                end = offset
+        return end
+
+    def _rows(self, text):
+        """Raw records in text as dicts of column -> value (or the error parsing one)"""
+        if self.format == "ndjson":
+            for line in text.splitlines():
+                if line.strip():
+                    try:
+                        yield json.loads(line)
+                    except ValueError as e:
+                        yield e
+            return
+        for row in csv.reader(io.StringIO(text)):
+            if not row:
+                continue
+            if self._header is None:
+                self._header = [column.strip().lower() for column in row]
+                continue
+            yield dict(zip(self._header, row))
+
+    def _parse(self, text):
+        transactions = []
+        for row in self._rows(text):
+            self.records += 1
+            try:
+                if isinstance(row, Exception):
+                    raise row
+                if not isinstance(row, dict):
+                    raise ValueError("record is not an object")
+                transactions.append(self.normalize(row))
+            except (ValueError, TypeError) as e:
+                self.rejected += 1
+                if len(self.errors) < MAX_IMPORT_ERRORS:
+                    self.errors.append({"record": self.records, "error": str(e)})
+        return transactions
+
+    def normalize(self, row):
+        """One raw record -> transaction dict; raises ValueError when it is unusable"""
+        date_value = _first(row, "date")
+        name = _first(row, "name")
+        if date_value is None or name is None:
+            raise ValueError("missing date or name")
+        amount_value = _first(row, "amount")
+        if amount_value is not None:
+            amount = parse_amount(amount_value)
+        else:
+            debit, credit = _first(row, "debit"), _first(row, "credit")
+            if debit is None and credit is None:
+                raise ValueError("missing amount")
+            amount = (parse_amount(debit) if debit is not None else 0.0) - (
+                parse_amount(credit) if credit is not None else 0.0)
+        if self.negate:
+            amount = -amount
+        if not _valid_amount(amount):
+            # A debit and a credit that are each fine can still add up to too much
+            raise ValueError("invalid amount")
+
+        merchant_name = _first(row, "merchant_name")
+        transaction = {
+            "transaction_id": None,
+            "account_id": str(_first(row, "account_id") or self.account_id),
+            "amount": round(amount, 2),
+            "date": parse_date(str(date_value), self.date_format),
+            "name": str(name).strip(),
+            "category": parse_category(_first(row, "category")),
+            "merchant_name": None if merchant_name is None else str(merchant_name),
+        }
+        transaction_id = _first(row, "transaction_id")
+        if transaction_id is None:
+            content = hashlib.sha1(
+                f"{transaction['account_id']}|{transaction['date']}|{transaction['amount']:.2f}|"
+                f"{transaction['name']}".encode()
+            ).digest()
+            occurrence = self._occurrences.get(content, 0)
+            self._occurrences[content] = occurrence + 1
+            transaction_id = content_id(content, occurrence)
+        transaction["transaction_id"] = str(transaction_id)
+        return transaction
+
+
+def parse_stream(parser, pieces, size=IMPORT_CHUNK_SIZE):
+    """Yield lists of up to size transactions parsed from an iterable of bytes/text pieces"""
+    pending = []
+    for piece in pieces:
+        pending.extend(parser.feed(piece))
+        while len(pending) >= size:
+            yield pending[:size]
+            del pending[:size]
+    pending.extend(parser.close())
+    if pending:
+        yield pending
@@ -0,0 +1,243 @@
+import calendar
+import re
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+from logs import get_logger
+from txtable import AdjustedTransactions, TransactionTable
+
+log = get_logger("early_payments")
+
+
+def configure_early_payments():
+    """
+    Return configuration for your specific early payments.
+    You can customize this based on your needs.
+
+    Recurring payments without a rule here (rent, bills, payroll) are still
+    found and moved to their intended month by recurring.RecurringDetector,
+    which runs on top of these rules. A configured rule wins over a detected
+    adjustment.
+    """
+    return {
+        "mortgage": {
+            "amount": 3416.03,
+            "keywords": ["mortgage", "loan", "mtg", "home loan", "wells fargo home", "quicken"],
+            "days_early": 2,
+            "tolerance": 10.00  # Allow $10 difference
+        },
+        # Add other recurring early payments here
+        # "car_payment": {
+        #     "amount": 450.00,
+        #     "keywords": ["auto loan", "car payment"],
+        #     "days_early": 3,
+        #     "tolerance": 5.00
+        # }
+    }
+
+
+def is_early_payment(transaction, config):
+    """
+    Check if a transaction matches the criteria for an early payment.
+    """
+    # Check amount (within tolerance)
+    amount_match = abs(transaction['amount'] - config['amount']) <= config.get('tolerance', 0)
+
+    # Check if transaction name contains any of the keywords
+    name_lower = transaction['name'].lower()
+    keyword_match = any(keyword in name_lower for keyword in config['keywords'])
+
+    # Check if it's near the end of the month (likely early payment for next month)
+    day, days_in_month = _day_and_month_length(transaction['date'])
+    is_end_of_month = day >= (days_in_month - config['days_early'])
+
+    return amount_match and keyword_match and is_end_of_month
+
+
+@lru_cache(maxsize=8192)
+def _day_and_month_length(date_str):
+    """Parse a YYYY-MM-DD date once; histories only have a few thousand distinct dates"""
+    parsed = datetime.strptime(date_str, '%Y-%m-%d')
+    return parsed.day, calendar.monthrange(parsed.year, parsed.month)[1]
+
+
+@lru_cache(maxsize=8192)
+def _shift_date(date_str, days):
+    return (datetime.strptime(date_str, '%Y-%m-%d') + timedelta(days=days)).strftime('%Y-%m-%d')
+
+
+def _prefix_mask(keyword_configs, keyword):
+    """OR together the config bits of every keyword that is a prefix of `keyword`"""
+    mask = 0
+    for other, other_mask in keyword_configs.items():
+        if keyword.startswith(other):
+            mask |= other_mask
+    return mask
+
+
+class CompiledPaymentRules:
+    """
+    Early payment configs compiled once into flat columns and one keyword regex.
+
+    All keywords from all configs go into a single alternation, scanned with a
+    lookahead so every start position is tried. Alternatives are ordered
+    longest first, so at each position the regex reports the longest keyword
+    that matches there; every other keyword matching at that position is a
+    prefix of it, which is why each keyword maps to the configs of all its
+    prefixes. The result per name is a bitmask of configs whose keywords occur,
+    identical to running `any(keyword in name ...)` per config.
+    """
+
+    def __init__(self, known_payments):
+        # The configuration as given, so it can be handed to other processes
+        self.known_payments = known_payments
+        self.payment_types = list(known_payments.keys())
+        configs = list(known_payments.values())
+        self.amounts = [c['amount'] for c in configs]
+        self.tolerances = [c.get('tolerance', 0) for c in configs]
+        self.days_early = [c['days_early'] for c in configs]
+        self.keywords = [list(c['keywords']) for c in configs]
+
+        keyword_configs = {}
+        for ci, config in enumerate(configs):
+            for keyword in config['keywords']:
+                keyword_configs[keyword] = keyword_configs.get(keyword, 0) | (1 << ci)
+        # Empty keywords match every name, like `"" in name` does
+        self._always = keyword_configs.pop("", 0)
+        self._keyword_masks = {
+            keyword: self._always | _prefix_mask(keyword_configs, keyword)
+            for keyword in keyword_configs
+        }
+        ordered = sorted(keyword_configs, key=len, reverse=True)
+        self._pattern = re.compile("(?=(" + "|".join(re.escape(k) for k in ordered) + "))") if ordered else None
+        self.keyword_mask = lru_cache(maxsize=65536)(self._keyword_mask)
+
+    def _keyword_mask(self, name_lower):
+        mask = self._always
+        if self._pattern is not None:
+            for match in self._pattern.finditer(name_lower):
+                mask |= self._keyword_masks[match.group(1)]
+        return mask
+
+    def match(self, transactions, index=None):
+        """
+        Return {row index: config index} for every early payment, using the
+        first matching config per row like the original per-row loop.
+
+        With a SearchIndex over the same transactions, keyword checks are
+        answered from the index (the names containing a keyword) instead of
+        scanning names.
+        """
+        if not self.payment_types:
+            return {}
+        if isinstance(transactions, TransactionTable):
+            amounts = transactions.amounts()
+        else:
+            amounts = [t['amount'] for t in transactions]
+        matches = {}
+        for ci in range(len(self.payment_types)):
+            target, tolerance, days_early, bit = self.amounts[ci], self.tolerances[ci], self.days_early[ci], 1 << ci
+            # Amount tolerance over the whole column first: by far the most selective check
+            candidates = [i for i, amount in enumerate(amounts) if abs(amount - target) <= tolerance]
+            keyword_names = None
+            if index is not None and candidates:
+                keyword_names = set().union(*(index.names_containing(keyword) for keyword in self.keywords[ci]))
+            for i in candidates:
+                if i in matches:
+                    continue
+                transaction = transactions[i]
+                if keyword_names is not None:
+                    if transaction['name'] not in keyword_names:
+                        continue
+                elif not self.keyword_mask(transaction['name'].lower()) & bit:
+                    continue
+                day, days_in_month = _day_and_month_length(transaction['date'])
+                if day >= days_in_month - days_early:
+                    matches[i] = ci
+        return matches
+
+
+_default_rules = None
+_rules_version = 0
+
+
+def default_rules():
+    global _default_rules
+    if _default_rules is None:
+        _default_rules = CompiledPaymentRules(configure_early_payments())
+    return _default_rules
+
+
+def set_early_payment_config(known_payments):
+    """Replace the default early payment configuration used by detect_early_payments"""
+    global _default_rules, _rules_version
+    _default_rules = CompiledPaymentRules(known_payments)
+    _rules_version += 1
+
+
+def rules_version():
+    """Bumped whenever the default configuration changes, for cache keys"""
+    return _rules_version
+
+
+def detect_early_payments(transactions, known_payments=None, detected=None, index=None):
+    """
+    Detect and adjust early payments to their intended month.
+
+    Unadjusted transactions are returned as-is rather than copied, so callers
+    must treat the result as read-only. A TransactionTable comes back as an
+    AdjustedTransactions overlay view.
+
+    Args:
+        transactions: List of transaction dictionaries
+        known_payments: Dict of known early payments with patterns and amounts
+        detected: {transaction_id: (days, payment_type)} from RecurringDetector
+        index: SearchIndex over the same transactions, for keyword lookups
+    """
+    rules = default_rules() if known_payments is None else CompiledPaymentRules(known_payments)
+    matches = rules.match(transactions, index)
+    detected = detected or {}
+    if matches or detected:
+        log.debug("early_payments_adjusted", configured=len(matches), detected=len(detected),
+                  transactions=len(transactions))
+
+    if isinstance(transactions, TransactionTable):
+        # Adjustments become an overlay on the table instead of copied rows
+        overlay = {}
+        for transaction_id, adjustment in detected.items():
+            row = transactions.row_number(transaction_id)
+            if row is not None:
+                overlay[row] = adjustment
+        order = transactions.order()
+        for i, ci in matches.items():
+            overlay[order[i]] = (rules.days_early[ci], rules.payment_types[ci])
+        return AdjustedTransactions(transactions, overlay)
+
+    adjusted_transactions = list(transactions)
+    if detected:
+        for i, transaction in enumerate(transactions):
+            adjustment = detected.get(transaction['transaction_id'])
+            if adjustment is not None:
+                adjusted_transactions[i] = _adjusted_copy(transaction, *adjustment)
+    for i, ci in matches.items():
+        adjusted_transactions[i] = _adjusted_copy(transactions[i], rules.days_early[ci], rules.payment_types[ci])
+    return adjusted_transactions
+
+
+def adjust_transaction(transaction, detected=None):
+    """Apply the default early payment rules, then any detected adjustment, to a single transaction"""
+    rules = default_rules()
+    matches = rules.match([transaction])
+    if matches:
+        return _adjusted_copy(transaction, rules.days_early[matches[0]], rules.payment_types[matches[0]])
+    adjustment = detected.get(transaction['transaction_id']) if detected else None
+    return _adjusted_copy(transaction, *adjustment) if adjustment else transaction
+
+
+def _adjusted_copy(transaction, days, payment_type):
+    adjusted_transaction = transaction.copy()
+    adjusted_transaction['date'] = _shift_date(transaction['date'], days)
+    adjusted_transaction['original_date'] = transaction['date']
+    adjusted_transaction['payment_type'] = payment_type
+    adjusted_transaction['date_adjusted'] = True
+    return adjusted_transaction
@@ -0,0 +1,179 @@
+import calendar
+import math
+import os
+from datetime import date
+from itertools import accumulate
+from operator import add
+
+from recurring import PERIODS, RECURRING_MAX_SHIFT_DAYS
+from txtable import date_to_day, day_to_date
+
+# Longest forecast, in days; shorter ones are served as slices of it
+FORECAST_MAX_DAYS = int(os.getenv("FORECAST_MAX_DAYS", "90"))
+# Whole weeks of history before the forecast that discretionary spend is modelled on
+FORECAST_LOOKBACK_WEEKS = int(os.getenv("FORECAST_LOOKBACK_WEEKS", "13"))
+# A series with no posting for this many of its periods is taken to have ended
+LAPSED_PERIODS = 2
+# Half-width of the band around the expected balance, in standard deviations (an 80% interval)
+BAND_Z = 1.2816
+# Account types whose balance is money owed, so spending raises it
+LIABILITY_TYPES = ("credit", "loan")
+
+NOMINAL_DAYS = {period: nominal for period, nominal, _ in PERIODS}
+_NO_FLOW = (0.0,) * 7
+
+
+def _weekday(day):
+    # Ordinal 1 (0001-01-01) was a Monday
+    return (day - 1) % 7
+
+
+def _next_month(day, anchor):
+    """The day with day-of-month anchor (clamped to the month's length) in the month after day's"""
+    d = date.fromordinal(day)
+    year, month = (d.year + 1, 1) if d.month == 12 else (d.year, d.month + 1)
+    return date(year, month, min(anchor, calendar.monthrange(year, month)[1])).toordinal()
+
+
+def series_occurrences(series, first_day, end_day):
+    """Days in first_day..end_day (exclusive) a detected recurring series is expected to post on"""
+    period = series["period"]
+    nominal = NOMINAL_DAYS[period]
+    if first_day - date_to_day(series["last_date"]) > LAPSED_PERIODS * nominal:
+        return []
+    due = date_to_day(series["next_expected_date"])
+    anchor = date.fromordinal(due).day
+    days = []
+    while due < end_day:
+        if due >= first_day:
+            days.append(due)
+        elif first_day - due <= RECURRING_MAX_SHIFT_DAYS:
+            # Overdue by no more than a late posting usually is: still expected, right away
+            days.append(first_day)
+        due = _next_month(due, anchor) if period == "monthly" else due + nominal
+    return days
+
+
+def discretionary_model(table, is_recurring, as_of, weeks=FORECAST_LOOKBACK_WEEKS):
+    """
+    {account_id: (means, variances)} of each account's daily net flow from
+    transactions outside any recurring series, by weekday (Monday first),
+    over the `weeks` whole weeks before as_of.
+
+    Every day of the window counts, quiet ones as zero, so a mean is the
+    expected amount on any such day. One pass over the window's rows fills a
+    per-account column of daily totals; each weekday is then a stride of it.
+    """
+    first = as_of - 7 * weeks
+    totals = {}
+    for transaction_id, account_id, day, amount in table.window(first):
+        if day >= as_of or is_recurring(transaction_id):
+            continue
+        column = totals.get(account_id)
+        if column is None:
+            column = totals[account_id] = [0.0] * (7 * weeks)
+        column[day - first] += amount
+    model = {}
+    for account_id, column in totals.items():
+        means, variances = [0.0] * 7, [0.0] * 7
+        for offset in range(7):
+            values = column[offset::7]
+            mean = sum(values) / weeks
+            means[_weekday(first + offset)] = mean
+            variances[_weekday(first + offset)] = sum((v - mean) ** 2 for v in values) / weeks
+        model[account_id] = (means, variances)
+    return model
+
+
+def build_forecast(accounts, table, recurring, as_of, days=FORECAST_MAX_DAYS):
+    """
+    Project each account's daily closing balance over the `days` days after
+    as_of (a day ordinal; the accounts' balances are taken as of its close).
+
+    A day's change is the recurring series expected to post on it (from
+    RecurringDetector, each on the account of its latest posting) plus the
+    discretionary model's mean for that weekday. The band widens with the
+    accumulated variance of the discretionary flow. Amounts follow Plaid's
+    sign convention, so money out lowers an asset's balance and raises a
+    liability's. Pass the result through trim() before serving it.
+    """
+    start, end = as_of + 1, as_of + 1 + days
+    model = discretionary_model(table, recurring.is_recurring, as_of)
+
+    scheduled, events = {}, []
+    for series in recurring.series():
+        posting = table.get(series["last_transaction_id"])
+        if posting is None:
+            continue
+        account_id = posting.account_id
+        flows = scheduled.setdefault(account_id, {})
+        for day in series_occurrences(series, start, end):
+            flows[day] = flows.get(day, 0.0) + series["amount"]
+            events.append({
+                "date": day_to_date(day), "account_id": account_id, "series_id": series["series_id"],
+                "name": series["name"], "amount": series["amount"],
+            })
+    events.sort(key=lambda e: (e["date"], e["series_id"]))
+
+    span = range(start, end)
+    dates = [day_to_date(day) for day in span]
+    weekdays = [_weekday(day) for day in span]
+    forecasts = []
+    net_balance, net_variance = [0.0] * days, [0.0] * days
+    for account in accounts:
+        account_id = account["account_id"]
+        sign = 1 if account["type"] in LIABILITY_TYPES else -1
+        means, variances = model.get(account_id, (_NO_FLOW, _NO_FLOW))
+        flows = scheduled.get(account_id, {})
+        recurring_flow = [sign * flows.get(day, 0.0) for day in span]
+        discretionary_flow = [sign * means[w] for w in weekdays]
+        balances = list(accumulate(map(add, recurring_flow, discretionary_flow), initial=account["balance"]))[1:]
+        variance = list(accumulate(variances[w] for w in weekdays))
+        # Net worth counts liabilities against assets
+        net_balance = list(map(add, net_balance, (-sign * b for b in balances)))
+        net_variance = list(map(add, net_variance, variance))
+        forecasts.append({
+            "account_id": account_id,
+            "name": account["name"],
+            "type": account["type"],
+            "balance": account["balance"],
+            "daily": [
+                {"date": d, "balance": round(b, 2), "low": round(b - BAND_Z * math.sqrt(v), 2),
+                 "high": round(b + BAND_Z * math.sqrt(v), 2), "recurring": round(r, 2), "discretionary": round(x, 2)}
+                for d, b, v, r, x in zip(dates, balances, variance, recurring_flow, discretionary_flow)
+            ],
+        })
+    return {
+        "as_of": day_to_date(as_of),
+        "accounts": forecasts,
+        "net": [
+            {"date": d, "balance": round(b, 2), "low": round(b - BAND_Z * math.sqrt(v), 2),
+             "high": round(b + BAND_Z * math.sqrt(v), 2)}
+            for d, b, v in zip(dates, net_balance, net_variance)
+        ],
+        "events": events,
+    }
+
+
+def trim(forecast, days):
+    """The first `days` days of a build_forecast() result, with per-account summaries"""
+    accounts = []
+    for account in forecast["accounts"]:
+        daily = account["daily"][:days]
+        lowest = min(daily, key=lambda d: d["balance"]) if daily else None
+        accounts.append({
+            **account,
+            "end_balance": daily[-1]["balance"] if daily else account["balance"],
+            "min_balance": lowest["balance"] if lowest else account["balance"],
+            "min_balance_date": lowest["date"] if lowest else None,
+            "daily": daily,
+        })
+    net = forecast["net"][:days]
+    last = net[-1]["date"] if net else forecast["as_of"]
+    return {
+        "as_of": forecast["as_of"],
+        "days": len(net),
+        "accounts": accounts,
+        "net": net,
+        "events": [event for event in forecast["events"] if event["date"] <= last],
+    }
@@ -0,0 +1,305 @@
+import json
+import os
+from bisect import bisect_left, bisect_right
+from datetime import date, datetime, timedelta
+
+# Every this many snapshots one is stored whole, so rebuilding any snapshot
+# applies at most this many deltas
+INSIGHTS_KEYFRAME_EVERY = int(os.getenv("INSIGHTS_KEYFRAME_EVERY", "24"))
+# Comma-separated max_age:resolution tiers (units s, m, h, d). Snapshots
+# younger than a tier's max age are kept at one per resolution window (the
+# latest in it; 0 keeps all); snapshots older than the last tier are dropped.
+# Ages are measured from the newest snapshot.
+INSIGHTS_RETENTION = os.getenv("INSIGHTS_RETENTION", "1d:0,30d:1h,365d:1d,1825d:7d")
+# Hard cap on stored snapshots, oldest dropped first
+INSIGHTS_MAX_SNAPSHOTS = int(os.getenv("INSIGHTS_MAX_SNAPSHOTS", "2000"))
+
+FULL, DELTA = "full", "delta"
+UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+EPOCH = datetime(1970, 1, 1)
+_MISSING = object()
+
+
+def parse_retention(spec):
+    """[(max age, resolution)] in seconds from an INSIGHTS_RETENTION string"""
+    def seconds(value):
+        value = value.strip()
+        if value == "0":
+            return 0
+        return float(value[:-1]) * UNITS[value[-1]]
+
+    tiers = []
+    for tier in spec.split(","):
+        if tier.strip():
+            max_age, resolution = tier.split(":")
+            tiers.append((seconds(max_age), seconds(resolution)))
+    return sorted(tiers)
+
+
+def _seconds(timestamp):
+    return (datetime.fromisoformat(timestamp) - EPOCH).total_seconds()
+
+
+# Deltas: {"set": {key: value}, "del": [key], "maps": {key: delta}}, with
+# "maps" holding nested deltas for dict values present on both sides, so a
+# single changed category only costs that entry. Empty parts are left out.
+
+def _delta(sets, deletes, maps):
+    delta = {}
+    if sets:
+        delta["set"] = sets
+    if deletes:
+        delta["del"] = sorted(deletes)
+    if maps:
+        delta["maps"] = maps
+    return delta
+
+
+def diff(previous, current):
+    """Delta turning previous into current"""
+    sets, maps = {}, {}
+    for key, value in current.items():
+        old = previous.get(key, _MISSING)
+        if old == value:
+            continue
+        if isinstance(old, dict) and isinstance(value, dict):
+            maps[key] = diff(old, value)
+        else:
+            sets[key] = value
+    return _delta(sets, [key for key in previous if key not in current], maps)
+
+
+def patch(snapshot, delta):
+    """A new snapshot: snapshot with delta applied (snapshot itself is left alone)"""
+    result = dict(snapshot)
+    for key in delta.get("del", ()):
+        result.pop(key, None)
+    result.update(delta.get("set", {}))
+    for key, inner in delta.get("maps", {}).items():
+        result[key] = patch(result.get(key, {}), inner)
+    return result
+
+
+def compose(first, second):
+    """One delta doing what applying first and then second does"""
+    sets = dict(first.get("set", {}))
+    deletes = set(first.get("del", ()))
+    maps = dict(first.get("maps", {}))
+    for key in second.get("del", ()):
+        sets.pop(key, None)
+        maps.pop(key, None)
+        deletes.add(key)
+    for key, value in second.get("set", {}).items():
+        sets[key] = value
+        maps.pop(key, None)
+        deletes.discard(key)
+    for key, inner in second.get("maps", {}).items():
+        if key in sets:
+            sets[key] = patch(sets[key], inner)
+        elif key in maps:
+            maps[key] = compose(maps[key], inner)
+        else:
+            maps[key] = inner
+    return _delta(sets, deletes, maps)
+
+
+class InsightsHistory:
+    """
+    Every generated insights snapshot still retained, oldest first, stored
+    as deltas against the one before with a whole snapshot every
+    INSIGHTS_KEYFRAME_EVERY.
+
+    append() downsamples older snapshots per the retention tiers and the
+    cap, so the history (and what is persisted of it) stays bounded however
+    often insights are generated. Removing a snapshot folds its delta into
+    the next one, so nothing else has to be rebuilt. Changes are returned as
+    (rows, removed) for the store: rows are (generated_at, kind, payload)
+    to upsert, removed the generated_at values to delete.
+    """
+
+    def __init__(self, rows=(), keyframe_every=INSIGHTS_KEYFRAME_EVERY, retention=INSIGHTS_RETENTION,
+                 max_snapshots=INSIGHTS_MAX_SNAPSHOTS):
+        self.keyframe_every = keyframe_every
+        self.tiers = parse_retention(retention)
+        self.max_snapshots = max_snapshots
+        self.times = []
+        self.seconds = []
+        self.kinds = []
+        self.payloads = []
+        self._latest = None
+        for generated_at, kind, payload in rows:
+            self.times.append(generated_at)
+            self.seconds.append(_seconds(generated_at))
+            self.kinds.append(kind)
+            self.payloads.append(payload)
+
+    def __len__(self):
+        return len(self.times)
+
+    def __bool__(self):
+        return bool(self.times)
+
+    def rows(self):
+        return list(zip(self.times, self.kinds, self.payloads))
+
+    # Reads
+
+    def _keyframe_at_or_before(self, index):
+        while self.kinds[index] != FULL:
+            index -= 1
+        return index
+
+    def _snapshots(self, first, last):
+        """Whole snapshots first..last (inclusive), rebuilt from the keyframe before first"""
+        state = None
+        for index in range(self._keyframe_at_or_before(first), last + 1):
+            payload = self.payloads[index]
+            state = payload if self.kinds[index] == FULL else patch(state, payload)
+            if index >= first:
+                yield state
+
+    def latest(self):
+        if not self.times:
+            return None
+        if self._latest is None:
+            self._latest = next(self._snapshots(len(self) - 1, len(self) - 1))
+        return self._latest
+
+    def recent(self, count):
+        """The last count snapshots, oldest first"""
+        if not self.times or count <= 0:
+            return []
+        return list(self._snapshots(max(0, len(self) - count), len(self) - 1))
+
+    def range(self, start=None, end=None, fields=None):
+        """
+        Snapshots generated between start and end (inclusive ISO dates or
+        datetimes; a bare end date covers that whole day), oldest first,
+        cut down to fields when given.
+        """
+        first = bisect_left(self.seconds, _seconds(start)) if start else 0
+        if end:
+            bound = _seconds(end)
+            if len(end) == 10:
+                bound += timedelta(days=1).total_seconds() - 1e-6
+            last = bisect_right(self.seconds, bound) - 1
+        else:
+            last = len(self) - 1
+        if first > last:
+            return []
+        snapshots = self._snapshots(first, last)
+        if fields is None:
+            return list(snapshots)
+        return [{"generated_at": s["generated_at"], **{f: s.get(f) for f in fields}} for s in snapshots]
+
+    # Writes
+
+    def append(self, insights):
+        """
+        Add a snapshot (a JSON-compatible dict with generated_at); returns
+        (rows, removed). A generated_at not after the newest one (the clock
+        stepped back) is moved just past it, so the history stays ordered.
+        """
+        if self.times and insights["generated_at"] <= self.times[-1]:
+            insights["generated_at"] = (datetime.fromisoformat(self.times[-1]) + timedelta(microseconds=1)).isoformat()
+        generated_at = insights["generated_at"]
+        latest = self.latest()
+        chain = len(self) - 1 - self._keyframe_at_or_before(len(self) - 1) if self.times else 0
+        if latest is None or chain + 1 >= self.keyframe_every:
+            kind, payload = FULL, insights
+        else:
+            kind, payload = DELTA, diff(latest, insights)
+        self.times.append(generated_at)
+        self.seconds.append(_seconds(generated_at))
+        self.kinds.append(kind)
+        self.payloads.append(payload)
+        self._latest = insights
+        rewritten, removed = self._compact()
+        rewritten.add(generated_at)
+        return [row for row in self.rows() if row[0] in rewritten], removed
+
+    def _expired(self):
+        """Indexes the retention tiers and cap drop, ascending"""
+        now = self.seconds[-1]
+        drop = set()
+        # Newest first, so the latest snapshot of each window is the one kept;
+        # the newest itself always is
+        seen = set()
+        for index in range(len(self) - 1, -1, -1):
+            age = now - self.seconds[index]
+            tier = next((i for i, (max_age, _) in enumerate(self.tiers) if age < max_age), None)
+            if tier is None:
+                if index < len(self) - 1:
+                    drop.add(index)
+                continue
+            resolution = self.tiers[tier][1]
+            if resolution:
+                window = (tier, int(self.seconds[index] // resolution))
+                if window in seen:
+                    drop.add(index)
+                seen.add(window)
+        kept = [index for index in range(len(self)) if index not in drop]
+        drop.update(kept[:max(0, len(kept) - max(1, self.max_snapshots))])
+        return sorted(drop)
+
+    def _compact(self):
+        rewritten, removed = set(), []
+        # Highest first, so the indexes still to remove stay valid
+        for index in reversed(self._expired()):
+            following = index + 1
+            if following < len(self) and self.kinds[following] == DELTA:
+                if self.kinds[index] == FULL:
+                    self.kinds[following], self.payloads[following] = self._rebase(
+                        index, patch(self.payloads[index], self.payloads[following]),
+                    )
+                else:
+                    self.payloads[following] = compose(self.payloads[index], self.payloads[following])
+                rewritten.add(self.times[following])
+            removed.append(self.times[index])
+            rewritten.discard(self.times[index])
+            for column in (self.times, self.seconds, self.kinds, self.payloads):
+                del column[index]
+        return rewritten, removed
+
+    def _rebase(self, index, snapshot):
+        """
+        (kind, payload) for the snapshot after index once index is removed:
+        a delta against the one before index while that keeps its run of
+        deltas shorter than keyframe_every, else whole
+        """
+        if index == 0:
+            return FULL, snapshot
+        keyframe = self._keyframe_at_or_before(index - 1)
+        run_end = index + 2
+        while run_end < len(self) and self.kinds[run_end] == DELTA:
+            run_end += 1
+        # Deltas from the keyframe on once index is gone: up to index - 1, the rebased one and those after it
+        if (index - 1 - keyframe) + (run_end - index - 1) >= self.keyframe_every:
+            return FULL, snapshot
+        previous = next(self._snapshots(index - 1, index - 1))
+        return DELTA, diff(previous, snapshot)
+
+
+def normalized(insights):
+    """insights as they read back from storage (tuples become lists), so deltas compare like with like"""
+    return json.loads(json.dumps(insights))
+
+
+def history_from_snapshots(snapshots):
+    """An InsightsHistory holding whole legacy snapshots, downsampled as if appended one by one"""
+    history = InsightsHistory()
+    for insights in sorted(snapshots, key=lambda s: s.get("generated_at") or ""):
+        insights = dict(insights, generated_at=insights.get("generated_at") or datetime.now().isoformat())
+        if not history.times or insights["generated_at"] > history.times[-1]:
+            history.append(normalized(insights))
+    return history
+
+
+def parse_bound(value):
+    """Validate a range bound (YYYY-MM-DD or ISO datetime); returns it or raises ValueError"""
+    if len(value) == 10:
+        date.fromisoformat(value)
+    elif datetime.fromisoformat(value).tzinfo is not None:
+        # generated_at is the server's local time, without an offset
+        raise ValueError("range bounds must not carry a UTC offset")
+    return value
@@ -0,0 +1,457 @@
+import asyncio
+import glob
+import json
+import os
+import sqlite3
+import time
+from collections.abc import Mapping
+
+from logs import get_logger
+from metrics import (
+    JOURNAL_APPEND_BYTES, JOURNAL_APPEND_DURATION, JOURNAL_QUARANTINED_ENTRIES, STORE_FLUSH_DURATION,
+    STORE_FLUSH_ENTRIES, STORE_FLUSH_FAILURES,
+)
+
+log = get_logger("journal")
+
+# How long the flusher waits after the first write so a burst lands in one batch
+STORE_FLUSH_INTERVAL = float(os.getenv("STORE_FLUSH_INTERVAL", "0.25"))
+# fsync every journal append; a write is only acknowledged once this returns
+STORE_JOURNAL_FSYNC = os.getenv("STORE_JOURNAL_FSYNC", "1") != "0"
+# Checkpoint the SQLite WAL every N flushes
+STORE_CHECKPOINT_EVERY = int(os.getenv("STORE_CHECKPOINT_EVERY", "50"))
+# A batch failing this many times in a row has its bad entries set aside even
+# if the error does not look like bad data
+STORE_FLUSH_MAX_FAILURES = int(os.getenv("STORE_FLUSH_MAX_FAILURES", "5"))
+# Longest wait between retries of a failing flush, in seconds
+STORE_FLUSH_RETRY_MAX = 30.0
+
+# Errors that mean an entry can never be applied, as opposed to the database
+# being unavailable for now (locked, disk full)
+DATA_ERRORS = (sqlite3.IntegrityError, sqlite3.DataError, sqlite3.InterfaceError,
+               ValueError, TypeError, KeyError, OverflowError)
+
+
+def _json_default(value):
+    if isinstance(value, Mapping):
+        return dict(value)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+class WriteBatch:
+    """
+    Journal entries coalesced so every row is written at most once.
+
+    Later entries win: a transaction upserted twice is written once, one
+    upserted then removed is only deleted, and a clear drops everything
+    queued before it.
+    """
+
+    def __init__(self):
+        self.clear = False
+        self.access_tokens = []
+        self.accounts = {}
+        self.upserts = {}
+        self.removed_ids = set()
+        self.cursors = {}
+        # generated_at -> (generated_at, kind, payload) of insights snapshots to upsert
+        self.insight_rows = {}
+        self.removed_insights = set()
+        self.entries = 0
+
+    def add(self, entry):
+        op = entry["op"]
+        if op == "clear":
+            self.__init__()
+            self.clear = True
+        elif op == "access_token":
+            if entry["access_token"] not in self.access_tokens:
+                self.access_tokens.append(entry["access_token"])
+        elif op == "accounts":
+            self.accounts[entry["access_token"]] = entry["accounts"]
+        elif op == "transactions":
+            for transaction_id in entry["removed_ids"]:
+                self.upserts.pop(transaction_id, None)
+                self.removed_ids.add(transaction_id)
+            for transaction in entry["upserts"]:
+                self.removed_ids.discard(transaction["transaction_id"])
+                self.upserts[transaction["transaction_id"]] = transaction
+            if entry.get("access_token") and entry.get("cursor"):
+                self.cursors[entry["access_token"]] = entry["cursor"]
+        elif op == "insights":
+            for generated_at in entry["removed"]:
+                self.insight_rows.pop(generated_at, None)
+                self.removed_insights.add(generated_at)
+            for generated_at, kind, payload in entry["rows"]:
+                self.removed_insights.discard(generated_at)
+                self.insight_rows[generated_at] = (generated_at, kind, payload)
+        elif op == "insight":
+            # Whole snapshot, as journaled before insights were stored as deltas
+            insights = entry["insights"]
+            generated_at = insights.get("generated_at")
+            if generated_at and generated_at not in self.insight_rows:
+                self.removed_insights.discard(generated_at)
+                self.insight_rows[generated_at] = (generated_at, "full", insights)
+        else:
+            raise ValueError(f"unknown journal op {op!r}")
+        self.entries += 1
+
+    def __bool__(self):
+        return self.entries > 0
+
+
+def _read_entries(path):
+    """Yield journal entries, skipping a torn final line from a crash mid-append"""
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        lines = f.readlines()
+    for i, line in enumerate(lines):
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError:
+            if i == len(lines) - 1:
+                log.warning("journal_torn_entry_ignored", path=path)
+            else:
+                log.error("journal_corrupt_entry_skipped", path=path, line=i + 1)
+
+
+class JournaledStore:
+    """
+    Write-ahead journal in front of a TransactionStore.
+
+    Every write is queued straight away and appended to an append-only
+    journal by commit(), which writers await before acknowledging: writes
+    waiting together share one append and fsync on a worker thread. A
+    background flusher waits STORE_FLUSH_INTERVAL for the burst to settle,
+    seals the journal with an atomic rename, coalesces the queued writes and
+    applies them to SQLite in one transaction off the event loop, then
+    deletes the sealed segment. Segments left behind by a crash are replayed
+    when the store is opened.
+
+    A batch that keeps failing is applied one entry at a time instead and
+    the entries that cannot be applied are moved to a .failed side file next
+    to the journal, so one bad write cannot hold up everything behind it;
+    flush_failures and quarantined report this for health checks.
+
+    Without a running flusher (scripts, tests without lifespan) every write
+    is journaled and flushed straight away.
+    """
+
+    def __init__(self, store, path, flush_interval=STORE_FLUSH_INTERVAL, fsync=STORE_JOURNAL_FSYNC):
+        self.store = store
+        self.path = path
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self._pending = WriteBatch()
+        self._sealed = []
+        self._flushes = 0
+        self._task = None
+        self._wake = None
+        self._stopping = False
+        # Entries queued but not yet in the journal file, and counts for commit()
+        self._unwritten = []
+        self._appended = 0
+        self._written = 0
+        self._commit_lock = None
+        self._flush_lock = None
+        # Consecutive failed attempts at the oldest sealed batch, and the last error
+        self.flush_failures = 0
+        self.last_error = None
+        # .failed side files next to the journal, left for an operator to look at
+        self.quarantined = len(glob.glob(f"{glob.escape(self.path)}.*.failed"))
+        self._replay()
+        self._journal = open(self.path, "a", encoding="utf-8")
+
+    # Recovery
+
+    def _segments(self):
+        return sorted(glob.glob(f"{glob.escape(self.path)}.*.flushing"))
+
+    def _replay(self):
+        """Apply what a crash left behind; entries that cannot be applied are set aside, never raised"""
+        paths = self._segments() + ([self.path] if os.path.exists(self.path) else [])
+        if not paths:
+            return
+        batch = WriteBatch()
+        try:
+            for path in paths:
+                for entry in _read_entries(path):
+                    batch.add(entry)
+            if batch:
+                self.store.apply_batch(batch)
+            log.info("journal_replayed", path=self.path, entries=batch.entries)
+        except Exception as e:
+            log.error("journal_replay_failed", path=self.path, error=str(e))
+            for path in paths:
+                self._salvage(path, give_up=True)
+        for path in paths:
+            os.remove(path)
+
+    def _salvage(self, path, give_up=False):
+        """
+        Apply a journal file's entries one at a time, moving the ones that
+        fail because of their data (any failure with give_up) to a .failed
+        side file. Returns False, with nothing set aside, if the database
+        itself looks unavailable; the file can then be retried later.
+        """
+        failed = []
+        for entry in _read_entries(path):
+            batch = WriteBatch()
+            try:
+                batch.add(entry)
+                self.store.apply_batch(batch)
+            except Exception as e:
+                if not give_up and not isinstance(e, DATA_ERRORS):
+                    return False
+                failed.append({"error": str(e), "entry": entry})
+        if failed:
+            side = f"{self.path}.{time.time_ns():020d}.failed"
+            try:
+                with open(side, "w", encoding="utf-8") as f:
+                    for record in failed:
+                        f.write(json.dumps(record, default=_json_default) + "\n")
+                    f.flush()
+                    os.fsync(f.fileno())
+            except OSError as e:
+                log.error("journal_quarantine_failed", path=side, error=str(e))
+                if not give_up:
+                    return False
+            self.quarantined += 1
+            JOURNAL_QUARANTINED_ENTRIES.inc(len(failed))
+            log.error("journal_entries_quarantined", path=side, entries=len(failed), error=failed[0]["error"])
+        return True
+
+    # Write API, mirroring TransactionStore
+
+    def add_access_token(self, access_token):
+        self._append({"op": "access_token", "access_token": access_token})
+
+    def replace_accounts(self, access_token, accounts):
+        self._append({"op": "accounts", "access_token": access_token, "accounts": list(accounts)})
+
+    def apply_transaction_changes(self, upserts=(), removed_ids=(), access_token=None, cursor=None):
+        self._append({
+            "op": "transactions",
+            "upserts": list(upserts),
+            "removed_ids": list(removed_ids),
+            "access_token": access_token,
+            "cursor": cursor,
+        })
+
+    def write_insights(self, rows=(), removed=()):
+        self._append({"op": "insights", "rows": [list(row) for row in rows], "removed": list(removed)})
+
+    def clear(self):
+        self._append({"op": "clear"})
+
+    def _append(self, entry):
+        # Queued as is, so reads see it at once; serializing it is left to the journal write
+        self._pending.add(entry)
+        self._unwritten.append(entry)
+        self._appended += 1
+        if self._task is None:
+            self.flush()
+        else:
+            self._wake.set()
+
+    # Journal
+
+    def _write(self, entries):
+        """Append entries to the journal file and fsync it; on a worker thread under the flusher"""
+        start = time.perf_counter()
+        lines = []
+        for entry in entries:
+            try:
+                lines.append(json.dumps(entry, default=_json_default) + "\n")
+            except (TypeError, ValueError) as e:
+                # Could never be replayed; dropping it keeps it from blocking every later write
+                log.error("journal_entry_unserializable", path=self.path, op=entry.get("op"), error=str(e))
+                JOURNAL_QUARANTINED_ENTRIES.inc()
+        self._journal.write("".join(lines))
+        self._journal.flush()
+        if self.fsync:
+            os.fsync(self._journal.fileno())
+        JOURNAL_APPEND_DURATION.observe(time.perf_counter() - start)
+        for line in lines:
+            JOURNAL_APPEND_BYTES.observe(len(line))
+
+    def _write_unwritten(self):
+        entries, self._unwritten = self._unwritten, []
+        try:
+            self._write(entries)
+        except BaseException:
+            self._unwritten[:0] = entries
+            raise
+        self._written += len(entries)
+
+    async def _write_unwritten_async(self):
+        """Like _write_unwritten on a worker thread; the caller holds the commit lock"""
+        entries, self._unwritten = self._unwritten, []
+        try:
+            await asyncio.to_thread(self._write, entries)
+        except BaseException:
+            self._unwritten[:0] = entries
+            raise
+        self._written += len(entries)
+
+    def _locks(self):
+        """(commit lock, flush lock): one journal write and one flush at a time; take flush first"""
+        if self._commit_lock is None:
+            self._commit_lock, self._flush_lock = asyncio.Lock(), asyncio.Lock()
+        return self._commit_lock, self._flush_lock
+
+    async def commit(self):
+        """Wait until every write made so far is in the journal on disk"""
+        target = self._appended
+        async with self._locks()[0]:
+            if self._written < target:
+                await self._write_unwritten_async()
+
+    # Reads
+
+    def get_sync_cursor(self, access_token):
+        """Saved sync cursor, including ones still waiting to be flushed"""
+        # Newest first: the live batch, then sealed ones still being flushed
+        for batch in (self._pending, *reversed([b for b, _ in self._sealed])):
+            if access_token in batch.cursors:
+                return batch.cursors[access_token]
+            if batch.clear:
+                return None
+        return self.store.get_sync_cursor(access_token)
+
+    def load(self):
+        self.flush()
+        return self.store.load()
+
+    # Flushing
+
+    def _seal(self):
+        """Atomically rename the live journal into a segment and start a new one"""
+        if self._pending:
+            self._journal.close()
+            segment = f"{self.path}.{time.time_ns():020d}.flushing"
+            try:
+                os.replace(self.path, segment)
+            finally:
+                # Reopened either way; if the rename failed it is still the live journal
+                self._journal = open(self.path, "a", encoding="utf-8")
+            self._sealed.append((self._pending, segment))
+            self._pending = WriteBatch()
+
+    def _applied(self, segment):
+        self._sealed.pop(0)
+        os.remove(segment)
+        self._flushes += 1
+        self.flush_failures = 0
+
+    def _apply(self, batch):
+        """Write one coalesced batch to SQLite, timing it"""
+        start = time.perf_counter()
+        self.store.apply_batch(batch)
+        STORE_FLUSH_DURATION.observe(time.perf_counter() - start)
+        STORE_FLUSH_ENTRIES.observe(batch.entries)
+
+    def _flush_batch(self, batch, segment):
+        """
+        Apply one sealed batch, falling back to _salvage() once it has
+        failed on bad data or too often. Returns False if it has to be
+        retried later.
+        """
+        try:
+            self._apply(batch)
+            return True
+        except Exception as e:
+            self.flush_failures += 1
+            self.last_error = str(e)
+            STORE_FLUSH_FAILURES.inc()
+            log.error("journal_flush_failed", path=self.path, attempts=self.flush_failures, error=str(e))
+            if not isinstance(e, DATA_ERRORS) and self.flush_failures < STORE_FLUSH_MAX_FAILURES:
+                return False
+        return self._salvage(segment, give_up=self.flush_failures >= STORE_FLUSH_MAX_FAILURES)
+
+    def flush(self):
+        """Journal and apply everything queued so far, synchronously"""
+        if self._unwritten:
+            self._write_unwritten()
+        self._seal()
+        while self._sealed:
+            batch, segment = self._sealed[0]
+            if not self._flush_batch(batch, segment):
+                raise RuntimeError(f"journal flush failed: {self.last_error}")
+            self._applied(segment)
+            if self._flushes % STORE_CHECKPOINT_EVERY == 0:
+                self.store.checkpoint()
+
+    async def flush_async(self):
+        """Journal and apply everything queued so far on worker threads"""
+        async with self._locks()[1]:
+            async with self._locks()[0]:
+                try:
+                    # Entries queued while a write was under way are written too, so the sealed segment holds the whole batch
+                    while self._unwritten:
+                        await self._write_unwritten_async()
+                except OSError as e:
+                    log.error("journal_write_failed", path=self.path, error=str(e))
+                    self._retry_later()
+                    return
+                self._seal()
+            while self._sealed:
+                batch, segment = self._sealed[0]
+                if not await asyncio.to_thread(self._flush_batch, batch, segment):
+                    # The sealed segment stays on disk and at the head of the queue
+                    self._retry_later()
+                    return
+                self._applied(segment)
+                if self._flushes % STORE_CHECKPOINT_EVERY == 0:
+                    await asyncio.to_thread(self.store.checkpoint)
+
+    def _retry_later(self):
+        if self._task is not None and not self._stopping:
+            delay = min(STORE_FLUSH_RETRY_MAX, self.flush_interval * 2 ** max(1, self.flush_failures))
+            asyncio.get_running_loop().call_later(delay, self._wake.set)
+
+    async def _run(self):
+        while not self._stopping:
+            await self._wake.wait()
+            if not self._stopping:
+                # Let the rest of the burst pile up before writing
+                await asyncio.sleep(self.flush_interval)
+            self._wake.clear()
+            try:
+                await self.flush_async()
+            except Exception as e:
+                # Failures flush_async doesn't expect (e.g. sealing the journal)
+                # must not end the loop, or nothing committed later is ever written
+                self.flush_failures += 1
+                self.last_error = str(e)
+                STORE_FLUSH_FAILURES.inc()
+                log.exception("journal_flush_loop_failed", path=self.path, attempts=self.flush_failures)
+                self._retry_later()
+
+    def start(self):
+        """Start the background flusher on the running event loop"""
+        if self._task is None:
+            self._stopping = False
+            self._wake = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+            if self._pending:
+                self._wake.set()
+
+    async def stop(self):
+        """Stop the flusher once it has written out whatever is still queued"""
+        if self._task is not None:
+            # Never cancel mid-flush: a batch applied twice would duplicate insights
+            self._stopping = True
+            self._wake.set()
+            await self._task
+            self._task = None
+        await self.flush_async()
+
+    def close(self):
+        """Close the journal and the underlying store; call after stop()"""
+        try:
+            self.flush()
+        finally:
+            self._journal.close()
+            self.store.close()
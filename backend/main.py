@@ -1,28 +1,62 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, Header, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from datetime import datetime, timedelta
+from contextlib import asynccontextmanager
+from typing import Optional
+from datetime import date, datetime, timedelta
+import asyncio
+import heapq
+import hmac
 import os
-import json
-import re
+import threading
+import zlib
 from dotenv import load_dotenv
 
-# Plaid imports
-from plaid.api import plaid_api
-from plaid.model.link_token_create_request import LinkTokenCreateRequest
-from plaid.model.link_token_create_request_user import LinkTokenCreateRequestUser
-from plaid.model.products import Products
-from plaid.model.country_code import CountryCode
-from plaid.model.item_public_token_exchange_request import ItemPublicTokenExchangeRequest
-from plaid.model.accounts_get_request import AccountsGetRequest
-from plaid.model.transactions_get_request import TransactionsGetRequest
-from plaid.model.institutions_get_request import InstitutionsGetRequest
-from plaid.configuration import Configuration
-from plaid.api_client import ApiClient
+from analytics import AnalyticsPool, JobCancelled, build_aggregates, restore_aggregates
+from logs import get_logger
+from metrics import (
+    INSIGHTS_STAGE_DURATION, Gauge, MetricsMiddleware, StageTimer, item_label, render as render_metrics,
+)
+from rollups import DIMENSIONS, GRANULARITIES
+from partitions import DEFAULT_USER_ID, PartitionManager, UserPartition, valid_user_id
+from plaid_sync import (
+    MAX_BACKFILL_DAYS, sync_transactions, fetch_transaction_history, fetch_institutions, account_balance,
+)
+from plaid_gateway import PlaidGateway, run_plaid, call_plaid
+from refcache import ReferenceCache
+from scheduler import RefreshScheduler
+from storage import ItemRegistry
+from early_payments import default_rules, rules_version
+from forecast import FORECAST_MAX_DAYS, trim
+from insights_history import parse_bound
+from transaction_query import MAX_PAGE_SIZE, build_filter, iter_csv, iter_ndjson, paginate
+from bulk_import import DEFAULT_IMPORT_ACCOUNT, IMPORT_CHUNK_SIZE, RecordParser
+from schemas import (
+    AccountsResponse, DashboardResponse, FastJSONResponse, ForecastResponse, ImportResponse, InsightsHistoryResponse,
+    RecurringPaymentsResponse,
+    RollupsResponse, SearchResponse, TransactionsResponse,
+    dumps, transaction_out,
+)
+from versioning import make_etag, etag_matches, not_modified
 
 load_dotenv()
 
-app = FastAPI(title="Financial AI Agent API")
+log = get_logger("api")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    partitions.start()
+    scheduler.start()
+    if PLAID_PRELOAD:
+        # Warm up off the event loop so /health answers while the SDK loads
+        asyncio.get_running_loop().run_in_executor(None, get_plaid_client)
+    yield
+    await scheduler.stop()
+    analytics.shutdown()
+    await partitions.close_all()
+
+app = FastAPI(title="Financial AI Agent API", default_response_class=FastJSONResponse, lifespan=lifespan)
 
 # CORS middleware - must be added BEFORE routes
 app.add_middleware(
@@ -31,137 +65,139 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
+# Outermost, so it times everything including CORS handling
+app.add_middleware(MetricsMiddleware)
 
 # Plaid Configuration
 PLAID_ENV = os.getenv("PLAID_ENV", "sandbox")
 
 # Set the correct Plaid host based on environment
-# For newer versions of plaid-python, use string URLs directly
-if PLAID_ENV == "production":
+# For newer versions of plaid-python, use string URLs directly.
+# PLAID_HOST overrides it, e.g. to point at a local fake Plaid server.
+if os.getenv("PLAID_HOST"):
+    PLAID_HOST = os.getenv("PLAID_HOST")
+elif PLAID_ENV == "production":
     PLAID_HOST = "https://production.plaid.com"
 elif PLAID_ENV == "development": 
     PLAID_HOST = "https://development.plaid.com"
 else:
     PLAID_HOST = "https://sandbox.plaid.com"
 
-configuration = Configuration(
-    host=PLAID_HOST,
-    api_key={
-        'clientId': os.getenv("PLAID_CLIENT_ID"),
-        'secret': os.getenv("PLAID_SECRET"),
-    }
+# Plaid sends SYNC_UPDATES_AVAILABLE webhooks here when set (e.g. https://host/plaid/webhook)
+PLAID_WEBHOOK_URL = os.getenv("PLAID_WEBHOOK_URL")
+
+# Importing the Plaid SDK takes longer than the rest of the app put together,
+# so the client (and the SDK's request models) are only loaded by the first
+# request that talks to Plaid. PLAID_PRELOAD=1 loads it in the background
+# right after startup instead, for long-running servers.
+PLAID_PRELOAD = os.getenv("PLAID_PRELOAD", "0") == "1"
+_plaid_client = None
+_plaid_client_lock = threading.Lock()
+
+def get_plaid_client():
+    """The Plaid API client, created on first use"""
+    global _plaid_client
+    with _plaid_client_lock:
+        if _plaid_client is None:
+            from plaid.api import plaid_api
+            from plaid.api_client import ApiClient
+            from plaid.configuration import Configuration
+            
+            configuration = Configuration(
+                host=PLAID_HOST,
+                api_key={
+                    'clientId': os.getenv("PLAID_CLIENT_ID"),
+                    'secret': os.getenv("PLAID_SECRET"),
+                }
+            )
+            _plaid_client = PlaidGateway(plaid_api.PlaidApi(ApiClient(configuration)))
+        return _plaid_client
+
+def set_plaid_client(client):
+    """Swap the Plaid client used by every endpoint (e.g. for a fake in tests); it is still called through the gateway"""
+    global _plaid_client
+    with _plaid_client_lock:
+        _plaid_client = PlaidGateway(client)
+
+# Data persistence
+DATA_FILE = "user_data.json"  # legacy whole-file store, migrated on first start
+DB_FILE = os.getenv("USER_DATA_DB", "user_data.db")
+
+ITEM_REGISTRY_DB = os.getenv("ITEM_REGISTRY_DB", "plaid_items.db")
+
+# Clients that may leave out X-User-Id and act as the default user: a local
+# single-user setup calling the API directly. Requests from anywhere else must
+# come through the authenticating proxy, which always sets the header
+DEFAULT_USER_HOSTS = frozenset(
+    host.strip() for host in os.getenv("DEFAULT_USER_HOSTS", "127.0.0.1,::1,localhost").split(",") if host.strip()
 )
 
-api_client = ApiClient(configuration)
-plaid_client = plaid_api.PlaidApi(api_client)
+# Authenticating proxies whose X-User-Id is believed; clients in
+# DEFAULT_USER_HOSTS are trusted as well (local tools, a proxy on this host)
+TRUSTED_PROXY_HOSTS = frozenset(
+    host.strip() for host in os.getenv("TRUSTED_PROXY_HOSTS", "").split(",") if host.strip()
+)
 
-# Data persistence functions
-DATA_FILE = "user_data.json"
+# When set, a request carrying it in X-Proxy-Secret may set X-User-Id from any host
+USER_ID_SECRET = os.getenv("USER_ID_SECRET", "")
 
-def load_user_data():
-    """Load user data from file"""
-    if os.path.exists(DATA_FILE):
-        try:
-            with open(DATA_FILE, 'r') as f:
-                return json.load(f)
-        except (json.JSONDecodeError, IOError):
-            print("Error loading user data, starting fresh")
-    return {
-        "access_tokens": [],
-        "accounts": [],
-        "transactions": [],
-        "insights": []
-    }
+# Reference data cache lifetimes, in seconds
+INSTITUTIONS_TTL = float(os.getenv("INSTITUTIONS_TTL", "86400"))
+INSTITUTIONS_STALE_TTL = float(os.getenv("INSTITUTIONS_STALE_TTL", "604800"))
+ACCOUNTS_CACHE_TTL = float(os.getenv("ACCOUNTS_CACHE_TTL", "300"))
 
-def save_user_data():
-    """Save user data to file"""
-    try:
-        with open(DATA_FILE, 'w') as f:
-            json.dump(user_data, f, indent=2)
-    except IOError as e:
-        print(f"Error saving user data: {e}")
+# Aggregate rebuilds started again when a sync lands while one is running
+AGGREGATE_REBUILD_ATTEMPTS = int(os.getenv("AGGREGATE_REBUILD_ATTEMPTS", "3"))
 
-# Load existing data on startup
-user_data = load_user_data()
+# Institutions and account metadata shared by every user; institutions are
+# also kept on disk when REFCACHE_FILE is set
+reference_cache = ReferenceCache()
 
-# Early Payment Detection Functions
-def configure_early_payments():
-    """
-    Return configuration for your specific early payments.
-    You can customize this based on your needs.
-    """
-    return {
-        "mortgage": {
-            "amount": 3416.03,
-            "keywords": ["mortgage", "loan", "mtg", "home loan", "wells fargo home", "quicken"],
-            "days_early": 2,
-            "tolerance": 10.00  # Allow $10 difference
-        },
-        # Add other recurring early payments here
-        # "car_payment": {
-        #     "amount": 450.00,
-        #     "keywords": ["auto loan", "car payment"],
-        #     "days_early": 3,
-        #     "tolerance": 5.00
-        # }
-    }
+# Full recomputes behind /generate_insights run in worker processes so they
+# never hold up other requests; started by the first job
+analytics = AnalyticsPool()
 
-def is_early_payment(transaction, config):
-    """
-    Check if a transaction matches the criteria for an early payment.
-    """
-    # Check amount (within tolerance)
-    amount_match = abs(transaction['amount'] - config['amount']) <= config.get('tolerance', 0)
-    
-    # Check if transaction name contains any of the keywords
-    name_lower = transaction['name'].lower()
-    keyword_match = any(keyword in name_lower for keyword in config['keywords'])
-    
-    # Check if it's near the end of the month (likely early payment for next month)
-    transaction_date = datetime.strptime(transaction['date'], '%Y-%m-%d')
-    days_in_month = (datetime(transaction_date.year, transaction_date.month % 12 + 1, 1) - timedelta(days=1)).day
-    is_end_of_month = transaction_date.day >= (days_in_month - config['days_early'])
-    
-    return amount_match and keyword_match and is_end_of_month
+# Maps Plaid Items to their user for webhooks and scheduled refreshes
+registry = ItemRegistry(ITEM_REGISTRY_DB)
+
+def register_items(partition):
+    # Items linked before the registry existed are picked up when their user loads
+    for access_token in partition.user_data["access_tokens"]:
+        registry.add(partition.user_id, access_token)
 
-def detect_early_payments(transactions, known_payments=None):
+# Every user gets their own partition (data, store, caches, lock), loaded on
+# first use and evicted when idle. The default user keeps the original
+# single-user database and the legacy JSON migration.
+partitions = PartitionManager(default_db=DB_FILE, legacy_json=DATA_FILE, on_load=register_items)
+
+def proxy_secret_valid(secret):
+    return bool(USER_ID_SECRET and secret) and hmac.compare_digest(secret.encode(), USER_ID_SECRET.encode())
+
+async def get_partition(request: Request, x_user_id: Optional[str] = Header(None),
+                        x_proxy_secret: Optional[str] = Header(None)):
     """
-    Detect and adjust early payments to their intended month.
-    
-    Args:
-        transactions: List of transaction dictionaries
-        known_payments: Dict of known early payments with patterns and amounts
+    Resolve the caller's partition from the X-User-Id header, set by the
+    authenticating proxy. The header is only believed from DEFAULT_USER_HOSTS,
+    TRUSTED_PROXY_HOSTS or with USER_ID_SECRET, and the default user (no
+    header, or naming it) is only served to DEFAULT_USER_HOSTS; anyone else
+    gets a 401 rather than somebody else's data.
     """
-    if known_payments is None:
-        known_payments = configure_early_payments()
-    
-    adjusted_transactions = []
-    adjustment_count = 0
-    
-    for transaction in transactions:
-        adjusted_transaction = transaction.copy()
-        
-        # Check if this transaction matches any known early payment pattern
-        for payment_type, config in known_payments.items():
-            if is_early_payment(transaction, config):
-                # Adjust the date to the intended month
-                original_date = datetime.strptime(transaction['date'], '%Y-%m-%d')
-                adjusted_date = original_date + timedelta(days=config['days_early'])
-                adjusted_transaction['date'] = adjusted_date.strftime('%Y-%m-%d')
-                adjusted_transaction['original_date'] = transaction['date']
-                adjusted_transaction['payment_type'] = payment_type
-                adjusted_transaction['date_adjusted'] = True
-                adjustment_count += 1
-                print(f"Adjusted {payment_type} payment from {transaction['date']} to {adjusted_transaction['date']}")
-                break
-        
-        adjusted_transactions.append(adjusted_transaction)
-    
-    if adjustment_count > 0:
-        print(f"Total adjustments made: {adjustment_count}")
-    
-    return adjusted_transactions
+    host = request.client.host if request.client else None
+    local = host in DEFAULT_USER_HOSTS
+    user_id = x_user_id or DEFAULT_USER_ID
+    if x_user_id and not (local or host in TRUSTED_PROXY_HOSTS or proxy_secret_valid(x_proxy_secret)):
+        raise HTTPException(status_code=401, detail="X-User-Id is only accepted from a trusted proxy")
+    if user_id == DEFAULT_USER_ID and not local:
+        raise HTTPException(status_code=401, detail="X-User-Id header required")
+    if not valid_user_id(user_id):
+        raise HTTPException(status_code=400, detail="Invalid X-User-Id")
+    partition = await partitions.acquire(user_id)
+    try:
+        yield partition
+    finally:
+        partitions.release(partition)
 
 # Pydantic models
 class LinkTokenResponse(BaseModel):
@@ -173,13 +209,32 @@ class PublicTokenExchange(BaseModel):
 # Routes
 @app.get("/health")
 async def health():
-    return {"status": "healthy", "environment": PLAID_ENV}
+    # A journal that cannot flush, or has set writes aside, needs someone to look at it
+    stores = [partitions.peek(user_id).store for user_id in partitions.loaded()]
+    failing = sum(1 for store in stores if store.flush_failures)
+    quarantined = sum(store.quarantined for store in stores)
+    return {
+        "status": "degraded" if failing or quarantined else "healthy",
+        "environment": PLAID_ENV,
+        "journals_failing": failing,
+        "journals_quarantined": quarantined,
+    }
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text-format metrics"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
 
 @app.post("/create_link_token", response_model=LinkTokenResponse)
-async def create_link_token():
+async def create_link_token(partition: UserPartition = Depends(get_partition)):
     """Create a Plaid link token"""
+    from plaid.model.country_code import CountryCode
+    from plaid.model.link_token_create_request import LinkTokenCreateRequest
+    from plaid.model.link_token_create_request_user import LinkTokenCreateRequestUser
+    from plaid.model.products import Products
+    
     try:
-        user = LinkTokenCreateRequestUser(client_user_id=f"user_{datetime.now().timestamp()}")
+        user = LinkTokenCreateRequestUser(client_user_id=partition.user_id)
         
         # Simplified request without account_filters
         request = LinkTokenCreateRequest(
@@ -187,311 +242,632 @@ async def create_link_token():
             client_name="Financial AI Agent",
             products=[Products("transactions"), Products("auth")],
             country_codes=[CountryCode("US")],
-            language="en"
+            language="en",
+            **({"webhook": PLAID_WEBHOOK_URL} if PLAID_WEBHOOK_URL else {})
         )
         
-        response = plaid_client.link_token_create(request)
+        response = await call_plaid(get_plaid_client().link_token_create, request)
         # Access the response properly - it's an object, not a dict
         return LinkTokenResponse(link_token=response.link_token)
         
     except Exception as e:
-        print(f"Error creating link token: {e}")
+        log.error("link_token_failed", user_id=partition.user_id, error=str(e))
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/exchange_public_token")
-async def exchange_public_token(token_data: PublicTokenExchange):
+async def exchange_public_token(token_data: PublicTokenExchange, partition: UserPartition = Depends(get_partition)):
     """Exchange public token for access token"""
+    from plaid.model.item_public_token_exchange_request import ItemPublicTokenExchangeRequest
+    
     try:
-        print(f"Exchanging public token: {token_data.public_token[:10]}...")
         
         request = ItemPublicTokenExchangeRequest(public_token=token_data.public_token)
-        response = plaid_client.item_public_token_exchange(request)
+        response = await call_plaid(get_plaid_client().item_public_token_exchange, request)
         
         # Access the response properly and convert to string
         access_token = str(response.access_token)
-        user_data["access_tokens"].append(access_token)
-        save_user_data()  # Save after adding access token
-        
-        print(f"Got access token: {access_token[:10]}...")
-        
-        # Fetch accounts immediately
-        await fetch_accounts(access_token)
+        async with partition.lock:
+            partition.add_access_token(access_token)
+            registry.add(partition.user_id, access_token, str(response.item_id))
+            
+            # Fetch accounts immediately
+            await fetch_accounts(partition, access_token)
+        await partition.commit()
         
-        print(f"Total accounts now: {len(user_data['accounts'])}")
+        log.info("item_linked", user_id=partition.user_id, item_id=str(response.item_id),
+                 accounts=len(partition.user_data["accounts"]))
         
         return {"success": True, "message": "Account connected successfully"}
         
     except Exception as e:
-        print(f"Error exchanging token: {e}")
+        log.error("public_token_exchange_failed", user_id=partition.user_id, error=str(e))
         raise HTTPException(status_code=500, detail=str(e))
 
-async def fetch_accounts(access_token: str):
-    """Fetch account information"""
+async def fetch_accounts(partition: UserPartition, access_token: str, balances=None):
+    """
+    Fetch account information. Names and types are reused for
+    ACCOUNTS_CACHE_TTL seconds, balances never are: they come from the
+    transactions sync that was just run (balances) or, without one, from a
+    fresh /accounts/get that also refreshes the cached metadata.
+    """
+    key = ("accounts", access_token)
     try:
-        request = AccountsGetRequest(access_token=access_token)
-        response = plaid_client.accounts_get(request)
+        metadata = None
+        if balances is not None:
+            metadata = await reference_cache.get(
+                key, lambda: load_account_metadata(access_token), ttl=ACCOUNTS_CACHE_TTL
+            )
+            if {a["account_id"] for a in metadata} != set(balances):
+                # The Item gained or lost accounts since they were cached
+                forget_item(access_token)
+                metadata = None
+        if metadata is None:
+            loaded = await load_accounts(access_token)
+            metadata = [account_metadata(a) for a in loaded]
+            reference_cache.put(key, metadata, ttl=ACCOUNTS_CACHE_TTL)
+            balances = {a["account_id"]: a["balance"] for a in loaded}
         
-        # Clear existing accounts for this access token to avoid duplicates
-        user_data["accounts"] = [acc for acc in user_data["accounts"] if acc.get("access_token") != access_token]
+        # New dicts every time: the journal may still hold the previous ones
+        fetched_accounts = [{**a, "balance": balances.get(a["account_id"], 0)} for a in metadata]
         
-        # Convert Plaid objects to plain Python dictionaries
-        for account in response.accounts:
-            # Get balance safely
-            current_balance = 0
-            if hasattr(account, 'balances') and account.balances:
-                if hasattr(account.balances, 'current') and account.balances.current is not None:
-                    current_balance = float(account.balances.current)
-            
-            account_dict = {
-                "account_id": str(account.account_id),
-                "name": str(account.name),
-                "type": str(account.type),
-                "subtype": str(account.subtype) if account.subtype else "unknown",
-                "balance": current_balance,
-                "access_token": access_token
-            }
-            user_data["accounts"].append(account_dict)
+        # Replace existing accounts for this access token to avoid duplicates
+        partition.replace_accounts(access_token, fetched_accounts)
             
-        print(f"Successfully fetched {len(response.accounts)} accounts")
-        save_user_data()  # Save after fetching accounts
+        log.info("accounts_fetched", user_id=partition.user_id, item=item_label(access_token),
+                 count=len(fetched_accounts))
             
     except Exception as e:
-        print(f"Error fetching accounts: {e}")
+        log.error("accounts_fetch_failed", user_id=partition.user_id, item=item_label(access_token), error=str(e))
         raise e  # Re-raise to see the full error
 
-@app.get("/accounts")
-async def get_accounts():
+def forget_item(access_token: str):
+    """Drop everything cached about an Item once it has changed"""
+    reference_cache.invalidate(("accounts", access_token))
+    if _plaid_client is not None:
+        _plaid_client.forget(access_token)
+
+def account_metadata(account):
+    """An account dict without its balance, which is all the reference cache keeps"""
+    return {k: v for k, v in account.items() if k != "balance"}
+
+async def load_account_metadata(access_token: str):
+    return [account_metadata(a) for a in await load_accounts(access_token)]
+
+async def load_accounts(access_token: str):
+    from plaid.model.accounts_get_request import AccountsGetRequest
+    
+    request = AccountsGetRequest(access_token=access_token)
+    response = await call_plaid(get_plaid_client().accounts_get, request, item_key=access_token)
+    
+    # Convert Plaid objects to plain Python dictionaries
+    fetched_accounts = []
+    for account in response.accounts:
+        account_dict = {
+            "account_id": str(account.account_id),
+            "name": str(account.name),
+            "type": str(account.type),
+            "subtype": str(account.subtype) if account.subtype else "unknown",
+            "balance": account_balance(account),
+            "access_token": access_token
+        }
+        fetched_accounts.append(account_dict)
+    return fetched_accounts
+
+@app.get("/accounts", response_model=AccountsResponse)
+async def get_accounts(request: Request, partition: UserPartition = Depends(get_partition)):
     """Get all connected accounts"""
     try:
-        # Ensure all data is JSON serializable
-        serializable_accounts = []
-        for account in user_data["accounts"]:
-            serializable_account = {
-                "account_id": str(account.get("account_id", "")),
-                "name": str(account.get("name", "")),
-                "type": str(account.get("type", "")),
-                "subtype": str(account.get("subtype", "")),
-                "balance": float(account.get("balance", 0))
-            }
-            serializable_accounts.append(serializable_account)
-        
-        return {"accounts": serializable_accounts}
-    except Exception as e:
-        print(f"Error in get_accounts: {e}")
+        key = partition.versions.key("accounts")
+        etag = make_etag("accounts", key)
+        if etag_matches(request, etag):
+            return not_modified(etag)
+        # Only changes when fetch_accounts runs, so the body is serialized once per change
+        body = partition.accounts_cache.get(key, lambda: dumps({"accounts": partition.public_accounts()}))
+        return FastJSONResponse(body, headers={"ETag": etag})
+    except Exception:
+        log.exception("get_accounts_failed")
         return {"accounts": []}
 
 @app.post("/fetch_transactions")
-async def fetch_transactions():
-    """Fetch transactions from all connected accounts"""
+async def fetch_transactions(mode: str = "sync", backfill_days: int = 0,
+                             partition: UserPartition = Depends(get_partition)):
+    """
+    Fetch transactions from all connected accounts.
+    
+    mode="sync" pulls only the changes since each access token's saved
+    /transactions/sync cursor. backfill_days additionally downloads older
+    history with /transactions/get for the given number of days back
+    (1 to MAX_BACKFILL_DAYS; 0 skips the backfill).
+    mode="full" re-downloads the last 90 days and replaces everything.
+    
+    A user's fetches run one at a time; an identical fetch that is already
+    running is joined instead of started again.
+    """
+    if mode not in ("sync", "full"):
+        raise HTTPException(status_code=400, detail="mode must be 'sync' or 'full'")
+    if not 0 <= backfill_days <= MAX_BACKFILL_DAYS:
+        raise HTTPException(status_code=400, detail=f"backfill_days must be between 1 and {MAX_BACKFILL_DAYS}, or 0")
+    
+    return await partition.single_flight(
+        ("fetch_transactions", mode, backfill_days),
+        lambda: sync_transactions_for(partition, mode, backfill_days),
+    )
+
+async def sync_transactions_for(partition: UserPartition, mode: str = "sync", backfill_days: int = 0):
+    """Fetch transactions for every access token of a user; the caller holds the partition lock"""
+    if mode == "full":
+        result = await fetch_transactions_full(partition)
+        await partition.commit()
+        return result
+    
+    # Every Item syncs concurrently on the Plaid worker pool; one failing doesn't stop the others
+    tokens = list(partition.user_data["access_tokens"])
+    results = await asyncio.gather(
+        *(sync_access_token(partition, access_token, backfill_days) for access_token in tokens),
+        return_exceptions=True,
+    )
+    failed = item_failures(tokens, results)
+    synced = [r for r in results if not isinstance(r, BaseException)]
+    added_count = sum(r[0] for r in synced)
+    modified_count = sum(r[1] for r in synced)
+    removed_count = sum(r[2] for r in synced)
+    
+    log.info("transactions_synced", user_id=partition.user_id, added=added_count,
+             modified=modified_count, removed=removed_count, failed=len(failed))
+    await partition.commit()
+    if tokens and len(failed) == len(tokens):
+        raise HTTPException(status_code=502, detail=failure_summary(failed, len(tokens)))
+    return {
+        "message": "Transactions fetched successfully" if not failed else failure_summary(failed, len(tokens)),
+        "count": len(partition.user_data["transactions"]),
+        "added": added_count,
+        "modified": modified_count,
+        "removed": removed_count,
+        "failed_items": len(failed),
+    }
+
+def item_failures(tokens, results):
+    """(access_token, error) for every Item whose gathered result is an exception"""
+    failures = []
+    for access_token, result in zip(tokens, results):
+        if isinstance(result, asyncio.CancelledError):
+            raise result
+        if isinstance(result, BaseException):
+            failures.append((access_token, result))
+    return failures
+
+def failure_summary(failures, total):
+    access_token, error = failures[0]
+    return f"{len(failures)} of {total} Items failed to refresh; {item_label(access_token)}: {error}"
+
+async def sync_access_token(partition: UserPartition, access_token: str, backfill_days: int = 0):
+    """
+    Sync one Item, apply its deltas and update its accounts with the balances
+    the sync returned; returns (added, modified, removed) counts, raises if
+    Plaid fails.
+    """
+    try:
+        cursor = partition.store.get_sync_cursor(access_token)
+        calls = [run_plaid(
+            sync_transactions, get_plaid_client(), access_token, cursor,
+            days_requested=backfill_days or None, item_key=access_token,
+        )]
+        if backfill_days > 0:
+            end_date = datetime.now().date()
+            start_date = end_date - timedelta(days=backfill_days)
+            calls.append(run_plaid(
+                fetch_transaction_history, get_plaid_client(), access_token, start_date, end_date,
+                item_key=access_token,
+            ))
+        results = await asyncio.gather(*calls)
+        added, modified, removed_ids, next_cursor, balances = results[0]
+        backfilled = results[1] if len(results) > 1 else []
+        
+        partition.apply_transaction_changes(backfilled + added + modified, removed_ids, access_token, next_cursor)
+        # Falls back to /accounts/get when Plaid sent no balances with the sync
+        await fetch_accounts(partition, access_token, balances or None)
+        return len(added), len(modified), len(removed_ids)
+    except Exception as e:
+        log.error("transactions_sync_failed", user_id=partition.user_id, item=item_label(access_token),
+                  error=str(e))
+        raise
+
+async def fetch_transactions_full(partition: UserPartition):
+    """Re-download the last 90 days for every access token and replace the stored set"""
     end_date = datetime.now().date()
     start_date = end_date - timedelta(days=90)  # Extended to 90 days for more data
     
-    # Clear existing transactions to avoid duplicates
-    user_data["transactions"] = []
-    
-    for access_token in user_data["access_tokens"]:
+    async def fetch_history(access_token):
         try:
-            request = TransactionsGetRequest(
-                access_token=access_token,
-                start_date=start_date,
-                end_date=end_date
+            return await run_plaid(
+                fetch_transaction_history, get_plaid_client(), access_token, start_date, end_date,
+                item_key=access_token,
             )
-            response = plaid_client.transactions_get(request)
-            
-            # Handle pagination for more than 100 transactions
-            total_transactions = response.total_transactions
-            transactions_fetched = len(response.transactions)
-            
-            # Process initial batch
-            for transaction in response.transactions:
-                category_list = []
-                if hasattr(transaction, 'category') and transaction.category:
-                    category_list = [str(cat) for cat in transaction.category]
-                
-                merchant_name = None
-                if hasattr(transaction, 'merchant_name') and transaction.merchant_name:
-                    merchant_name = str(transaction.merchant_name)
-                
-                transaction_dict = {
-                    "transaction_id": str(transaction.transaction_id),
-                    "account_id": str(transaction.account_id),
-                    "amount": float(transaction.amount),
-                    "date": str(transaction.date),
-                    "name": str(transaction.name),
-                    "category": category_list,
-                    "merchant_name": merchant_name,
-                }
-                user_data["transactions"].append(transaction_dict)
-            
-            # Fetch remaining transactions if there are more
-            while transactions_fetched < total_transactions:
-                request = TransactionsGetRequest(
-                    access_token=access_token,
-                    start_date=start_date,
-                    end_date=end_date,
-                    offset=transactions_fetched
-                )
-                response = plaid_client.transactions_get(request)
-                
-                for transaction in response.transactions:
-                    category_list = []
-                    if hasattr(transaction, 'category') and transaction.category:
-                        category_list = [str(cat) for cat in transaction.category]
-                    
-                    merchant_name = None
-                    if hasattr(transaction, 'merchant_name') and transaction.merchant_name:
-                        merchant_name = str(transaction.merchant_name)
-                    
-                    transaction_dict = {
-                        "transaction_id": str(transaction.transaction_id),
-                        "account_id": str(transaction.account_id),
-                        "amount": float(transaction.amount),
-                        "date": str(transaction.date),
-                        "name": str(transaction.name),
-                        "category": category_list,
-                        "merchant_name": merchant_name,
-                    }
-                    user_data["transactions"].append(transaction_dict)
-                
-                transactions_fetched += len(response.transactions)
-                
         except Exception as e:
-            print(f"Error fetching transactions: {e}")
+            log.error("transactions_fetch_failed", user_id=partition.user_id, item=item_label(access_token),
+                      error=str(e))
+            raise
+    
+    tokens = list(partition.user_data["access_tokens"])
+    results = await asyncio.gather(*(fetch_history(t) for t in tokens), return_exceptions=True)
+    failed = item_failures(tokens, results)
+    if failed:
+        # A missing Item would look like all of its transactions were deleted, so nothing is replaced
+        raise HTTPException(status_code=502, detail=failure_summary(failed, len(tokens)))
+    fetched = []
+    for history in results:
+        fetched.extend(history)
     
-    # Sort transactions by date (newest first)
-    user_data["transactions"].sort(key=lambda x: x["date"], reverse=True)
-    save_user_data()  # Save after fetching transactions
+    # Only the rows that changed or disappeared are written back
+    fetched_ids = {t["transaction_id"] for t in fetched}
+    removed_ids = [tid for tid in partition.user_data["transactions"].ids() if tid not in fetched_ids]
+    partition.apply_transaction_changes(fetched, removed_ids)
     
-    print(f"Successfully fetched {len(user_data['transactions'])} transactions")
-    return {"message": "Transactions fetched successfully", "count": len(user_data["transactions"])}
+    log.info("transactions_fetched", user_id=partition.user_id, count=len(partition.user_data["transactions"]))
+    return {"message": "Transactions fetched successfully", "count": len(partition.user_data["transactions"])}
 
-@app.get("/dashboard")
-async def get_dashboard():
+@app.get("/dashboard", response_model=DashboardResponse)
+async def get_dashboard(request: Request, partition: UserPartition = Depends(get_partition)):
     """Get complete dashboard data with early payment adjustments applied"""
     try:
-        # Apply early payment adjustments to transactions
-        adjusted_transactions = detect_early_payments(user_data["transactions"])
-        
-        # Ensure all data is JSON serializable
-        serializable_accounts = []
-        for account in user_data["accounts"]:
-            serializable_account = {
-                "account_id": str(account.get("account_id", "")),
-                "name": str(account.get("name", "")),
-                "type": str(account.get("type", "")),
-                "subtype": str(account.get("subtype", "")),
-                "balance": float(account.get("balance", 0))
-            }
-            serializable_accounts.append(serializable_account)
-        
-        serializable_transactions = []
-        for transaction in adjusted_transactions[-20:]:  # Last 20 transactions
-            serializable_transaction = {
-                "transaction_id": str(transaction.get("transaction_id", "")),
-                "account_id": str(transaction.get("account_id", "")),
-                "amount": float(transaction.get("amount", 0)),
-                "date": str(transaction.get("date", "")),
-                "name": str(transaction.get("name", "")),
-                "category": transaction.get("category", []),
-                "merchant_name": transaction.get("merchant_name"),
-                "original_date": transaction.get("original_date"),
-                "date_adjusted": transaction.get("date_adjusted", False),
-                "payment_type": transaction.get("payment_type")
-            }
-            serializable_transactions.append(serializable_transaction)
-        
-        serializable_insights = user_data["insights"][-5:] if user_data["insights"] else []  # Last 5 insights
-        
-        return {
-            "accounts": serializable_accounts,
-            "recent_transactions": serializable_transactions,
-            "recent_insights": serializable_insights,
-        }
-    except Exception as e:
-        print(f"Error in get_dashboard: {e}")
+        key = partition.versions.key("transactions", "accounts", "insights") + (rules_version(),)
+        etag = make_etag("dashboard", key)
+        if etag_matches(request, etag):
+            return not_modified(etag)
+        body = partition.dashboard_cache.get(key, lambda: dumps(build_dashboard(partition)))
+        return FastJSONResponse(body, headers={"ETag": etag})
+    except Exception:
+        log.exception("get_dashboard_failed")
         return {
             "accounts": [],
             "recent_transactions": [],
             "recent_insights": [],
         }
 
-@app.get("/transactions_adjusted")
-async def get_transactions_adjusted():
-    """Get all transactions with early payment adjustments applied"""
+def build_dashboard(partition: UserPartition):
+    # Apply early payment adjustments to transactions
+    adjusted_transactions = partition.adjusted_transactions()
+    
+    serializable_transactions = [
+        transaction_out(t) for t in adjusted_transactions[-20:]  # Last 20 transactions
+    ]
+    # Last 5 insights, newest last; rebuilt from the history's latest snapshots only
+    serializable_insights = partition.user_data["insights"].recent(5)
+    
+    return {
+        "accounts": partition.public_accounts(),
+        "recent_transactions": serializable_transactions,
+        "recent_insights": serializable_insights,
+    }
+
+@app.get("/transactions_adjusted", response_model=TransactionsResponse)
+async def get_transactions_adjusted(
+    request: Request,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    account_id: Optional[str] = None,
+    category: Optional[str] = None,
+    merchant: Optional[str] = None,
+    min_amount: Optional[float] = None,
+    max_amount: Optional[float] = None,
+    adjusted_only: bool = False,
+    format: str = "json",
+    partition: UserPartition = Depends(get_partition),
+):
+    """
+    Get transactions with early payment adjustments applied, newest first.
+    
+    Without limit/cursor the whole (filtered) list is returned as before.
+    With limit, a page plus next_cursor is returned; pass it back as cursor
+    for the next page. format=ndjson or format=csv streams every matching
+    transaction instead, without building the body in memory.
+    """
+    if format not in ("json", "ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="format must be 'json', 'ndjson' or 'csv'")
+    if limit is not None and not 1 <= limit <= MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    
+    predicate = build_filter(start_date, end_date, account_id, category, merchant,
+                             min_amount, max_amount, adjusted_only)
+    key = partition.adjusted_key()
+    etag = make_etag("transactions", key + (zlib.crc32(str(request.url.query).encode()),))
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    
+    if format in ("ndjson", "csv"):
+        # The stream is read on a worker thread after this returns, outside the
+        # partition lock, so it gets a copy that later writes can't reach
+        pinned = partition.adjusted_transactions().pinned()
+    if format == "ndjson":
+        return StreamingResponse(
+            iter_ndjson(pinned, transaction_out, predicate),
+            media_type="application/x-ndjson",
+            headers={"ETag": etag},
+        )
+    if format == "csv":
+        return StreamingResponse(
+            iter_csv(pinned, transaction_out, predicate),
+            media_type="text/csv",
+            headers={"ETag": etag},
+        )
+    
     try:
-        adjusted_transactions = detect_early_payments(user_data["transactions"])
+        headers = {"ETag": etag}
+        if limit is None and cursor is None and predicate is None:
+            body = partition.transactions_adjusted_cache.get(key, lambda: dumps({
+                "transactions": [transaction_out(t) for t in partition.adjusted_transactions()]
+            }))
+            return FastJSONResponse(body, headers=headers)
         
-        serializable_transactions = []
-        for transaction in adjusted_transactions:
-            serializable_transaction = {
-                "transaction_id": str(transaction.get("transaction_id", "")),
-                "account_id": str(transaction.get("account_id", "")),
-                "amount": float(transaction.get("amount", 0)),
-                "date": str(transaction.get("date", "")),
-                "name": str(transaction.get("name", "")),
-                "category": transaction.get("category", []),
-                "merchant_name": transaction.get("merchant_name"),
-                "original_date": transaction.get("original_date"),
-                "date_adjusted": transaction.get("date_adjusted", False),
-                "payment_type": transaction.get("payment_type")
-            }
-            serializable_transactions.append(serializable_transaction)
+        if limit is None and cursor is None:
+            matching = [t for t in partition.adjusted_transactions() if predicate(t)]
+            return FastJSONResponse({"transactions": [transaction_out(t) for t in matching]}, headers=headers)
         
-        return {"transactions": serializable_transactions}
-    except Exception as e:
-        print(f"Error in get_transactions_adjusted: {e}")
+        try:
+            page, next_cursor = paginate(partition.adjusted_transactions(), limit or MAX_PAGE_SIZE, cursor, predicate)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return FastJSONResponse({
+            "transactions": [transaction_out(t) for t in page],
+            "next_cursor": next_cursor,
+        }, headers=headers)
+    except HTTPException:
+        raise
+    except Exception:
+        log.exception("get_transactions_adjusted_failed")
         return {"transactions": []}
 
+@app.post("/import_transactions", response_model=ImportResponse)
+async def import_transactions(
+    request: Request,
+    format: str = "ndjson",
+    account_id: str = DEFAULT_IMPORT_ACCOUNT,
+    date_format: Optional[str] = None,
+    negate: bool = False,
+    partition: UserPartition = Depends(get_partition),
+):
+    """
+    Bulk-import transaction history from the request body, e.g. years of
+    history older than Plaid's window.
+    
+    The body is an NDJSON or CSV file (see bulk_import.COLUMN_ALIASES for the
+    accepted columns, including OFX statements converted to CSV). It is
+    parsed as it streams in and applied in chunks of IMPORT_CHUNK_SIZE
+    through the same path as Plaid syncs, so adjustments, aggregates,
+    rollups and search see imported rows too. Rows are deduplicated on
+    transaction_id, or on a content hash when the file has no ids, so
+    re-importing a file is harmless.
+    """
+    try:
+        parser = RecordParser(format, account_id, date_format, negate)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    totals = {"added": 0, "updated": 0, "unchanged": 0, "chunks": 0}
+    
+    async def apply(chunk):
+        async with partition.lock:
+            added, updated, unchanged = partition.import_transactions(chunk)
+        await partition.commit()
+        totals["added"] += added
+        totals["updated"] += updated
+        totals["unchanged"] += unchanged
+        totals["chunks"] += 1
+    
+    pending = []
+    async for piece in request.stream():
+        pending.extend(parser.feed(piece))
+        while len(pending) >= IMPORT_CHUNK_SIZE:
+            await apply(pending[:IMPORT_CHUNK_SIZE])
+            del pending[:IMPORT_CHUNK_SIZE]
+    pending.extend(parser.close())
+    if pending:
+        await apply(pending)
+    
+    log.info("transactions_imported", user_id=partition.user_id, format=format, records=parser.records,
+             rejected=parser.rejected, **totals)
+    return {
+        "records": parser.records,
+        **totals,
+        "rejected": parser.rejected,
+        "errors": parser.errors,
+        "count": len(partition.user_data["transactions"]),
+    }
+
+@app.get("/recurring_payments", response_model=RecurringPaymentsResponse)
+async def get_recurring_payments(request: Request, partition: UserPartition = Depends(get_partition)):
+    """
+    Recurring payment series detected in the transaction history, with the
+    postings that came early or late relative to each series' schedule.
+    """
+    try:
+        key = partition.versions.key("transactions")
+        etag = make_etag("recurring", key)
+        if etag_matches(request, etag):
+            return not_modified(etag)
+        return FastJSONResponse({"series": partition.recurring_series().series()}, headers={"ETag": etag})
+    except Exception:
+        log.exception("get_recurring_payments_failed")
+        return {"series": []}
+
+@app.get("/forecast", response_model=ForecastResponse)
+async def get_forecast(request: Request, days: int = 30, partition: UserPartition = Depends(get_partition)):
+    """
+    Projected daily balances per account (and net) over the next `days`
+    days, from current balances, the detected recurring series and each
+    account's typical discretionary spend by weekday, with an 80% band.
+    
+    One forecast of the longest supported length is cached per data
+    version and day; shorter horizons are served as slices of it.
+    """
+    if not 1 <= days <= FORECAST_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"days must be between 1 and {FORECAST_MAX_DAYS}")
+    
+    as_of = date.today().toordinal()
+    key = partition.versions.key("transactions", "accounts") + (as_of,)
+    etag = make_etag("forecast", key + (days,))
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    
+    return FastJSONResponse(trim(partition.forecast(as_of), days), headers={"ETag": etag})
+
+@app.get("/rollups", response_model=RollupsResponse)
+async def get_rollups(
+    request: Request,
+    granularity: str = "month",
+    group_by: Optional[str] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    category: Optional[str] = None,
+    account_id: Optional[str] = None,
+    merchant: Optional[str] = None,
+    partition: UserPartition = Depends(get_partition),
+):
+    """
+    Spending and income totals from the materialized rollups.
+    
+    granularity is day, week, month or total; group_by is a comma-separated
+    subset of category, account_id and merchant. Dates are inclusive
+    YYYY-MM-DD bounds on the adjusted date. Answers come from precomputed
+    period totals, so they cost the same however long the history is.
+    """
+    if granularity not in GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"granularity must be one of {', '.join(GRANULARITIES)}")
+    dimensions = [d.strip() for d in group_by.split(",") if d.strip()] if group_by else []
+    unknown = [d for d in dimensions if d not in DIMENSIONS]
+    if unknown or len(set(dimensions)) != len(dimensions):
+        raise HTTPException(status_code=400, detail=f"group_by must be distinct values from {', '.join(DIMENSIONS)}")
+    
+    key = partition.adjusted_key()
+    etag = make_etag("rollups", key + (zlib.crc32(str(request.url.query).encode()),))
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    
+    try:
+        rows = partition.rollup_store().query(
+            granularity, dimensions, start_date, end_date, category, account_id, merchant,
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="start_date and end_date must be YYYY-MM-DD")
+    return FastJSONResponse(
+        {"granularity": granularity, "group_by": dimensions, "rows": rows}, headers={"ETag": etag},
+    )
+
+@app.get("/search", response_model=SearchResponse)
+async def search_transactions(
+    request: Request,
+    q: str,
+    offset: int = 0,
+    limit: int = 50,
+    partition: UserPartition = Depends(get_partition),
+):
+    """
+    Full-text search over transaction names, merchants and categories.
+    
+    Every word of q must match a word of the transaction exactly, as a
+    prefix or with one typo. Results are ranked by match quality (merchant
+    over name over category), newest first among equals; offset/limit page
+    through them and total counts every match.
+    """
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="q must not be empty")
+    if offset < 0 or not 1 <= limit <= MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"offset must be >= 0 and limit between 1 and {MAX_PAGE_SIZE}")
+    
+    key = partition.adjusted_key()
+    etag = make_etag("search", key + (zlib.crc32(str(request.url.query).encode()),))
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    
+    total, hits = partition.search().search(q, offset, limit)
+    adjusted = partition.adjusted_transactions()
+    results = [dict(transaction_out(adjusted.get(tid)), score=round(score, 3)) for tid, score in hits]
+    return FastJSONResponse({"query": q, "total": total, "results": results}, headers={"ETag": etag})
+
+async def rebuild_aggregates(partition: UserPartition):
+    """
+    Build the recurring detector and insight aggregates from scratch in the
+    analytics pool. Returns (adjusted_key, detector, aggregates), or None if
+    the transactions changed while every attempt was running, as its result
+    would then describe data the partition no longer has.
+    """
+    for _ in range(AGGREGATE_REBUILD_ATTEMPTS):
+        key = partition.adjusted_key()
+        packed = await analytics.run(
+            ("aggregates", partition.user_id) + key,
+            build_aggregates, await partition.snapshot(), default_rules().known_payments,
+        )
+        recurring, rebuilt = await restore_aggregates(packed, partition.is_recurring)
+        if key == partition.adjusted_key():
+            return key, recurring, rebuilt
+    return None
+
 @app.post("/generate_insights")
-async def generate_insights():
-    """Generate advanced financial insights with early payment adjustments"""
+async def generate_insights(consistency_check: bool = False, partition: UserPartition = Depends(get_partition)):
+    """
+    Generate advanced financial insights with early payment adjustments.
+    
+    Reads the running aggregates instead of rescanning every transaction.
+    When they have to be built from scratch, that runs in the analytics
+    worker pool. consistency_check=true also compares them against a full
+    recompute there and replaces them if they drifted; it is skipped when
+    transactions keep changing while the recompute runs.
+    """
     try:
+        user_data = partition.user_data
         if not user_data["transactions"]:
             return {"error": "No transactions available. Please fetch transactions first."}
         
-        # Apply early payment adjustments
-        adjusted_transactions = detect_early_payments(user_data["transactions"])
+        stages = StageTimer(INSIGHTS_STAGE_DURATION)
+        aggregates = partition.aggregates()
+        check = None
+        if aggregates is None or consistency_check:
+            built = await rebuild_aggregates(partition)
+            # Nothing can change between here and the comparison: no awaits
+            aggregates = partition.aggregates()
+            if built is None:
+                if consistency_check:
+                    check = {"consistent": None, "skipped": "transactions kept changing during the check"}
+                if aggregates is None:
+                    raise HTTPException(status_code=503, detail="Transactions kept changing; try again shortly")
+            else:
+                key, recurring, rebuilt = built
+                mismatches = aggregates.differences(rebuilt) if aggregates is not None else []
+                if consistency_check:
+                    check = {"consistent": not mismatches, "mismatches": mismatches}
+                if mismatches:
+                    log.warning("insight_aggregates_drifted", user_id=partition.user_id, mismatches=mismatches)
+                if aggregates is None or mismatches:
+                    aggregates = rebuilt
+                    partition.install_derived(key, recurring, rebuilt)
+        stages.lap("adjustment")
         
         # Calculate basic metrics using adjusted transactions
-        total_spending = sum(t['amount'] for t in adjusted_transactions if t['amount'] > 0)
-        total_income = sum(abs(t['amount']) for t in adjusted_transactions if t['amount'] < 0)
+        total_spending = aggregates.total_spending / 100
+        total_income = aggregates.total_income / 100
         net_cashflow = total_income - total_spending
         total_balance = sum(a['balance'] for a in user_data["accounts"])
         
-        # Group spending by category
-        spending_by_category = {}
-        monthly_spending = {}
-        merchant_spending = {}
-        
-        for transaction in adjusted_transactions:
-            if transaction['amount'] > 0:  # Only spending (positive amounts)
-                # Category analysis
-                if transaction['category']:
-                    category = transaction['category'][0]
-                    spending_by_category[category] = spending_by_category.get(category, 0) + transaction['amount']
-                
-                # Monthly analysis (using adjusted dates)
-                month = transaction['date'][:7]  # YYYY-MM format
-                monthly_spending[month] = monthly_spending.get(month, 0) + transaction['amount']
-                
-                # Merchant analysis
-                if transaction['merchant_name']:
-                    merchant = transaction['merchant_name']
-                    merchant_spending[merchant] = merchant_spending.get(merchant, 0) + transaction['amount']
+        spending_by_category = aggregates.spending_by_category()
+        monthly_spending = aggregates.monthly_spending()
+        merchant_spending = aggregates.merchant_spending()
         
         # Calculate savings rate
         savings_rate = (net_cashflow / total_income * 100) if total_income > 0 else 0
         
         # Top spending analysis
-        top_categories = sorted(spending_by_category.items(), key=lambda x: x[1], reverse=True)[:5]
-        top_merchants = sorted(merchant_spending.items(), key=lambda x: x[1], reverse=True)[:5]
+        top_categories = heapq.nlargest(5, spending_by_category.items(), key=lambda x: x[1])
+        top_merchants = heapq.nlargest(5, merchant_spending.items(), key=lambda x: x[1])
         
-        # Monthly trend analysis
+        # Monthly trend: the latest month against the average of up to three before it
         sorted_months = sorted(monthly_spending.items())
-        monthly_trend = "increasing" if len(sorted_months) >= 2 and sorted_months[-1][1] > sorted_months[-2][1] else "decreasing"
+        previous = [amount for _, amount in sorted_months[-4:-1]]
+        monthly_trend = "increasing" if previous and sorted_months[-1][1] > sum(previous) / len(previous) else "decreasing"
         
-        # Count adjusted transactions
-        adjusted_count = len([t for t in adjusted_transactions if t.get('date_adjusted')])
+        adjusted_count = aggregates.adjusted_count
+        recurring_adjusted_count = aggregates.recurring_adjusted_count
         
         # Generate smart recommendations
         recommendations = []
@@ -499,6 +875,9 @@ async def generate_insights():
         if adjusted_count > 0:
             recommendations.append(f"Adjusted {adjusted_count} early payment(s) to their intended months for accurate analysis.")
         
+        if recurring_adjusted_count > 0:
+            recommendations.append(f"Moved {recurring_adjusted_count} recurring payment(s) that posted early or late to their intended months.")
+        
         if savings_rate < 20:
             recommendations.append(f"Your savings rate is {savings_rate:.1f}%. Consider aiming for 20% or higher.")
         
@@ -506,7 +885,7 @@ async def generate_insights():
             top_category = top_categories[0]
             recommendations.append(f"You spent ${top_category[1]:.2f} on {top_category[0]}. Review if this aligns with your priorities.")
         
-        if len([t for t in adjusted_transactions if "subscription" in t['name'].lower() or "monthly" in t['name'].lower()]) > 0:
+        if aggregates.subscription_count > 0:
             recommendations.append("Review your subscriptions - you may have recurring charges to optimize.")
         
         if monthly_trend == "increasing":
@@ -529,58 +908,139 @@ async def generate_insights():
             "recommendations": recommendations,
             "transaction_count": len(user_data["transactions"]),
             "adjusted_transactions_count": adjusted_count,
-            "analysis_period": f"{len(set(t['date'][:7] for t in adjusted_transactions))} months",
+            "recurring_adjusted_count": recurring_adjusted_count,
+            "analysis_period": f"{len(aggregates.active_months)} months",
             "generated_at": datetime.now().isoformat()
         }
+        stages.lap("aggregation")
         
-        user_data["insights"].append(insights)
-        save_user_data()  # Save after generating insights
+        partition.append_insight(insights)
+        await partition.commit()
+        stages.lap("persistence")
+        if check is not None:
+            return {"insights": insights, "consistency_check": check}
         return {"insights": insights}
         
+    except HTTPException:
+        raise
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Insight generation timed out")
+    except JobCancelled:
+        raise HTTPException(status_code=503, detail="Insight generation was cancelled")
     except Exception as e:
-        print(f"Error generating insights: {e}")
+        log.exception("generate_insights_failed")
         raise HTTPException(status_code=500, detail=str(e))
 
+# Fields /insights/history returns when none are asked for
+HISTORY_FIELDS = ("total_spending", "total_income", "net_cashflow", "savings_rate", "total_balance", "transaction_count")
+
+@app.get("/insights/history", response_model=InsightsHistoryResponse)
+async def get_insights_history(
+    request: Request,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    fields: Optional[str] = None,
+    partition: UserPartition = Depends(get_partition),
+):
+    """
+    Insight snapshots generated between start and end (inclusive, YYYY-MM-DD
+    or ISO datetimes), oldest first, for charting how they changed.
+    
+    fields is a comma-separated list of insight keys to return (e.g.
+    total_spending,spending_by_category); the headline totals by default.
+    Older history is downsampled by the retention policy, so a long range
+    comes back at a coarser resolution rather than longer.
+    """
+    selected = [f.strip() for f in fields.split(",") if f.strip()] if fields else list(HISTORY_FIELDS)
+    if not selected:
+        raise HTTPException(status_code=400, detail="fields must name at least one insight key")
+    try:
+        start, end = (parse_bound(v) if v else None for v in (start, end))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="start and end must be YYYY-MM-DD or ISO datetimes")
+    
+    key = partition.versions.key("insights")
+    etag = make_etag("insights-history", key + (zlib.crc32(str(request.url.query).encode()),))
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    
+    points = partition.user_data["insights"].range(start, end, selected)
+    return FastJSONResponse(
+        {"start": start, "end": end, "fields": selected, "points": points}, headers={"ETag": etag},
+    )
+
+class InstitutionDirectory:
+    """The cached institution list plus lower-cased names for search"""
+    
+    def __init__(self, institutions):
+        self.institutions = institutions
+        self.names = [institution["name"].lower() for institution in institutions]
+    
+    def search(self, query):
+        """Institutions whose name contains query, name-prefix matches first"""
+        query = query.strip().lower()
+        if not query:
+            return self.institutions
+        prefix_matches, other_matches = [], []
+        for institution, name in zip(self.institutions, self.names):
+            if name.startswith(query):
+                prefix_matches.append(institution)
+            elif query in name:
+                other_matches.append(institution)
+        return prefix_matches + other_matches
+
+_institution_directory = InstitutionDirectory([])
+
+async def get_institution_directory():
+    global _institution_directory
+    institutions = await reference_cache.get(
+        "institutions:US",
+        lambda: run_plaid(fetch_institutions, get_plaid_client(), ("US",)),
+        ttl=INSTITUTIONS_TTL, stale_ttl=INSTITUTIONS_STALE_TTL, persist=True,
+    )
+    # Only re-index when the cache handed back a new list
+    if _institution_directory.institutions is not institutions:
+        _institution_directory = InstitutionDirectory(institutions)
+    return _institution_directory
+
 @app.get("/available_institutions")
-async def get_available_institutions():
-    """Get list of available institutions"""
+async def get_available_institutions(query: Optional[str] = None, offset: int = 0, limit: int = 50):
+    """
+    Get list of available institutions.
+    
+    Served from the cached full directory; query filters by name and
+    offset/limit page through the matches.
+    """
+    if offset < 0 or not 1 <= limit <= 500:
+        raise HTTPException(status_code=400, detail="offset must be >= 0 and limit between 1 and 500")
     try:
-        request = InstitutionsGetRequest(
-            count=50,
-            offset=0,
-            country_codes=[CountryCode("US")]
-        )
-        response = plaid_client.institutions_get(request)
-        institutions = []
-        for institution in response.institutions:
-            institutions.append({
-                "institution_id": str(institution.institution_id),
-                "name": str(institution.name),
-                "products": [str(product) for product in institution.products] if institution.products else []
-            })
-        return {"institutions": institutions}
+        directory = await get_institution_directory()
+        matches = directory.search(query or "")
+        return {"institutions": matches[offset:offset + limit], "total": len(matches)}
     except Exception as e:
-        print(f"Error fetching institutions: {e}")
+        log.error("institutions_fetch_failed", error=str(e))
         return {"institutions": []}
 
 @app.post("/refresh_data")
-async def refresh_data():
-    """Refresh both accounts and transactions data"""
+async def refresh_data(partition: UserPartition = Depends(get_partition)):
+    """
+    Queue a refresh of accounts and transactions and return its job id
+    straight away; poll /refresh_jobs/{job_id} for the outcome. A refresh
+    already waiting for this user is reused.
+    """
+    user_data = partition.user_data
     try:
-        # Refresh accounts
-        for access_token in user_data["access_tokens"]:
-            await fetch_accounts(access_token)
-        # Refresh transactions
-        await fetch_transactions()
-        save_user_data()  # Save after refreshing
+        job = scheduler.submit(partition.user_id)
         return {
             "success": True,
-            "message": "Data refreshed successfully",
+            "message": "Refresh queued",
+            "job_id": job.job_id,
+            "status": job.status,
             "accounts_count": len(user_data["accounts"]),
             "transactions_count": len(user_data["transactions"])
         }
     except Exception as e:
-        print(f"Error refreshing data: {e}")
+        log.error("refresh_submit_failed", user_id=partition.user_id, error=str(e))
         return {
             "success": False,
             "message": str(e),
@@ -588,21 +1048,104 @@ async def refresh_data():
             "transactions_count": len(user_data["transactions"])
         }
 
+@app.get("/refresh_jobs/{job_id}")
+async def get_refresh_job(job_id: str, partition: UserPartition = Depends(get_partition)):
+    """Status of a refresh job"""
+    job = scheduler.get(job_id)
+    if job is None or job.user_id != partition.user_id:
+        raise HTTPException(status_code=404, detail="Unknown refresh job")
+    return job.to_dict()
+
+class PlaidWebhook(BaseModel):
+    webhook_type: str
+    webhook_code: str
+    item_id: Optional[str] = None
+
+# Transactions webhooks that mean new data is ready to sync
+SYNC_WEBHOOK_CODES = {"SYNC_UPDATES_AVAILABLE", "DEFAULT_UPDATE", "INITIAL_UPDATE", "HISTORICAL_UPDATE"}
+
+@app.post("/plaid/webhook")
+async def plaid_webhook(webhook: PlaidWebhook):
+    """
+    Receive Plaid webhooks and queue a refresh of the Item that has updates.
+    
+    Only ever refreshes an Item that is already registered, so an unsigned
+    request can at worst trigger an extra (coalesced) sync.
+    """
+    if webhook.webhook_type != "TRANSACTIONS" or webhook.webhook_code not in SYNC_WEBHOOK_CODES:
+        return {"received": True, "job_id": None}
+    item = registry.find(webhook.item_id) if webhook.item_id else None
+    if item is None:
+        log.warning("webhook_unknown_item", item_id=webhook.item_id, webhook_code=webhook.webhook_code)
+        return {"received": True, "job_id": None}
+    user_id, access_token = item
+    # The Item has changed, so its cached Plaid answers and account metadata are stale
+    forget_item(access_token)
+    job = scheduler.submit(user_id, access_token, reason="webhook")
+    log.info("webhook_refresh_queued", item_id=webhook.item_id, job_id=job.job_id)
+    return {"received": True, "job_id": job.job_id}
+
+async def refresh_partition(partition: UserPartition, access_tokens=None):
+    """Refresh accounts and transactions of the given Items (default: all of them)"""
+    known = partition.user_data["access_tokens"]
+    tokens = list(known) if access_tokens is None else [t for t in access_tokens if t in known]
+    # Refresh every Item concurrently (a sync updates its accounts too); the Items
+    # that work are applied even when others fail, and then the refresh as a whole fails
+    synced = await asyncio.gather(
+        *(sync_access_token(partition, access_token) for access_token in tokens),
+        return_exceptions=True,
+    )
+    failed = item_failures(tokens, synced)
+    if failed:
+        raise RuntimeError(failure_summary(failed, len(tokens)))
+    return {
+        "items": len(tokens),
+        "added": sum(r[0] for r in synced),
+        "modified": sum(r[1] for r in synced),
+        "removed": sum(r[2] for r in synced),
+        "accounts_count": len(partition.user_data["accounts"]),
+        "transactions_count": len(partition.user_data["transactions"]),
+    }
+
+async def run_refresh_job(job):
+    """Run a scheduler job against its user's partition"""
+    partition = await partitions.acquire(job.user_id)
+    try:
+        access_tokens = None if job.access_token is None else [job.access_token]
+        try:
+            async with partition.lock:
+                return await refresh_partition(partition, access_tokens)
+        finally:
+            # Whatever the Items that did refresh applied is kept, even when the job fails
+            await partition.commit()
+    finally:
+        partitions.release(partition)
+
+# Jobs for the same user or Item run one at a time and coalesce while they wait
+scheduler = RefreshScheduler(run_refresh_job, items=registry.items)
+
+Gauge("partitions_loaded", "User partitions currently in memory", lambda: len(partitions.loaded()))
+Gauge("refresh_jobs_queued", "Refresh jobs waiting to run", lambda: scheduler.queued_count())
+Gauge("analytics_jobs_running", "Analytics jobs queued or running in the worker pool", lambda: analytics.running())
+Gauge("refcache_entries", "Entries in the reference data cache", lambda: reference_cache.stats()["entries"])
+
 @app.post("/clear_data")
-async def clear_data():
+async def clear_data(partition: UserPartition = Depends(get_partition)):
     """Clear all stored data"""
     try:
-        global user_data
-        user_data = {
-            "access_tokens": [],
-            "accounts": [],
-            "transactions": [],
-            "insights": []
-        }
-        save_user_data()
+        # Waits for any refresh of this user to finish first
+        async with partition.lock:
+            for access_token in partition.user_data["access_tokens"]:
+                forget_item(access_token)
+            partition.clear()
+            registry.remove_user(partition.user_id)
+            # Anything still computing from the old data is wasted work
+            analytics.cancel(lambda key: key[1] == partition.user_id)
+            analytics.forget(lambda key: key[1] == partition.user_id)
+        await partition.commit()
         return {"success": True, "message": "All data cleared successfully"}
     except Exception as e:
-        print(f"Error clearing data: {e}")
+        log.error("clear_data_failed", user_id=partition.user_id, error=str(e))
         return {"success": False, "message": str(e)}
 
 if __name__ == "__main__":
@@ -0,0 +1,213 @@
+import hashlib
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (1, 10, 100, 1000, 10000, 100000, 1000000)
+
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in (*zip(names, values), *extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            lines.extend(self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        for key, value in sorted(self._values.items()):
+            yield f"{self.name}_total{_labels(self.labelnames, key)} {_number(value)}"
+
+
+class Gauge(_Metric):
+    """A value read from a callback at scrape time"""
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, callback):
+        super().__init__(name, documentation)
+        self.callback = callback
+
+    def _samples(self):
+        yield f"{self.name} {_number(self.callback())}"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                # [count per bucket..., +Inf count], sum
+                series = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self):
+        for key, (counts, total) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                le = _labels(self.labelnames, key, [("le", _number(bound))])
+                yield f"{self.name}_bucket{le} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}"
+            yield f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}"
+
+
+def render():
+    """Every registered metric in the Prometheus text exposition format"""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def item_label(access_token):
+    """Stable, non-secret label for an access token"""
+    if not access_token:
+        return "none"
+    return hashlib.sha256(str(access_token).encode()).hexdigest()[:12]
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording request latency per route template, up to the
+    last body chunk so streamed responses are timed in full.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            HTTP_REQUEST_DURATION.observe(
+                time.perf_counter() - start,
+                method=scope["method"],
+                route=getattr(route, "path", "unmatched"),
+                status=status[0],
+            )
+
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Request latency by route", ("method", "route", "status"),
+)
+INSIGHTS_STAGE_DURATION = Histogram(
+    "insights_stage_duration_seconds", "Time spent in each /generate_insights stage", ("stage",),
+)
+PLAID_REQUESTS = Counter(
+    "plaid_requests", "Plaid API calls, including retried attempts", ("method", "item", "outcome"),
+)
+PLAID_REQUEST_DURATION = Histogram(
+    "plaid_request_duration_seconds", "Plaid API call latency", ("method",),
+)
+PLAID_GATEWAY = Counter(
+    "plaid_gateway", "Plaid calls answered without a request of their own (cached, shared), "
+    "hedges sent and calls delayed by the rate limiter", ("method", "outcome"),
+)
+PLAID_PAGES = Counter(
+    "plaid_pages", "Paginated Plaid responses fetched", ("method", "item"),
+)
+STORE_FLUSH_DURATION = Histogram(
+    "store_flush_duration_seconds", "Time to apply one coalesced journal batch to SQLite",
+)
+STORE_FLUSH_ENTRIES = Histogram(
+    "store_flush_entries", "Journal entries coalesced into one SQLite flush", buckets=SIZE_BUCKETS,
+)
+STORE_FLUSH_FAILURES = Counter(
+    "store_flush_failures", "Failed attempts to apply a journal batch to SQLite",
+)
+JOURNAL_QUARANTINED_ENTRIES = Counter(
+    "journal_quarantined_entries", "Journal entries that could not be applied, moved to .failed side files",
+)
+ANALYTICS_JOBS = Counter(
+    "analytics_jobs", "Analytics jobs by outcome (ok, cached, failed, timeout, cancelled)", ("job", "outcome"),
+)
+ANALYTICS_JOB_DURATION = Histogram(
+    "analytics_job_duration_seconds", "Wall time of analytics jobs run in the worker pool", ("job",),
+)
+JOURNAL_APPEND_BYTES = Histogram(
+    "journal_append_bytes", "Size of each journal append", buckets=SIZE_BUCKETS,
+)
+JOURNAL_APPEND_DURATION = Histogram(
+    "journal_append_duration_seconds", "Time to append (and fsync) one group of journal entries",
+)
+
+
+class StageTimer:
+    """Times consecutive stages of one operation into a histogram labelled by stage"""
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+        self._last = time.perf_counter()
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        self.histogram.observe(now - self._last, stage=stage)
+        self._last = now
@@ -0,0 +1,411 @@
+import asyncio
+import os
+import re
+from collections import OrderedDict
+
+from aggregates import InsightsAggregator
+from early_payments import adjust_transaction, default_rules, detect_early_payments, rules_version
+from forecast import build_forecast
+from insights_history import normalized
+from journal import JournaledStore
+from logs import get_logger
+from recurring import RecurringDetector
+from rollups import RollupStore
+from schemas import account_out
+from search_index import SearchIndex
+from storage import TransactionStore, empty_user_data
+from versioning import DataVersions, VersionedCache
+
+log = get_logger("partitions")
+
+# Requests without an X-User-Id header belong to this user
+DEFAULT_USER_ID = os.getenv("DEFAULT_USER_ID", "default")
+# One SQLite database (plus journal) per user lives in here
+USER_DATA_DIR = os.getenv("USER_DATA_DIR", "users")
+# Partitions kept in memory; idle ones beyond this are evicted, least recently used first
+MAX_LOADED_PARTITIONS = int(os.getenv("MAX_LOADED_PARTITIONS", "256"))
+# An import chunk changing more than this fraction of the history drops the
+# derived state instead of updating it, so it is rebuilt once on next read
+IMPORT_REBUILD_RATIO = 0.25
+
+# User ids end up in file names, so keep them to a safe alphabet
+USER_ID_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.@-]{0,63}$")
+
+
+def valid_user_id(user_id):
+    return bool(user_id) and USER_ID_PATTERN.match(user_id) is not None
+
+
+def _same_transaction(stored, transaction):
+    """Whether a stored row already holds exactly this raw transaction"""
+    return (
+        stored.account_id == transaction["account_id"]
+        and stored.amount == transaction["amount"]
+        and stored.original_date == transaction["date"]
+        and stored.name == transaction["name"]
+        and stored.category == tuple(transaction["category"])
+        and stored.merchant_name == transaction["merchant_name"]
+    )
+
+
+class UserPartition:
+    """
+    Everything one user's requests touch: the in-memory data, its journaled
+    store, the read caches and insight aggregates, and the lock that keeps
+    that user's refreshes from interleaving.
+    """
+
+    def __init__(self, user_id, db_path, journal_path, legacy_json=None):
+        self.user_id = user_id
+        self.db = TransactionStore(db_path)
+        if legacy_json:
+            self.db.migrate_from_json(legacy_json)
+        # Writes are journaled first and flushed to SQLite in coalesced batches;
+        # opening the journal replays anything a crash left behind
+        self.store = JournaledStore(self.db, journal_path)
+        self.user_data = self.store.load()
+
+        # Read endpoints cache their payloads until the data they depend on changes
+        self.versions = DataVersions()
+        self.adjusted_cache = VersionedCache()
+        self.accounts_cache = VersionedCache()
+        self.dashboard_cache = VersionedCache()
+        self.transactions_adjusted_cache = VersionedCache()
+        self.forecast_cache = VersionedCache()
+        self.recurring = RecurringDetector()
+        self.aggregator = InsightsAggregator(self.is_recurring)
+        self.rollups = RollupStore()
+        self.search_index = SearchIndex()
+
+        # Created on the event loop by PartitionManager
+        self.lock = None
+        self.active = 0
+        self.closed = False
+        self._inflight = {}
+        # TransactionTable.snapshot() pieces and the transactions version they are of
+        self._snapshot = None
+        self._snapshot_key = None
+
+    # Reads
+
+    def adjusted_key(self):
+        return self.versions.key("transactions") + (rules_version(),)
+
+    def recurring_series(self):
+        """The recurring payment detector, built from the full history on first use"""
+        if not self.recurring.built:
+            self.recurring.rebuild(self.user_data["transactions"])
+        return self.recurring
+
+    def is_recurring(self, transaction_id):
+        return self.recurring_series().is_recurring(transaction_id)
+
+    def search(self):
+        """The full-text search index, built from the full history on first use"""
+        if not self.search_index.built:
+            self.search_index.rebuild(self.user_data["transactions"])
+        return self.search_index
+
+    def adjusted_transactions(self):
+        """Early-payment adjusted transactions, recomputed only when transactions or config change"""
+        return self.adjusted_cache.get(
+            self.adjusted_key(),
+            lambda: detect_early_payments(
+                self.user_data["transactions"],
+                detected=self.recurring_series().adjustments,
+                # Configured keyword rules are answered from the search index
+                index=self.search() if default_rules().payment_types else None,
+            ),
+        )
+
+    async def snapshot(self):
+        """
+        The transaction table serialized for analytics workers, reused until
+        transactions change. Built a piece at a time so other requests keep
+        being served meanwhile.
+        """
+        key = self.versions.key("transactions")
+        if self._snapshot_key != key:
+            pieces = []
+            for piece in self.user_data["transactions"].snapshot():
+                pieces.append(piece)
+                await asyncio.sleep(0)
+            self._snapshot, self._snapshot_key = pieces, key
+        return self._snapshot
+
+    def forecast(self, as_of):
+        """
+        The full-length cash-flow forecast from the close of day ordinal
+        as_of, recomputed only when transactions, accounts or the day change
+        """
+        key = self.versions.key("transactions", "accounts") + (as_of,)
+        return self.forecast_cache.get(
+            key,
+            lambda: build_forecast(
+                self.user_data["accounts"], self.user_data["transactions"], self.recurring_series(), as_of,
+            ),
+        )
+
+    def public_accounts(self):
+        return [account_out(account) for account in self.user_data["accounts"]]
+
+    def aggregates(self):
+        """
+        Running insight aggregates if they are current, else None: a rebuild
+        is a full pass over the history, left to an analytics worker (see
+        install_derived).
+        """
+        return self.aggregator if self.aggregator.rules_version == rules_version() else None
+
+    def rollup_store(self):
+        """Materialized day/week/month rollups, rebuilt only when the early-payment config changes"""
+        if self.rollups.rules_version != rules_version():
+            self.rollups.rebuild(self.adjusted_transactions(), rules_version())
+        return self.rollups
+
+    # Writes
+
+    def add_access_token(self, access_token):
+        if access_token not in self.user_data["access_tokens"]:
+            self.user_data["access_tokens"].append(access_token)
+        self.store.add_access_token(access_token)
+
+    def replace_accounts(self, access_token, accounts):
+        """Replace the accounts of one access token to avoid duplicates"""
+        current = [acc for acc in self.user_data["accounts"] if acc.get("access_token") == access_token]
+        if current == list(accounts):
+            return
+        self.user_data["accounts"] = [
+            acc for acc in self.user_data["accounts"] if acc.get("access_token") != access_token
+        ]
+        self.user_data["accounts"].extend(accounts)
+        self.store.replace_accounts(access_token, accounts)
+        self.versions.bump("accounts")
+
+    def apply_transaction_changes(self, upserts, removed_ids, access_token=None, cursor=None):
+        """Merge added/modified/removed transactions into memory and the store"""
+        self.user_data["transactions"].remove(removed_ids)
+        self.user_data["transactions"].upsert(upserts)
+        self.store.apply_transaction_changes(upserts, removed_ids, access_token=access_token, cursor=cursor)
+        self.versions.bump("transactions")
+        if self.search_index.built:
+            self.search_index.apply(upserts, removed_ids)
+        moved = self.recurring.apply(upserts, removed_ids) if self.recurring.built else set()
+        current = [
+            derived for derived in (self.aggregator, self.rollups) if derived.rules_version == rules_version()
+        ]
+        if current:
+            # A change can move other postings of the same series too; refold those with it
+            refold = ({t["transaction_id"] for t in upserts} | moved) - set(removed_ids)
+            table, detected = self.user_data["transactions"], self.recurring_series().adjustments
+            adjusted = [adjust_transaction(table.get(tid), detected) for tid in refold]
+            for derived in current:
+                derived.apply(adjusted, removed_ids)
+
+    def install_derived(self, key, recurring, aggregator):
+        """
+        Adopt a recurring detector and aggregates built elsewhere (by an
+        analytics worker) from the data at adjusted_key() `key`. Ignored,
+        returning False, when the data has changed since.
+        """
+        if key != self.adjusted_key():
+            return False
+        self.recurring = recurring
+        aggregator.is_recurring = self.is_recurring
+        aggregator.rules_version = key[-1]
+        self.aggregator = aggregator
+        return True
+
+    def import_transactions(self, transactions):
+        """
+        Upsert one chunk of imported transactions, deduplicated by
+        transaction_id; rows identical to the stored ones are skipped.
+        Returns (added, updated, unchanged) counts.
+        """
+        table = self.user_data["transactions"]
+        chunk = {t["transaction_id"]: t for t in transactions}
+        changed, added = [], 0
+        for transaction_id, transaction in chunk.items():
+            existing = table.get(transaction_id)
+            if existing is None:
+                added += 1
+            elif _same_transaction(existing, transaction):
+                continue
+            changed.append(transaction)
+        if changed:
+            if len(changed) > IMPORT_REBUILD_RATIO * len(table):
+                self.drop_derived()
+            self.apply_transaction_changes(changed, [])
+        return added, len(changed) - added, len(transactions) - len(changed)
+
+    def append_insight(self, insights):
+        """Add a generated snapshot to the insights history, persisting only what changed in it"""
+        rows, removed = self.user_data["insights"].append(normalized(insights))
+        self.store.write_insights(rows, removed)
+        self.versions.bump("insights")
+
+    async def commit(self):
+        """Wait until the writes made so far are in the journal on disk; await before acknowledging them"""
+        await self.store.commit()
+
+    def clear(self):
+        # Cleared in place so requests already holding user_data see it too
+        self.user_data.clear()
+        self.user_data.update(empty_user_data())
+        self.store.clear()
+        self.versions.bump()
+        self.drop_derived()
+
+    def drop_derived(self):
+        """Forget series, aggregates, rollups and the search index; each rebuilds on next use"""
+        self.recurring.reset()
+        self.aggregator.reset()
+        self.rollups.reset()
+        self.search_index.reset()
+
+    # Concurrency
+
+    async def single_flight(self, key, factory):
+        """
+        Run factory() under the partition lock. Callers asking for the same
+        key while it is already running share its result instead of running
+        it again.
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._locked(factory))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # A caller disconnecting must not cancel the work other callers wait on
+        return await asyncio.shield(task)
+
+    async def _locked(self, factory):
+        async with self.lock:
+            return await factory()
+
+    @property
+    def busy(self):
+        return self.active > 0 or self.lock.locked() or bool(self._inflight)
+
+    async def close(self):
+        self.closed = True
+        await self.store.stop()
+        await asyncio.to_thread(self.store.close)
+
+
+class PartitionManager:
+    """
+    Lazily loaded, LRU-evicted UserPartitions.
+
+    A partition is opened on a worker thread the first time its user makes a
+    request (concurrent first requests share one load). Once more than
+    max_loaded partitions are in memory, the least recently used idle ones are
+    flushed and closed in the background; they are reloaded from disk on the
+    next request.
+    """
+
+    def __init__(self, data_dir=USER_DATA_DIR, max_loaded=MAX_LOADED_PARTITIONS,
+                 default_user_id=DEFAULT_USER_ID, default_db=None, legacy_json=None, on_load=None):
+        self.data_dir = data_dir
+        self.max_loaded = max_loaded
+        self.default_user_id = default_user_id
+        # The default user keeps the single-user database from before partitioning
+        self.default_db = default_db
+        self.legacy_json = legacy_json
+        # Called with every partition right after it is loaded
+        self.on_load = on_load
+        self._partitions = OrderedDict()
+        self._loading = {}
+        self._closing = {}
+        self._started = False
+
+    def paths(self, user_id):
+        """(database, journal) paths of a user's store"""
+        if user_id == self.default_user_id and self.default_db:
+            db_path = self.default_db
+        else:
+            db_path = os.path.join(self.data_dir, f"{user_id}.db")
+        return db_path, db_path + ".journal"
+
+    def loaded(self):
+        return list(self._partitions)
+
+    def peek(self, user_id):
+        """The user's partition if it is in memory, without marking it used"""
+        return self._partitions.get(user_id)
+
+    async def acquire(self, user_id):
+        """Return the user's partition, loading it if needed; pair with release()"""
+        if not valid_user_id(user_id):
+            raise ValueError(f"invalid user id {user_id!r}")
+        while True:
+            partition = self._partitions.get(user_id)
+            if partition is None:
+                loading = self._loading.get(user_id)
+                if loading is None:
+                    loading = self._loading[user_id] = asyncio.ensure_future(self._open(user_id))
+                partition = await asyncio.shield(loading)
+            # Evicted between loading and resuming here; load it again
+            if not partition.closed:
+                break
+        self._partitions.move_to_end(user_id)
+        partition.active += 1
+        self._evict()
+        return partition
+
+    def release(self, partition):
+        partition.active -= 1
+        self._evict()
+
+    async def _open(self, user_id):
+        try:
+            # Never open a store while its previous instance is still flushing
+            closing = self._closing.get(user_id)
+            if closing is not None:
+                await asyncio.shield(closing)
+            db_path, journal_path = self.paths(user_id)
+            legacy_json = self.legacy_json if user_id == self.default_user_id else None
+            os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+            partition = await asyncio.to_thread(UserPartition, user_id, db_path, journal_path, legacy_json)
+            partition.lock = asyncio.Lock()
+            if self._started:
+                partition.store.start()
+            if self.on_load is not None:
+                self.on_load(partition)
+            self._partitions[user_id] = partition
+            return partition
+        finally:
+            self._loading.pop(user_id, None)
+
+    def _evict(self):
+        excess = len(self._partitions) - self.max_loaded
+        if excess <= 0:
+            return
+        victims = [p for p in self._partitions.values() if not p.busy][:excess]
+        for partition in victims:
+            del self._partitions[partition.user_id]
+            log.debug("partition_evicted", user_id=partition.user_id, loaded=len(self._partitions))
+            task = asyncio.ensure_future(partition.close())
+            self._closing[partition.user_id] = task
+            task.add_done_callback(lambda t, user_id=partition.user_id: self._closed(user_id, t))
+
+    def _closed(self, user_id, task):
+        if self._closing.get(user_id) is task:
+            del self._closing[user_id]
+        if not task.cancelled() and task.exception() is not None:
+            log.error("partition_close_failed", user_id=user_id, error=str(task.exception()))
+
+    def start(self):
+        """Start the background journal flushers on the running event loop"""
+        self._started = True
+        for partition in self._partitions.values():
+            partition.store.start()
+
+    async def close_all(self):
+        """Flush and close every loaded partition"""
+        self._started = False
+        partitions = list(self._partitions.values())
+        self._partitions.clear()
+        await asyncio.gather(
+            *(p.close() for p in partitions), *self._closing.values(), return_exceptions=True
+        )
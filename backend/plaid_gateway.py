@@ -0,0 +1,344 @@
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+import weakref
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from functools import partial
+
+from metrics import PLAID_GATEWAY, PLAID_REQUEST_DURATION, PLAID_REQUESTS, item_label
+
+# Size of the shared worker pool the blocking Plaid SDK calls run on
+PLAID_MAX_WORKERS = int(os.getenv("PLAID_MAX_WORKERS", "8"))
+# How many calls may be in flight at once for a single Item (one linked institution)
+PLAID_ITEM_CONCURRENCY = int(os.getenv("PLAID_ITEM_CONCURRENCY", "2"))
+PLAID_MAX_RETRIES = int(os.getenv("PLAID_MAX_RETRIES", "4"))
+PLAID_BACKOFF_BASE = float(os.getenv("PLAID_BACKOFF_BASE", "0.5"))
+PLAID_BACKOFF_MAX = 8.0
+# Requests per minute sent for one Item and in total; 0 is unlimited. Like
+# Plaid's own limits they apply per minute, so up to a minute's worth may go at once
+PLAID_ITEM_RATE_LIMIT = float(os.getenv("PLAID_ITEM_RATE_LIMIT", "50"))
+PLAID_GLOBAL_RATE_LIMIT = float(os.getenv("PLAID_GLOBAL_RATE_LIMIT", "2500"))
+# Seconds an answer to a cacheable read is reused for identical requests; 0 disables the cache
+PLAID_CACHE_TTL = float(os.getenv("PLAID_CACHE_TTL", "30"))
+PLAID_CACHE_SIZE = int(os.getenv("PLAID_CACHE_SIZE", "256"))
+# A read still unanswered after this many seconds is sent again and the first
+# answer wins; once enough latencies are known, their 95th percentile is used
+# instead. 0 disables hedging
+PLAID_HEDGE_AFTER = float(os.getenv("PLAID_HEDGE_AFTER", "2.0"))
+HEDGE_QUANTILE = 0.95
+HEDGE_MIN_SAMPLES = 20
+# Never hedge sooner than this, so a fast but jittery upstream is not asked everything twice
+HEDGE_MIN_DELAY = 0.05
+LATENCY_WINDOW = 200
+# Idle Items' rate limit buckets are dropped once there are this many
+ITEM_BUCKETS_PRUNE_AT = 1024
+
+# Reads that can safely be shared between callers and sent twice
+READ_METHODS = frozenset({"accounts_get", "transactions_get", "transactions_sync", "institutions_get"})
+# Reads whose answer only changes when the Item does. A sync page at the
+# latest cursor is new as soon as there is new data, and /accounts/get
+# carries balances, so neither is ever cached
+CACHED_METHODS = frozenset({"transactions_get", "institutions_get"})
+
+_executor = ThreadPoolExecutor(max_workers=PLAID_MAX_WORKERS, thread_name_prefix="plaid")
+# Attempts of hedged reads; never waits on anything itself, so it cannot deadlock with _executor
+_attempts = ThreadPoolExecutor(max_workers=2 * PLAID_MAX_WORKERS, thread_name_prefix="plaid-attempt")
+# Held only by the calls using them, so an Item's entry goes once it is idle
+_item_semaphores = weakref.WeakValueDictionary()
+
+
+def is_rate_limited(exc):
+    """True for Plaid 429 / RATE_LIMIT_EXCEEDED errors"""
+    from plaid.exceptions import ApiException
+
+    if not isinstance(exc, ApiException):
+        return False
+    if exc.status == 429:
+        return True
+    try:
+        return json.loads(exc.body).get("error_type") == "RATE_LIMIT_EXCEEDED"
+    except (TypeError, ValueError, AttributeError):
+        return False
+
+
+def with_retries(fn, *args, **kwargs):
+    """
+    Call a blocking Plaid method, retrying rate-limit errors with jittered
+    exponential backoff. Runs on a worker thread, so sleeping here never
+    blocks the event loop.
+    """
+    attempt = 0
+    while True:
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            if not is_rate_limited(e) or attempt >= PLAID_MAX_RETRIES:
+                raise
+            delay = min(PLAID_BACKOFF_MAX, PLAID_BACKOFF_BASE * (2 ** attempt))
+            time.sleep(delay * random.uniform(0.5, 1.0))
+            attempt += 1
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilling `rate` tokens a second, holding at most `burst`"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self):
+        """
+        Take a token, returning the seconds to wait before using it. The
+        bucket may go into debt, so waiting callers are served in order.
+        """
+        with self._lock:
+            self._refill()
+            self._tokens -= 1
+            return -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+    def try_take(self):
+        """Take a token only if one is available right now"""
+        with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def give_back(self):
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + 1)
+
+    def full(self):
+        """Whether the bucket has refilled completely, i.e. is no different from a new one"""
+        with self._lock:
+            self._refill()
+            return self._tokens >= self.burst
+
+
+def _fingerprint(request):
+    """Stable text identifying a request's contents"""
+    to_dict = getattr(request, "to_dict", None)
+    fields = to_dict() if to_dict is not None else vars(request)
+    return json.dumps(fields, sort_keys=True, default=str)
+
+
+class PlaidGateway:
+    """
+    Stands in front of a plaid_api.PlaidApi (or anything with the same
+    methods, like benchmarks/fake_plaid.FakePlaid) and is called the same
+    way, from worker threads.
+
+    Every request waits for a token from its Item's bucket and the global
+    one, so bursts are spread out instead of answered with 429s. Reads are
+    also deduplicated: an identical read already in flight is joined, and
+    answers to CACHED_METHODS are reused for cache_ttl seconds (forget()
+    drops an Item's once it has changed). A read slower than its method's
+    usual latency is sent a second time if the rate limits allow it right
+    away, and whichever answer comes first is used.
+    """
+
+    def __init__(self, client, item_rate_limit=PLAID_ITEM_RATE_LIMIT, global_rate_limit=PLAID_GLOBAL_RATE_LIMIT,
+                 cache_ttl=PLAID_CACHE_TTL, cache_size=PLAID_CACHE_SIZE, hedge_after=PLAID_HEDGE_AFTER,
+                 burst_seconds=60.0):
+        self.client = client
+        self.item_rate_limit = item_rate_limit
+        self.burst_seconds = burst_seconds
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self.hedge_after = hedge_after
+        self._global = self._bucket(global_rate_limit) if global_rate_limit > 0 else None
+        self._lock = threading.Lock()
+        self._item_buckets = {}
+        # (method, access token, fingerprint) -> Future of the read in flight
+        self._inflight = {}
+        # (method, access token, fingerprint) -> (expires at, response)
+        self._cache = OrderedDict()
+        # method -> recent successful latencies, for the hedge delay
+        self._latencies = {}
+
+    def __getattr__(self, name):
+        if name.startswith("_") or name == "client":
+            raise AttributeError(name)
+        method = getattr(self.client, name)
+        if not callable(method):
+            return method
+
+        def call(request, *args, **kwargs):
+            return self.call(name, request, *args, **kwargs)
+        call.__name__ = name
+        return call
+
+    def call(self, method, request, *args, **kwargs):
+        if method not in READ_METHODS or args or kwargs:
+            return self._send(method, request, *args, **kwargs)
+        item = getattr(request, "access_token", None)
+        key = (method, item, _fingerprint(request))
+        cached = method in CACHED_METHODS and self.cache_ttl > 0
+        with self._lock:
+            if cached:
+                entry = self._cache.get(key)
+                if entry is not None and entry[0] > time.monotonic():
+                    self._cache.move_to_end(key)
+                    PLAID_GATEWAY.inc(method=method, outcome="cached")
+                    return entry[1]
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+        if not leader:
+            PLAID_GATEWAY.inc(method=method, outcome="shared")
+            return future.result()
+
+        try:
+            response = self._hedged(method, request, item)
+        except BaseException as e:
+            with self._lock:
+                del self._inflight[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            if cached:
+                self._cache[key] = (time.monotonic() + self.cache_ttl, response)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+            del self._inflight[key]
+        future.set_result(response)
+        return response
+
+    def forget(self, access_token=None):
+        """Drop cached answers for an Item (default: for every Item)"""
+        with self._lock:
+            for key in [key for key in self._cache if access_token is None or key[1] == access_token]:
+                del self._cache[key]
+
+    # Rate limits
+
+    def _bucket(self, per_minute):
+        rate = per_minute / 60
+        return TokenBucket(rate, max(1.0, rate * self.burst_seconds))
+
+    def _buckets(self, item):
+        buckets = []
+        if item and self.item_rate_limit > 0:
+            with self._lock:
+                bucket = self._item_buckets.get(item)
+                if bucket is None:
+                    if len(self._item_buckets) >= ITEM_BUCKETS_PRUNE_AT:
+                        self._prune_buckets()
+                    bucket = self._item_buckets[item] = self._bucket(self.item_rate_limit)
+            buckets.append(bucket)
+        if self._global is not None:
+            buckets.append(self._global)
+        return buckets
+
+    def _prune_buckets(self):
+        """Drop the buckets of Items that have been idle long enough to refill; the caller holds _lock"""
+        for item in [item for item, bucket in self._item_buckets.items() if bucket.full()]:
+            del self._item_buckets[item]
+
+    def _try_take(self, item):
+        taken = []
+        for bucket in self._buckets(item):
+            if not bucket.try_take():
+                for other in taken:
+                    other.give_back()
+                return False
+            taken.append(bucket)
+        return True
+
+    # Upstream
+
+    def _send(self, method, request, *args, reserved=False, **kwargs):
+        """One request to the wrapped client, after waiting for its rate limits unless reserved"""
+        item = getattr(request, "access_token", None)
+        if not reserved:
+            delay = max((bucket.reserve() for bucket in self._buckets(item)), default=0.0)
+            if delay > 0:
+                PLAID_GATEWAY.inc(method=method, outcome="throttled")
+                time.sleep(delay)
+        start = time.perf_counter()
+        try:
+            response = getattr(self.client, method)(request, *args, **kwargs)
+        except Exception as e:
+            PLAID_REQUEST_DURATION.observe(time.perf_counter() - start, method=method)
+            PLAID_REQUESTS.inc(method=method, item=item_label(item),
+                               outcome="rate_limited" if is_rate_limited(e) else "error")
+            raise
+        elapsed = time.perf_counter() - start
+        PLAID_REQUEST_DURATION.observe(elapsed, method=method)
+        PLAID_REQUESTS.inc(method=method, item=item_label(item), outcome="ok")
+        with self._lock:
+            latencies = self._latencies.get(method)
+            if latencies is None:
+                latencies = self._latencies[method] = deque(maxlen=LATENCY_WINDOW)
+            latencies.append(elapsed)
+        return response
+
+    def _hedge_delay(self, method):
+        if self.hedge_after <= 0:
+            return 0.0
+        with self._lock:
+            latencies = sorted(self._latencies.get(method, ()))
+        if len(latencies) < HEDGE_MIN_SAMPLES:
+            return self.hedge_after
+        return max(HEDGE_MIN_DELAY, latencies[int(HEDGE_QUANTILE * (len(latencies) - 1))])
+
+    def _hedged(self, method, request, item):
+        delay = self._hedge_delay(method)
+        if not delay:
+            return self._send(method, request)
+        primary = _attempts.submit(self._send, method, request)
+        done, _ = wait([primary], timeout=delay)
+        # No hedge when the limits would make it wait: it would only add load
+        if done or not self._try_take(item):
+            return primary.result()
+        PLAID_GATEWAY.inc(method=method, outcome="hedged")
+        pending = {primary, _attempts.submit(self._send, method, request, reserved=True)}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for attempt in done:
+                if attempt.exception() is None:
+                    # The slower attempt finishes on its own; its answer is dropped
+                    return attempt.result()
+                error = error or attempt.exception()
+        raise error
+
+
+def _item_semaphore(item_key):
+    semaphore = _item_semaphores.get(item_key)
+    if semaphore is None:
+        semaphore = _item_semaphores[item_key] = asyncio.Semaphore(PLAID_ITEM_CONCURRENCY)
+    return semaphore
+
+
+async def run_plaid(fn, *args, item_key=None, **kwargs):
+    """
+    Run a blocking Plaid call (or a function making several of them) on the
+    bounded worker pool. Calls sharing an item_key are limited to
+    PLAID_ITEM_CONCURRENCY at a time.
+    """
+    loop = asyncio.get_running_loop()
+    call = partial(fn, *args, **kwargs)
+    if item_key is None:
+        return await loop.run_in_executor(_executor, call)
+    async with _item_semaphore(item_key):
+        return await loop.run_in_executor(_executor, call)
+
+
+async def call_plaid(fn, *args, item_key=None, **kwargs):
+    """Run a single Plaid SDK call on the worker pool with rate-limit retries"""
+    return await run_plaid(with_retries, fn, *args, item_key=item_key, **kwargs)
@@ -0,0 +1,153 @@
+import json
+
+# The Plaid SDK is slow to import, so its models are imported inside the
+# functions that build requests; those only run once a Plaid client exists
+from logs import get_logger
+from metrics import PLAID_PAGES, item_label
+from plaid_gateway import with_retries
+
+log = get_logger("plaid_sync")
+
+SYNC_PAGE_SIZE = 500
+GET_PAGE_SIZE = 500
+INSTITUTIONS_PAGE_SIZE = 500
+# Plaid serves at most two years of history (days_requested is 1..730)
+MAX_BACKFILL_DAYS = 730
+
+# Returned by /transactions/sync when the Item changed while we were paging;
+# the whole pagination loop has to restart from the original cursor.
+MUTATION_DURING_PAGINATION = "TRANSACTIONS_SYNC_MUTATION_DURING_PAGINATION"
+
+
+def transaction_to_dict(transaction):
+    """Convert a Plaid transaction object to the plain dict we store"""
+    category_list = []
+    if hasattr(transaction, 'category') and transaction.category:
+        category_list = [str(cat) for cat in transaction.category]
+
+    merchant_name = None
+    if hasattr(transaction, 'merchant_name') and transaction.merchant_name:
+        merchant_name = str(transaction.merchant_name)
+
+    return {
+        "transaction_id": str(transaction.transaction_id),
+        "account_id": str(transaction.account_id),
+        "amount": float(transaction.amount),
+        "date": str(transaction.date),
+        "name": str(transaction.name),
+        "category": category_list,
+        "merchant_name": merchant_name,
+    }
+
+
+def account_balance(account):
+    """Current balance of a Plaid account object, 0 when Plaid has none"""
+    balances = getattr(account, "balances", None)
+    if balances is not None and getattr(balances, "current", None) is not None:
+        return float(balances.current)
+    return 0
+
+
+def _error_code(exc):
+    try:
+        return json.loads(exc.body).get("error_code")
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+def sync_transactions(client, access_token, cursor=None, days_requested=None):
+    """
+    Pull every change since `cursor` from /transactions/sync.
+
+    Returns (added, modified, removed_ids, next_cursor, balances), balances
+    mapping account id -> current balance as of the sync (empty if Plaid
+    sent no accounts). Nothing should be applied until this returns, so a
+    failed pagination loop leaves the store and the saved cursor untouched.
+    """
+    from plaid.exceptions import ApiException
+    from plaid.model.transactions_sync_request import TransactionsSyncRequest
+    from plaid.model.transactions_sync_request_options import TransactionsSyncRequestOptions
+
+    start_cursor = cursor
+    item = item_label(access_token)
+    while True:
+        added, modified, removed_ids, balances = [], [], [], {}
+        cursor = start_cursor
+        try:
+            while True:
+                request_args = {"access_token": access_token, "count": SYNC_PAGE_SIZE}
+                if cursor:
+                    request_args["cursor"] = cursor
+                elif days_requested:
+                    # Only honoured on the very first sync of an Item
+                    request_args["options"] = TransactionsSyncRequestOptions(days_requested=days_requested)
+
+                response = with_retries(client.transactions_sync, TransactionsSyncRequest(**request_args))
+                PLAID_PAGES.inc(method="transactions_sync", item=item)
+                added.extend(transaction_to_dict(t) for t in response.added)
+                modified.extend(transaction_to_dict(t) for t in response.modified)
+                removed_ids.extend(str(t.transaction_id) for t in response.removed)
+                # Every page carries the Item's accounts; the last one has the newest balances
+                for account in getattr(response, "accounts", None) or ():
+                    balances[str(account.account_id)] = account_balance(account)
+                cursor = response.next_cursor
+
+                if not response.has_more:
+                    return added, modified, removed_ids, cursor, balances
+        except ApiException as e:
+            if _error_code(e) != MUTATION_DURING_PAGINATION:
+                raise
+            log.warning("sync_pagination_restarted", item=item, reason=MUTATION_DURING_PAGINATION)
+
+
+def fetch_transaction_history(client, access_token, start_date, end_date):
+    """Download every transaction in [start_date, end_date] with /transactions/get paging"""
+    from plaid.model.transactions_get_request import TransactionsGetRequest
+    from plaid.model.transactions_get_request_options import TransactionsGetRequestOptions
+
+    transactions = []
+    total_transactions = None
+    while total_transactions is None or len(transactions) < total_transactions:
+        request = TransactionsGetRequest(
+            access_token=access_token,
+            start_date=start_date,
+            end_date=end_date,
+            options=TransactionsGetRequestOptions(count=GET_PAGE_SIZE, offset=len(transactions)),
+        )
+        response = with_retries(client.transactions_get, request)
+        PLAID_PAGES.inc(method="transactions_get", item=item_label(access_token))
+        total_transactions = response.total_transactions
+        if not response.transactions:
+            break
+        transactions.extend(transaction_to_dict(t) for t in response.transactions)
+    return transactions
+
+
+def institution_to_dict(institution):
+    return {
+        "institution_id": str(institution.institution_id),
+        "name": str(institution.name),
+        "products": [str(product) for product in institution.products] if institution.products else []
+    }
+
+
+def fetch_institutions(client, country_codes=("US",)):
+    """Download the whole institution directory with /institutions/get paging"""
+    from plaid.model.country_code import CountryCode
+    from plaid.model.institutions_get_request import InstitutionsGetRequest
+
+    institutions = []
+    total = None
+    while total is None or len(institutions) < total:
+        request = InstitutionsGetRequest(
+            count=INSTITUTIONS_PAGE_SIZE,
+            offset=len(institutions),
+            country_codes=[CountryCode(code) for code in country_codes],
+        )
+        response = with_retries(client.institutions_get, request)
+        PLAID_PAGES.inc(method="institutions_get", item="none")
+        total = response.total
+        if not response.institutions:
+            break
+        institutions.extend(institution_to_dict(i) for i in response.institutions)
+    return institutions
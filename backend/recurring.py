@@ -0,0 +1,309 @@
+import calendar
+import os
+import re
+from bisect import bisect_right
+from collections import Counter
+from datetime import date
+from functools import lru_cache
+from operator import itemgetter
+from statistics import median
+
+from txtable import TransactionTable, date_to_day, day_to_date
+
+# Fewest postings that make a series
+RECURRING_MIN_OCCURRENCES = int(os.getenv("RECURRING_MIN_OCCURRENCES", "3"))
+# Share of a series' date gaps that must fit its period
+RECURRING_REGULARITY = float(os.getenv("RECURRING_REGULARITY", "0.75"))
+# Postings further than this from their expected date are irregular, not early or late
+RECURRING_MAX_SHIFT_DAYS = int(os.getenv("RECURRING_MAX_SHIFT_DAYS", "5"))
+# An amount bucket spans at most this fraction (plus AMOUNT_SLACK dollars) above its smallest amount
+AMOUNT_TOLERANCE = 0.10
+AMOUNT_SLACK = 1.00
+
+# Recurring charges above this are bills rather than subscriptions, unless called one
+SUBSCRIPTION_MAX_AMOUNT = float(os.getenv("SUBSCRIPTION_MAX_AMOUNT", "100"))
+# Category words of recurring payments that are never subscriptions
+NON_SUBSCRIPTION_CATEGORIES = (
+    "loan", "mortgage", "rent", "housing", "payment", "transfer", "utilities", "insurance", "credit card", "tax",
+)
+# Payment types the detector gives the adjustments it makes
+DETECTED_PAYMENT_TYPE_PREFIX = "recurring_"
+
+# (period, nominal days between postings, accepted gap range)
+PERIODS = (
+    ("weekly", 7, (5, 9)),
+    ("biweekly", 14, (11, 17)),
+    ("monthly", 30, (25, 35)),
+)
+
+_NOT_LETTERS = re.compile(r"[^a-z ]+")
+
+
+@lru_cache(maxsize=65536)
+def normalize_merchant(name):
+    """'STARBUCKS #1234' -> 'starbucks': lowercased, digits and punctuation dropped"""
+    normalized = " ".join(_NOT_LETTERS.sub(" ", name.lower()).split())
+    return normalized or name.lower()
+
+
+def is_subscription_like(transaction):
+    """
+    Whether a recurring charge looks like a subscription: not a loan, housing,
+    utility, insurance or transfer payment (by category, or by a configured
+    early payment rule matching it), and either called a subscription or
+    small enough to be one.
+    """
+    payment_type = transaction.get("payment_type")
+    if payment_type and not payment_type.startswith(DETECTED_PAYMENT_TYPE_PREFIX):
+        return False
+    category = " ".join(transaction["category"]).lower()
+    if any(word in category for word in NON_SUBSCRIPTION_CATEGORIES):
+        return False
+    if "subscription" in category or "subscription" in transaction["name"].lower():
+        return True
+    return abs(transaction["amount"]) <= SUBSCRIPTION_MAX_AMOUNT
+
+
+def is_detected_adjustment(transaction):
+    """Whether an adjusted transaction was moved by the detector rather than a configured rule"""
+    payment_type = transaction.get("payment_type")
+    return bool(payment_type) and payment_type.startswith(DETECTED_PAYMENT_TYPE_PREFIX)
+
+
+def _records(transactions):
+    """(transaction_id, day ordinal, amount, label) for raw or stored transactions"""
+    if isinstance(transactions, TransactionTable):
+        return transactions.records()
+    return (
+        (t["transaction_id"], date_to_day(t.get("original_date") or t["date"]), t["amount"],
+         t.get("merchant_name") or t["name"])
+        for t in transactions
+    )
+
+
+@lru_cache(maxsize=65536)
+def _nearest_due(day, anchor):
+    """The date with day-of-month `anchor` (clamped to month length) closest to `day`"""
+    posted = date.fromordinal(day)
+    best = None
+    for step in (-1, 0, 1):
+        year, month = posted.year, posted.month + step
+        if month == 0:
+            year, month = year - 1, 12
+        elif month == 13:
+            year, month = year + 1, 1
+        due = date(year, month, min(anchor, calendar.monthrange(year, month)[1])).toordinal()
+        if best is None or abs(day - due) < abs(day - best):
+            best = due
+    return best
+
+
+def _cyclic_offset(day, phase, period):
+    """Days after (positive) or before (negative) the nearest day congruent to phase"""
+    r = (day - phase) % period
+    return r if r <= period // 2 else r - period
+
+
+def _schedule(days, period, nominal):
+    """Expected posting day for each posting, and the next one after the last"""
+    if period == "monthly":
+        # Candidate anchors are the most common posting days; the best one is
+        # closest to every posting (a due-on-the-1st bill paid on the 30th is
+        # one or two days early, not 29 late)
+        candidates = [a for a, _ in Counter(date.fromordinal(d).day for d in days).most_common(3)]
+        anchor = min(candidates, key=lambda a: sum(abs(d - _nearest_due(d, a)) for d in days))
+        expected = [_nearest_due(d, anchor) for d in days]
+        return expected, _nearest_due(expected[-1] + 30, anchor)
+    candidates = [p for p, _ in Counter(d % nominal for d in days).most_common(3)]
+    phase = min(candidates, key=lambda p: sum(abs(_cyclic_offset(d, p, nominal)) for d in days))
+    expected = [d - _cyclic_offset(d, phase, nominal) for d in days]
+    return expected, expected[-1] + nominal
+
+
+def _fit_bucket(merchant, outflow, bucket):
+    """A series dict plus {transaction_id: (days, payment_type)} for one amount bucket, or None"""
+    if len(bucket) < RECURRING_MIN_OCCURRENCES:
+        return None
+    # Enough regular gaps of even the shortest period cannot fit in the date
+    # span of a dense bucket (daily card spend), so skip sorting it at all
+    span = max(m[1] for m in bucket) - min(m[1] for m in bucket)
+    if span < RECURRING_REGULARITY * (len(bucket) - 1) * PERIODS[0][2][0]:
+        return None
+    bucket.sort(key=itemgetter(1))
+    days = [m[1] for m in bucket]
+    gaps = [b - a for a, b in zip(days, days[1:])]
+    typical = median(gaps)
+    for period, nominal, (low, high) in PERIODS:
+        if low <= typical <= high:
+            break
+    else:
+        return None
+    if sum(1 for g in gaps if low <= g <= high) < RECURRING_REGULARITY * len(gaps):
+        return None
+
+    expected, next_due = _schedule(days, period, nominal)
+    payment_type = f"{DETECTED_PAYMENT_TYPE_PREFIX}{period}"
+    off_schedule = []
+    adjustments = {}
+    for (transaction_id, day, _, _), due in zip(bucket, expected):
+        offset = day - due
+        if offset == 0 or abs(offset) > RECURRING_MAX_SHIFT_DAYS:
+            continue
+        posted, due_date = day_to_date(day), day_to_date(due)
+        off_schedule.append({
+            "transaction_id": transaction_id, "date": posted, "expected_date": due_date, "days": offset,
+        })
+        # Only postings that landed in the wrong month move; the rest are just flagged
+        if posted[:7] != due_date[:7]:
+            adjustments[transaction_id] = (-offset, payment_type)
+
+    amount = median(m[2] for m in bucket)
+    series = {
+        "series_id": f"{merchant}|{'out' if outflow else 'in'}|{period}|{abs(amount):.0f}",
+        "name": Counter(m[3] for m in bucket).most_common(1)[0][0],
+        "direction": "outflow" if outflow else "inflow",
+        "period": period,
+        "amount": round(amount, 2),
+        "count": len(bucket),
+        "first_date": day_to_date(days[0]),
+        "last_date": day_to_date(days[-1]),
+        "next_expected_date": day_to_date(next_due),
+        # The latest posting, e.g. to find which account the series pays from
+        "last_transaction_id": bucket[-1][0],
+        "early": sum(1 for p in off_schedule if p["days"] < 0),
+        "late": sum(1 for p in off_schedule if p["days"] > 0),
+        "off_schedule": off_schedule,
+    }
+    return series, adjustments, [m[0] for m in bucket]
+
+
+def fit_group(merchant, outflow, members):
+    """
+    Split one merchant/direction group into amount buckets and fit each.
+
+    members are (transaction_id, day, amount, label). Sorted by amount, a new
+    bucket starts wherever an amount is more than AMOUNT_TOLERANCE above the
+    current bucket's smallest. Returns (series list, adjustments, member ids).
+    """
+    series, adjustments, recurring = [], {}, []
+    # Smallest magnitude first; inflows are negative
+    members = sorted(members, key=itemgetter(2), reverse=not outflow)
+    magnitudes = [abs(m[2]) for m in members]
+    start = 0
+    while start < len(members):
+        end = bisect_right(magnitudes, magnitudes[start] * (1 + AMOUNT_TOLERANCE) + AMOUNT_SLACK, start)
+        fitted = _fit_bucket(merchant, outflow, members[start:end])
+        if fitted is not None:
+            series.append(fitted[0])
+            adjustments.update(fitted[1])
+            recurring.extend(fitted[2])
+        start = end
+    return series, adjustments, recurring
+
+
+class RecurringDetector:
+    """
+    Recurring payment series in a transaction history, kept up to date as
+    transactions change.
+
+    Transactions are hashed into groups by normalized merchant and direction
+    (money out or in); each group is bucketed by amount and each bucket fitted
+    to a weekly, biweekly or monthly period from its date gaps. Postings off
+    their expected date are flagged early or late, and those that landed in
+    a different month than intended become date adjustments for
+    detect_early_payments. All work is per group and sort-based, so a rebuild
+    is O(n log n) and apply() only refits the groups a change touched.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.built = False
+        # transaction_id -> group key
+        self._rows = {}
+        # group key -> {transaction_id: (transaction_id, day, amount, label)}
+        self._groups = {}
+        # group key -> (series, adjustments, member ids) from its last fit, for groups with a series
+        self._fits = {}
+        # transaction_id -> (days, payment_type), for postings to move into their intended month
+        self.adjustments = {}
+        # Ids of transactions that belong to some series
+        self.recurring = set()
+
+    def rebuild(self, transactions):
+        self.reset()
+        for record in _records(transactions):
+            self._put(record)
+        for key in list(self._groups):
+            self._refit(key)
+        self.built = True
+
+    def apply(self, upserts=(), removed_ids=()):
+        """
+        Fold raw added/modified/removed transactions in. Returns the ids of
+        other transactions whose adjustment or series membership changed as a
+        result, so callers can refresh anything derived from them.
+        """
+        touched = set()
+        for transaction_id in removed_ids:
+            touched.add(self._drop(transaction_id))
+        for record in _records(upserts):
+            touched.add(self._drop(record[0]))
+            touched.add(self._put(record))
+        touched.discard(None)
+
+        changed = set()
+        for key in touched:
+            _, old_adjustments, old_members = self._fits.get(key, ((), {}, ()))
+            _, new_adjustments, new_members = self._refit(key)
+            old_members, new_members = set(old_members), set(new_members)
+            changed |= old_members ^ new_members
+            changed.update(
+                tid for tid in old_members & new_members if old_adjustments.get(tid) != new_adjustments.get(tid)
+            )
+        return {tid for tid in changed if tid in self._rows}
+
+    def _put(self, record):
+        key = (normalize_merchant(record[3]), record[2] > 0)
+        self._rows[record[0]] = key
+        group = self._groups.get(key)
+        if group is None:
+            group = self._groups[key] = {}
+        group[record[0]] = record
+        return key
+
+    def _drop(self, transaction_id):
+        key = self._rows.pop(transaction_id, None)
+        if key is None:
+            return None
+        del self._groups[key][transaction_id]
+        return key
+
+    def _refit(self, key):
+        """Refit one group, replacing its previous series; returns the new fit"""
+        previous = self._fits.pop(key, None)
+        if previous is not None:
+            for transaction_id in previous[2]:
+                self.adjustments.pop(transaction_id, None)
+                self.recurring.discard(transaction_id)
+        members = self._groups.get(key)
+        if not members:
+            self._groups.pop(key, None)
+            return (), {}, ()
+        fit = fit_group(key[0], key[1], list(members.values()))
+        if fit[0]:
+            self._fits[key] = fit
+            self.adjustments.update(fit[1])
+            self.recurring.update(fit[2])
+        return fit
+
+    # Reads
+
+    def series(self):
+        """Every detected series, soonest next expected posting first"""
+        found = [s for series, _, _ in self._fits.values() for s in series]
+        return sorted(found, key=lambda s: (s["next_expected_date"], s["series_id"]))
+
+    def is_recurring(self, transaction_id):
+        return transaction_id in self.recurring
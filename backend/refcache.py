@@ -0,0 +1,164 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from logs import get_logger
+
+log = get_logger("refcache")
+
+# Entries kept in memory; the least recently used are dropped beyond this
+REFCACHE_MAX_ENTRIES = int(os.getenv("REFCACHE_MAX_ENTRIES", "1024"))
+# JSON file persistable entries are written to so a restart starts warm; unset disables it
+REFCACHE_FILE = os.getenv("REFCACHE_FILE")
+
+
+class _Entry:
+    __slots__ = ("value", "fetched_at", "ttl", "stale_ttl", "persist")
+
+    def __init__(self, value, fetched_at, ttl, stale_ttl, persist):
+        self.value = value
+        self.fetched_at = fetched_at
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.persist = persist
+
+    def age(self, now):
+        return now - self.fetched_at
+
+
+class ReferenceCache:
+    """
+    TTL cache for slow-changing upstream data (institutions, account metadata).
+
+    An entry younger than its ttl is served as is. Once older, it is still
+    served for up to stale_ttl more seconds while a single background load
+    refreshes it (stale-while-revalidate); past that, callers wait for a
+    fresh load. Concurrent loads of the same key are shared, and a failed
+    background refresh keeps serving the stale value.
+
+    Entries stored with persist=True are also written to `path` and read
+    back on startup, keeping their original fetch time, so after a restart
+    they are served straight away and revalidated if they have gone stale.
+    """
+
+    def __init__(self, max_entries=REFCACHE_MAX_ENTRIES, path=REFCACHE_FILE):
+        self.max_entries = max_entries
+        self.path = path
+        self._entries = OrderedDict()
+        self._loads = {}
+        self._disk_lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        if path:
+            self._read_disk()
+
+    async def get(self, key, loader, ttl, stale_ttl=0, persist=False):
+        """
+        Cached value for key; loader() is an async callable producing a fresh
+        one. persisted values must be JSON serializable and keys strings.
+        """
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            age = entry.age(now)
+            if age < entry.ttl:
+                self.hits += 1
+                return entry.value
+            if age < entry.ttl + entry.stale_ttl:
+                self.stale_hits += 1
+                if key not in self._loads:
+                    self._load(key, loader, ttl, stale_ttl, persist).add_done_callback(_log_failure(key))
+                return entry.value
+        self.misses += 1
+        try:
+            return await asyncio.shield(self._load(key, loader, ttl, stale_ttl, persist))
+        except Exception as e:
+            if entry is None:
+                raise
+            # Upstream is down: an old value beats no value
+            log.warning("refcache_serving_expired", key=_key_label(key), error=str(e))
+            return entry.value
+
+    def _load(self, key, loader, ttl, stale_ttl, persist):
+        task = self._loads.get(key)
+        if task is None:
+            task = self._loads[key] = asyncio.ensure_future(self._fetch(key, loader, ttl, stale_ttl, persist))
+        return task
+
+    async def _fetch(self, key, loader, ttl, stale_ttl, persist):
+        try:
+            value = await loader()
+        finally:
+            self._loads.pop(key, None)
+        self._store(key, value, ttl, stale_ttl, persist)
+        if persist and self.path:
+            try:
+                await asyncio.to_thread(self._write_disk, self._snapshot())
+            except OSError as e:
+                log.error("refcache_write_failed", path=self.path, error=str(e))
+        return value
+
+    def _store(self, key, value, ttl, stale_ttl, persist):
+        self._entries[key] = _Entry(value, time.time(), ttl, stale_ttl, persist)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def put(self, key, value, ttl, stale_ttl=0):
+        """Store a value the caller fetched itself (not persisted)"""
+        self._store(key, value, ttl, stale_ttl, False)
+
+    def invalidate(self, key):
+        self._entries.pop(key, None)
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+        }
+
+    # Warm cache on disk
+
+    def _snapshot(self):
+        return {
+            key: {"value": e.value, "fetched_at": e.fetched_at, "ttl": e.ttl, "stale_ttl": e.stale_ttl}
+            for key, e in self._entries.items() if e.persist
+        }
+
+    def _write_disk(self, snapshot):
+        with self._disk_lock:
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(snapshot, f)
+            os.replace(tmp, self.path)
+
+    def _read_disk(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+        except (json.JSONDecodeError, IOError):
+            log.warning("refcache_read_failed", path=self.path)
+            return
+        for key, e in snapshot.items():
+            self._entries[key] = _Entry(e["value"], e["fetched_at"], e["ttl"], e["stale_ttl"], True)
+
+
+def _key_label(key):
+    # Tuple keys carry an access token after the kind; never log it
+    return str(key[0]) if isinstance(key, tuple) else str(key)
+
+
+def _log_failure(key):
+    def callback(task):
+        if not task.cancelled() and task.exception() is not None:
+            log.warning("refcache_serving_stale", key=_key_label(key), error=str(task.exception()))
+    return callback
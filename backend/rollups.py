@@ -0,0 +1,191 @@
+from datetime import date
+from functools import lru_cache
+
+from txtable import date_to_day, day_to_date
+
+GRANULARITIES = ("day", "week", "month", "total")
+# group_by name -> position in a cell's dimension key
+DIMENSIONS = {"category": 0, "account_id": 1, "merchant": 2}
+
+
+def _month_of(day):
+    return day_to_date(day)[:7]
+
+
+@lru_cache(maxsize=16384)
+def _week_of(day):
+    """Ordinal of the Monday starting the week"""
+    return day - date.fromordinal(day).weekday()
+
+
+def _period_bounds(granularity, day):
+    """First day of the week/month containing day, and the first day after it"""
+    if granularity == "week":
+        start = _week_of(day)
+        return start, start + 7
+    d = date.fromordinal(day)
+    return d.replace(day=1).toordinal(), date(d.year + d.month // 12, d.month % 12 + 1, 1).toordinal()
+
+
+def _label(granularity, day):
+    if granularity == "day":
+        return day_to_date(day)
+    if granularity == "week":
+        return day_to_date(_week_of(day))
+    if granularity == "month":
+        return _month_of(day)
+    return None
+
+
+class RollupStore:
+    """
+    Materialized spending/income rollups by day, week and month, each broken
+    down by (primary category, account, merchant) and kept up to date as
+    adjusted transactions are ingested, modified or removed.
+
+    Like InsightsAggregator, amounts are integer cents and every transaction's
+    contribution is remembered so it can be subtracted exactly. A cell is
+    [spending cents, income cents, count] and disappears when empty.
+
+    Queries stitch a date range together from whole months (or weeks) plus
+    day cells at the edges, so their cost depends on the number of periods
+    and dimension combinations, not on the number of transactions.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self, rules_version=None):
+        self.rules_version = rules_version
+        self.by_day = {}
+        self.by_week = {}
+        self.by_month = {}
+        self._contributions = {}
+
+    def rebuild(self, adjusted_transactions, rules_version=None):
+        self.reset(rules_version)
+        for transaction in adjusted_transactions:
+            self._add(transaction["transaction_id"], self._contribution(transaction))
+
+    def apply(self, upserts=(), removed_ids=()):
+        """Fold removed transactions and adjusted added/modified ones in"""
+        for transaction_id in removed_ids:
+            self._remove(transaction_id)
+        for transaction in upserts:
+            transaction_id = transaction["transaction_id"]
+            self._remove(transaction_id)
+            self._add(transaction_id, self._contribution(transaction))
+
+    @staticmethod
+    def _contribution(transaction):
+        category = transaction["category"]
+        dims = (
+            category[0] if category else "Uncategorized",
+            transaction["account_id"],
+            transaction["merchant_name"],
+        )
+        return date_to_day(transaction["date"]), dims, int(round(transaction["amount"] * 100))
+
+    def _add(self, transaction_id, contribution):
+        self._contributions[transaction_id] = contribution
+        self._fold(contribution, 1)
+
+    def _remove(self, transaction_id):
+        contribution = self._contributions.pop(transaction_id, None)
+        if contribution is not None:
+            self._fold(contribution, -1)
+
+    def _fold(self, contribution, sign):
+        day, dims, cents = contribution
+        spending, income = (cents, 0) if cents > 0 else (0, -cents)
+        for level, period in ((self.by_day, day), (self.by_week, _week_of(day)), (self.by_month, _month_of(day))):
+            cells = level.get(period)
+            if cells is None:
+                cells = level[period] = {}
+            cell = cells.get(dims)
+            if cell is None:
+                cell = cells[dims] = [0, 0, 0]
+            cell[0] += sign * spending
+            cell[1] += sign * income
+            cell[2] += sign
+            if cell[2] == 0:
+                del cells[dims]
+                if not cells:
+                    del level[period]
+
+    # Queries
+
+    def bounds(self):
+        """First and last day with any transaction, as ordinals, or None"""
+        if not self.by_day:
+            return None
+        return min(self.by_day), max(self.by_day)
+
+    def _segments(self, granularity, start, end):
+        """(label, cells) pieces covering start..end exactly once"""
+        by_day = self.by_day
+        if granularity == "day":
+            for day in range(start, end + 1):
+                cells = by_day.get(day)
+                if cells:
+                    yield day_to_date(day), cells
+            return
+
+        whole = self.by_week if granularity == "week" else self.by_month
+        day = start
+        while day <= end:
+            period_start, following = _period_bounds(granularity, day)
+            if period_start == day and following - 1 <= end:
+                # The whole period is in range: use its precomputed cells
+                cells = whole.get(day if granularity == "week" else _month_of(day))
+                if cells:
+                    yield _label(granularity, day), cells
+                day = following
+            else:
+                cells = by_day.get(day)
+                if cells:
+                    yield _label(granularity, day), cells
+                day += 1
+
+    def query(self, granularity="month", group_by=(), start_date=None, end_date=None,
+              category=None, account_id=None, merchant=None):
+        """
+        Rows of {"period", <group_by dims>, "spending", "income", "count"},
+        ordered by period. Dates are inclusive YYYY-MM-DD strings on the
+        adjusted date; missing bounds default to the whole history.
+        """
+        bounds = self.bounds()
+        if bounds is None:
+            return []
+        start = max(date_to_day(start_date), bounds[0]) if start_date else bounds[0]
+        end = min(date_to_day(end_date), bounds[1]) if end_date else bounds[1]
+        positions = [DIMENSIONS[name] for name in group_by]
+        category_lower = category.lower() if category else None
+        merchant_lower = merchant.lower() if merchant else None
+
+        totals = {}
+        for label, cells in self._segments(granularity, start, end):
+            for dims, (spending, income, count) in cells.items():
+                if category_lower is not None and dims[0].lower() != category_lower:
+                    continue
+                if account_id is not None and dims[1] != account_id:
+                    continue
+                if merchant_lower is not None and (dims[2] or "").lower() != merchant_lower:
+                    continue
+                key = (label, *(dims[p] for p in positions))
+                total = totals.get(key)
+                if total is None:
+                    total = totals[key] = [0, 0, 0]
+                total[0] += spending
+                total[1] += income
+                total[2] += count
+
+        rows = []
+        for key in sorted(totals, key=lambda k: tuple("" if v is None else v for v in k)):
+            spending, income, count = totals[key]
+            row = {"period": key[0]}
+            for name, value in zip(group_by, key[1:]):
+                row[name] = value
+            row.update(spending=spending / 100, income=income / 100, count=count)
+            rows.append(row)
+        return rows
@@ -0,0 +1,209 @@
+import asyncio
+import os
+import random
+import time
+import uuid
+from collections import OrderedDict
+
+from logs import get_logger
+
+log = get_logger("scheduler")
+
+# Seconds between background refreshes of each Item; 0 turns them off
+REFRESH_INTERVAL = float(os.getenv("REFRESH_INTERVAL", "21600"))
+# Each interval is stretched or shrunk by up to this fraction so Items don't refresh in lockstep
+REFRESH_JITTER = float(os.getenv("REFRESH_JITTER", "0.1"))
+# Refresh jobs running at once across all users
+REFRESH_WORKERS = int(os.getenv("REFRESH_WORKERS", "4"))
+# Finished jobs kept around for the status endpoint
+REFRESH_JOB_HISTORY = int(os.getenv("REFRESH_JOB_HISTORY", "1000"))
+# How often the periodic loop looks for Items that are due
+SCHEDULER_TICK = 30.0
+
+
+class RefreshJob:
+    """One queued or finished refresh of a user's Items (or of a single Item)"""
+
+    def __init__(self, user_id, access_token=None, reason="manual"):
+        self.job_id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.access_token = access_token
+        self.reason = reason
+        self.status = "queued"
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.error = None
+
+    @property
+    def key(self):
+        return (self.user_id, self.access_token)
+
+    @property
+    def done(self):
+        return self.status in ("succeeded", "failed", "cancelled")
+
+    def to_dict(self):
+        # The access token never leaves the backend
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "reason": self.reason,
+            "scope": "user" if self.access_token is None else "item",
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class RefreshScheduler:
+    """
+    Background refresh jobs with per-Item coalescing.
+
+    submit() returns straight away with a job; a fixed pool of workers runs
+    jobs through run_job(job). At most one job per user/Item runs at a time
+    and at most one more waits behind it: a request that finds a job still
+    waiting gets that job back. A running job does not absorb new requests,
+    so updates that arrive mid-refresh are picked up by the follow-up.
+
+    When interval > 0 every Item returned by items() is also refreshed
+    periodically. First refreshes are spread over one interval, later ones
+    are jittered, and any finished Item job pushes that Item's next periodic
+    refresh back.
+    """
+
+    def __init__(self, run_job, items=lambda: (), interval=REFRESH_INTERVAL, jitter=REFRESH_JITTER,
+                 workers=REFRESH_WORKERS, history=REFRESH_JOB_HISTORY):
+        self.run_job = run_job
+        self.items = items
+        self.interval = interval
+        self.jitter = jitter
+        self.workers = workers
+        self.history = history
+        self._jobs = OrderedDict()
+        self._queued = {}
+        self._running = set()
+        self._deferred = {}
+        self._due = {}
+        self._queue = None
+        self._tasks = []
+
+    # Jobs
+
+    def submit(self, user_id, access_token=None, reason="manual"):
+        """Queue a refresh, or return the one already queued for the same user/Item"""
+        job = self._queued.get((user_id, access_token))
+        if job is not None:
+            return job
+        self.start()
+        job = RefreshJob(user_id, access_token, reason)
+        self._jobs[job.job_id] = job
+        self._queued[job.key] = job
+        self._queue.put_nowait(job)
+        self._trim()
+        return job
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def queued_count(self):
+        return len(self._queued)
+
+    def _trim(self):
+        while len(self._jobs) > self.history:
+            oldest = next(iter(self._jobs.values()))
+            if not oldest.done:
+                break
+            del self._jobs[oldest.job_id]
+
+    def _next_refresh(self, now):
+        return now + self.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            if job is None:
+                return
+            if job.key in self._running:
+                # Picked up again once the running job for this key finishes
+                self._deferred[job.key] = job
+                continue
+            self._queued.pop(job.key, None)
+            self._running.add(job.key)
+            job.status = "running"
+            job.started_at = time.time()
+            try:
+                job.result = await self.run_job(job)
+                job.status = "succeeded"
+            except asyncio.CancelledError:
+                job.status = "cancelled"
+                raise
+            except Exception as e:
+                log.error("refresh_job_failed", job_id=job.job_id, reason=job.reason, error=str(e))
+                job.error = str(e)
+                job.status = "failed"
+            finally:
+                job.finished_at = time.time()
+                self._running.discard(job.key)
+                deferred = self._deferred.pop(job.key, None)
+                if deferred is not None:
+                    self._queue.put_nowait(deferred)
+            if job.access_token is not None and job.key in self._due:
+                self._due[job.key] = self._next_refresh(job.finished_at)
+
+    # Periodic refreshes
+
+    def _tick(self, now):
+        """Queue every Item that is due and track newly registered ones"""
+        current = set(self.items())
+        for key in list(self._due):
+            if key not in current:
+                del self._due[key]
+        for key in current:
+            due = self._due.get(key)
+            if due is None:
+                self._due[key] = now + random.uniform(0, self.interval)
+            elif due <= now:
+                self.submit(*key, reason="scheduled")
+                self._due[key] = self._next_refresh(now)
+
+    async def _periodic(self):
+        while True:
+            try:
+                self._tick(time.time())
+            except Exception:
+                log.exception("refresh_scheduling_failed")
+            await asyncio.sleep(min(SCHEDULER_TICK, self.interval))
+
+    # Lifecycle
+
+    def start(self):
+        """Start the workers (and the periodic loop) on the running event loop"""
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        if self.interval > 0:
+            self._tasks.append(asyncio.create_task(self._periodic()))
+
+    async def stop(self):
+        """Cancel queued jobs and wait for the running ones to finish"""
+        if not self._tasks:
+            return
+        for job in self._queued.values():
+            job.status = "cancelled"
+            job.finished_at = time.time()
+        while not self._queue.empty():
+            self._queue.get_nowait()
+        self._queued.clear()
+        self._deferred.clear()
+        workers, periodic = self._tasks[:self.workers], self._tasks[self.workers:]
+        for task in periodic:
+            task.cancel()
+        for _ in workers:
+            self._queue.put_nowait(None)
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
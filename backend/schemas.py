@@ -0,0 +1,216 @@
+import json
+from typing import Dict, List, Optional
+
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+# orjson is an optional speedup, not a dependency: `pip install orjson` makes
+# every JSON body several times cheaper to render. Without it the stdlib
+# encoder produces the same documents.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Which encoder dumps() uses, reported by the benchmarks next to their timings
+JSON_ENCODER = "json" if orjson is None else "orjson"
+
+
+# Response models. Endpoints return pre-rendered FastJSONResponse bodies, so
+# FastAPI does not re-validate against these; they document the API shape.
+
+class AccountOut(BaseModel):
+    account_id: str
+    name: str
+    type: str
+    subtype: str
+    balance: float
+
+
+class TransactionOut(BaseModel):
+    transaction_id: str
+    account_id: str
+    amount: float
+    date: str
+    name: str
+    category: List[str]
+    merchant_name: Optional[str] = None
+    original_date: Optional[str] = None
+    date_adjusted: bool = False
+    payment_type: Optional[str] = None
+
+
+class AccountsResponse(BaseModel):
+    accounts: List[AccountOut]
+
+
+class TransactionsResponse(BaseModel):
+    transactions: List[TransactionOut]
+    next_cursor: Optional[str] = None
+
+
+class OffSchedulePosting(BaseModel):
+    transaction_id: str
+    date: str
+    expected_date: str
+    days: int  # negative when early, positive when late
+
+
+class RecurringSeriesOut(BaseModel):
+    series_id: str
+    name: str
+    direction: str
+    period: str
+    amount: float
+    count: int
+    first_date: str
+    last_date: str
+    next_expected_date: str
+    last_transaction_id: str
+    early: int
+    late: int
+    off_schedule: List[OffSchedulePosting]
+
+
+class RecurringPaymentsResponse(BaseModel):
+    series: List[RecurringSeriesOut]
+
+
+class RollupsResponse(BaseModel):
+    granularity: str
+    group_by: List[str]
+    # {"period", <group_by dimensions>, "spending", "income", "count"}
+    rows: List[Dict]
+
+
+class ForecastDay(BaseModel):
+    date: str
+    balance: float
+    low: float
+    high: float
+    recurring: float
+    discretionary: float
+
+
+class AccountForecast(BaseModel):
+    account_id: str
+    name: str
+    type: str
+    balance: float
+    end_balance: float
+    min_balance: float
+    min_balance_date: Optional[str] = None
+    daily: List[ForecastDay]
+
+
+class NetForecastDay(BaseModel):
+    date: str
+    balance: float
+    low: float
+    high: float
+
+
+class ForecastEvent(BaseModel):
+    date: str
+    account_id: str
+    series_id: str
+    name: str
+    amount: float
+
+
+class ForecastResponse(BaseModel):
+    as_of: str
+    days: int
+    accounts: List[AccountForecast]
+    net: List[NetForecastDay]
+    events: List[ForecastEvent]
+
+
+class InsightsHistoryResponse(BaseModel):
+    start: Optional[str] = None
+    end: Optional[str] = None
+    fields: List[str]
+    # {"generated_at", <fields>}, oldest first
+    points: List[Dict]
+
+
+class SearchHit(TransactionOut):
+    score: float
+
+
+class SearchResponse(BaseModel):
+    query: str
+    total: int
+    results: List[SearchHit]
+
+
+class ImportRowError(BaseModel):
+    record: int  # 1-based position of the record in the upload
+    error: str
+
+
+class ImportResponse(BaseModel):
+    records: int
+    added: int
+    updated: int
+    unchanged: int
+    rejected: int
+    errors: List[ImportRowError]
+    chunks: int
+    count: int
+
+
+class DashboardResponse(BaseModel):
+    accounts: List[AccountOut]
+    recent_transactions: List[TransactionOut]
+    recent_insights: List[Dict]
+
+
+def account_out(account):
+    """Public shape of a stored account (drops the access token)"""
+    return {
+        "account_id": account["account_id"],
+        "name": account["name"],
+        "type": account["type"],
+        "subtype": account["subtype"],
+        "balance": account["balance"],
+    }
+
+
+def transaction_out(transaction):
+    """
+    Public shape of an adjusted transaction. Stored rows are already typed
+    when they are ingested, so there is no per-request coercion here.
+    """
+    return {
+        "transaction_id": transaction["transaction_id"],
+        "account_id": transaction["account_id"],
+        "amount": transaction["amount"],
+        "date": transaction["date"],
+        "name": transaction["name"],
+        "category": transaction["category"],
+        "merchant_name": transaction["merchant_name"],
+        "original_date": transaction.get("original_date"),
+        "date_adjusted": transaction.get("date_adjusted", False),
+        "payment_type": transaction.get("payment_type"),
+    }
+
+
+def dumps(content):
+    """Serialize to compact JSON bytes, with orjson if it is installed and the stdlib otherwise"""
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSON response rendered by dumps(), so with orjson only if it is
+    installed. Bytes are passed through untouched so cached payloads are
+    only serialized once.
+    """
+
+    def render(self, content):
+        if isinstance(content, bytes):
+            return content
+        return dumps(content)
@@ -0,0 +1,264 @@
+import heapq
+import re
+from bisect import bisect_left, insort
+from functools import lru_cache
+from itertools import islice
+
+from txtable import TransactionTable, date_to_day
+
+# Field bits stored per (token, text) posting, with their ranking weights
+NAME_FIELD, MERCHANT_FIELD, CATEGORY_FIELD = 1, 2, 4
+FIELD_WEIGHTS = ((MERCHANT_FIELD, 3.0), (NAME_FIELD, 2.0), (CATEGORY_FIELD, 1.0))
+
+# How much of a field's weight each kind of term match earns
+EXACT_SCORE = 1.0
+PREFIX_SCORE = 0.7
+FUZZY_SCORE = 0.4
+# Shortest query term expanded to prefix / fuzzy matches
+PREFIX_MIN_LENGTH = 2
+FUZZY_MIN_LENGTH = 4
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    return _TOKEN.findall(text.lower()) if text else []
+
+
+@lru_cache(maxsize=65536)
+def _text_tokens(text):
+    """{token: field bits} for one (name, merchant_name, category) text"""
+    name, merchant_name, category = text
+    tokens = {}
+    for field, value in ((NAME_FIELD, name), (MERCHANT_FIELD, merchant_name)):
+        for token in tokenize(value):
+            tokens[token] = tokens.get(token, 0) | field
+    for part in category:
+        for token in tokenize(part):
+            tokens[token] = tokens.get(token, 0) | CATEGORY_FIELD
+    return tokens
+
+
+@lru_cache(maxsize=65536)
+def _field_weight(fields):
+    return max(weight for field, weight in FIELD_WEIGHTS if fields & field)
+
+
+def _deletes(token):
+    """The token itself plus every single-character deletion of it"""
+    return {token, *(token[:i] + token[i + 1:] for i in range(len(token)))}
+
+
+def _within_one_edit(a, b):
+    """Levenshtein distance between a and b is at most 1"""
+    if a == b:
+        return True
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) > len(b):
+        a, b = b, a
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    if len(a) == len(b):
+        return a[i + 1:] == b[i + 1:]
+    return a[i:] == b[i + 1:]
+
+
+def _records(transactions):
+    """(transaction_id, day, name, merchant_name, category) for raw or stored transactions"""
+    if isinstance(transactions, TransactionTable):
+        return transactions.texts()
+    return (
+        (t["transaction_id"], date_to_day(t.get("original_date") or t["date"]), t["name"],
+         t.get("merchant_name"), tuple(t.get("category") or ()))
+        for t in transactions
+    )
+
+
+class SearchIndex:
+    """
+    Inverted index over transaction name, merchant_name and category tokens.
+
+    Transactions sharing the same (name, merchant_name, category) text share
+    one index entry, so postings grow with distinct texts, not with rows.
+    Query terms match tokens exactly, by prefix (through a sorted
+    vocabulary) or within one edit (through a map of single-character
+    deletions, SymSpell style). Updates add and remove single transactions,
+    so syncs keep the index current without a rebuild.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.built = False
+        # transaction_id -> (text, day)
+        self._docs = {}
+        # text -> [(-day, transaction_id)] sorted, so newest first
+        self._texts = {}
+        # token -> {text: field bits}
+        self._postings = {}
+        # Sorted tokens, for prefix lookups
+        self._vocabulary = []
+        # token or token with one character deleted -> tokens it came from
+        self._variants = {}
+        # phrase -> names containing it; only valid until the set of texts changes
+        self._containing = {}
+
+    def rebuild(self, transactions):
+        self.reset()
+        docs, texts = self._docs, self._texts
+        # Group rows by text first so each distinct text is tokenized and posted once
+        for transaction_id, day, name, merchant_name, category in _records(transactions):
+            text = (name, merchant_name, category)
+            docs[transaction_id] = (text, day)
+            rows = texts.get(text)
+            if rows is None:
+                rows = texts[text] = []
+            rows.append((-day, transaction_id))
+        for text, rows in texts.items():
+            rows.sort()
+            self._post(text)
+        self.built = True
+
+    def apply(self, upserts=(), removed_ids=()):
+        for transaction_id in removed_ids:
+            self._remove(transaction_id)
+        for record in _records(upserts):
+            self._remove(record[0])
+            self._add(*record)
+
+    def _add(self, transaction_id, day, name, merchant_name, category):
+        text = (name, merchant_name, category)
+        self._docs[transaction_id] = (text, day)
+        rows = self._texts.get(text)
+        if rows is None:
+            rows = self._texts[text] = []
+            self._post(text)
+        insort(rows, (-day, transaction_id))
+
+    def _post(self, text):
+        self._containing.clear()
+        for token, fields in _text_tokens(text).items():
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = {}
+                insort(self._vocabulary, token)
+                for variant in _deletes(token):
+                    self._variants.setdefault(variant, set()).add(token)
+            postings[text] = fields
+
+    def _remove(self, transaction_id):
+        doc = self._docs.pop(transaction_id, None)
+        if doc is None:
+            return
+        text, day = doc
+        rows = self._texts[text]
+        del rows[bisect_left(rows, (-day, transaction_id))]
+        if rows:
+            return
+        del self._texts[text]
+        self._containing.clear()
+        for token in _text_tokens(text):
+            postings = self._postings[token]
+            del postings[text]
+            if not postings:
+                del self._postings[token]
+                del self._vocabulary[bisect_left(self._vocabulary, token)]
+                for variant in _deletes(token):
+                    tokens = self._variants[variant]
+                    tokens.discard(token)
+                    if not tokens:
+                        del self._variants[variant]
+
+    # Lookups
+
+    def _expand(self, term):
+        """{token: match score} for every vocabulary token a query term matches"""
+        matches = {}
+        if len(term) >= FUZZY_MIN_LENGTH:
+            for variant in _deletes(term):
+                for token in self._variants.get(variant, ()):
+                    if _within_one_edit(term, token):
+                        matches[token] = FUZZY_SCORE
+        if len(term) >= PREFIX_MIN_LENGTH:
+            vocabulary = self._vocabulary
+            i = bisect_left(vocabulary, term)
+            while i < len(vocabulary) and vocabulary[i].startswith(term):
+                matches[vocabulary[i]] = PREFIX_SCORE
+                i += 1
+        if term in self._postings:
+            matches[term] = EXACT_SCORE
+        return matches
+
+    def search(self, query, offset=0, limit=50):
+        """
+        Rank transactions matching every term of the query.
+
+        Each term scores its best-matching token in a text (exact, prefix or
+        fuzzy, times the weight of the field it is in); a text's score is the
+        sum over terms. Returns (total, [(transaction_id, score)]) for the
+        requested page, best first and newest first among equals.
+        """
+        scores = None
+        for term in dict.fromkeys(tokenize(query)):
+            term_scores = {}
+            for token, match in self._expand(term).items():
+                for text, fields in self._postings[token].items():
+                    score = match * _field_weight(fields)
+                    if score > term_scores.get(text, 0):
+                        term_scores[text] = score
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {text: score + term_scores[text] for text, score in scores.items() if text in term_scores}
+            if not scores:
+                return 0, []
+        if scores is None:
+            return 0, []
+
+        # Each text's rows are already newest first, so a score tier is a lazy
+        # merge of them and only the rows up to the end of the page are touched
+        texts = self._texts
+        tiers = {}
+        for text, score in scores.items():
+            tiers.setdefault(score, []).append(texts[text])
+        total = sum(len(texts[text]) for text in scores)
+        wanted = offset + limit
+        ranked = []
+        for score in sorted(tiers, reverse=True):
+            lists, needed = tiers[score], wanted - len(ranked)
+            if len(lists) > needed:
+                # Only texts whose newest row is among the `needed` newest heads can contribute
+                cutoff = heapq.nsmallest(needed, (rows[0] for rows in lists))[-1]
+                lists = [rows for rows in lists if rows[0] <= cutoff]
+            newest = islice(heapq.merge(*lists), needed)
+            ranked.extend((transaction_id, score) for _, transaction_id in newest)
+            if len(ranked) >= wanted:
+                break
+        return total, ranked[offset:wanted]
+
+    def names_containing(self, phrase):
+        """
+        Distinct names that contain phrase, case-insensitively: the names for
+        which `phrase in name.lower()` holds, found through the vocabulary
+        instead of scanning every row, and remembered until texts change.
+        """
+        names = self._containing.get(phrase)
+        if names is not None:
+            return names
+        lowered = phrase.lower()
+        runs = tokenize(lowered)
+        if runs:
+            # Any name containing the phrase has a token containing its longest alphanumeric run
+            anchor = max(runs, key=len)
+            candidates = {
+                text[0]
+                for token in self._vocabulary if anchor in token
+                for text, fields in self._postings[token].items() if fields & NAME_FIELD
+            }
+        else:
+            candidates = {text[0] for text in self._texts}
+        names = self._containing[phrase] = frozenset(name for name in candidates if lowered in name.lower())
+        return names
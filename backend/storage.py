@@ -0,0 +1,410 @@
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+from insights_history import InsightsHistory, history_from_snapshots
+from logs import get_logger
+from txtable import TransactionTable
+
+log = get_logger("storage")
+
+# Bytes of each database SQLite may memory-map for reads (0 disables it)
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS access_tokens (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    access_token TEXT NOT NULL UNIQUE,
+    created_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS accounts (
+    account_id TEXT PRIMARY KEY,
+    access_token TEXT NOT NULL,
+    name TEXT NOT NULL,
+    type TEXT NOT NULL,
+    subtype TEXT NOT NULL,
+    balance REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_accounts_access_token ON accounts (access_token);
+
+CREATE TABLE IF NOT EXISTS transactions (
+    transaction_id TEXT NOT NULL,
+    account_id TEXT NOT NULL,
+    amount REAL NOT NULL,
+    date TEXT NOT NULL,
+    name TEXT NOT NULL,
+    category TEXT NOT NULL DEFAULT '[]',
+    merchant_name TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_transactions_transaction_id ON transactions (transaction_id);
+CREATE INDEX IF NOT EXISTS idx_transactions_account_date ON transactions (account_id, date);
+CREATE INDEX IF NOT EXISTS idx_transactions_merchant_name ON transactions (merchant_name);
+
+CREATE TABLE IF NOT EXISTS sync_cursors (
+    access_token TEXT PRIMARY KEY,
+    cursor TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+
+-- One row per retained insights snapshot: kind 'full' holds the whole
+-- snapshot, 'delta' the changes since the row before it (see insights_history.py)
+CREATE TABLE IF NOT EXISTS insights (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    generated_at TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    kind TEXT NOT NULL DEFAULT 'full'
+);
+-- generated_at identifies an insight, so replaying a journal never duplicates one
+CREATE UNIQUE INDEX IF NOT EXISTS idx_insights_generated_at ON insights (generated_at);
+"""
+
+# Columns added after a table was first shipped: (table, column, definition)
+MIGRATIONS = (
+    # Rows written before deltas existed are all whole snapshots
+    ("insights", "kind", "TEXT NOT NULL DEFAULT 'full'"),
+)
+
+UPSERT_INSIGHT = """
+INSERT INTO insights (generated_at, kind, payload) VALUES (?, ?, ?)
+ON CONFLICT (generated_at) DO UPDATE SET kind = excluded.kind, payload = excluded.payload
+"""
+
+TRANSACTION_COLUMNS = ("transaction_id", "account_id", "amount", "date", "name", "category", "merchant_name")
+ACCOUNT_COLUMNS = ("account_id", "access_token", "name", "type", "subtype", "balance")
+
+# Only rewrite a row when one of its values actually changed, so re-fetching
+# an unchanged history doesn't touch the pages on disk.
+UPSERT_TRANSACTION = """
+INSERT INTO transactions (transaction_id, account_id, amount, date, name, category, merchant_name)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (transaction_id) DO UPDATE SET
+    account_id = excluded.account_id,
+    amount = excluded.amount,
+    date = excluded.date,
+    name = excluded.name,
+    category = excluded.category,
+    merchant_name = excluded.merchant_name
+WHERE transactions.account_id IS NOT excluded.account_id
+   OR transactions.amount IS NOT excluded.amount
+   OR transactions.date IS NOT excluded.date
+   OR transactions.name IS NOT excluded.name
+   OR transactions.category IS NOT excluded.category
+   OR transactions.merchant_name IS NOT excluded.merchant_name
+"""
+
+UPSERT_ACCOUNT = """
+INSERT INTO accounts (account_id, access_token, name, type, subtype, balance)
+VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT (account_id) DO UPDATE SET
+    access_token = excluded.access_token,
+    name = excluded.name,
+    type = excluded.type,
+    subtype = excluded.subtype,
+    balance = excluded.balance
+WHERE accounts.access_token IS NOT excluded.access_token
+   OR accounts.name IS NOT excluded.name
+   OR accounts.type IS NOT excluded.type
+   OR accounts.subtype IS NOT excluded.subtype
+   OR accounts.balance IS NOT excluded.balance
+"""
+
+
+def empty_user_data():
+    """Return an empty in-memory user data structure"""
+    return {
+        "access_tokens": [],
+        "accounts": [],
+        "transactions": TransactionTable(),
+        "insights": InsightsHistory(),
+    }
+
+
+def _transaction_row(transaction):
+    return (
+        transaction["transaction_id"],
+        transaction["account_id"],
+        float(transaction["amount"]),
+        transaction["date"],
+        transaction["name"],
+        json.dumps(transaction.get("category") or []),
+        transaction.get("merchant_name"),
+    )
+
+
+def _account_row(account):
+    return (
+        account["account_id"],
+        account.get("access_token", ""),
+        account.get("name", ""),
+        account.get("type", ""),
+        account.get("subtype", "unknown"),
+        float(account.get("balance", 0)),
+    )
+
+
+def _write_access_token(cur, access_token):
+    cur.execute(
+        "INSERT OR IGNORE INTO access_tokens (access_token, created_at) VALUES (?, ?)",
+        (access_token, datetime.now().isoformat()),
+    )
+
+
+def _write_accounts(cur, access_token, accounts):
+    cur.executemany(UPSERT_ACCOUNT, [_account_row(a) for a in accounts])
+    keep = [a["account_id"] for a in accounts]
+    placeholders = ", ".join("?" for _ in keep)
+    query = "DELETE FROM accounts WHERE access_token = ?"
+    if keep:
+        query += f" AND account_id NOT IN ({placeholders})"
+    cur.execute(query, (access_token, *keep))
+
+
+def _write_transaction_changes(cur, upserts, removed_ids, cursors):
+    if upserts:
+        cur.executemany(UPSERT_TRANSACTION, [_transaction_row(t) for t in upserts])
+    if removed_ids:
+        cur.executemany(
+            "DELETE FROM transactions WHERE transaction_id = ?",
+            [(tid,) for tid in removed_ids],
+        )
+    for access_token, cursor in cursors.items():
+        cur.execute(
+            "INSERT INTO sync_cursors (access_token, cursor, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (access_token) DO UPDATE SET cursor = excluded.cursor, updated_at = excluded.updated_at",
+            (access_token, cursor, datetime.now().isoformat()),
+        )
+
+
+def _write_insights(cur, rows, removed):
+    """Apply InsightsHistory changes: delete removed snapshots, upsert (generated_at, kind, payload) rows"""
+    cur.executemany("DELETE FROM insights WHERE generated_at = ?", [(generated_at,) for generated_at in removed])
+    cur.executemany(UPSERT_INSIGHT, [(generated_at, kind, json.dumps(payload)) for generated_at, kind, payload in rows])
+
+
+def _write_clear(cur):
+    for table in ("insights", "sync_cursors", "transactions", "accounts", "access_tokens"):
+        cur.execute(f"DELETE FROM {table}")
+
+
+class TransactionStore:
+    """
+    Embedded SQLite store for tokens, accounts, transactions and insights.
+
+    The database runs in WAL mode so reads never block on a writer, and every
+    write method only touches the rows that changed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        # Read pages straight from a memory map instead of copying them through read() calls
+        self._conn.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        self._conn.executescript(SCHEMA)
+        self._migrate()
+
+    def _migrate(self):
+        for table, column, definition in MIGRATIONS:
+            columns = {row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _write(self, fn):
+        """Run fn(cursor) inside a single write transaction"""
+        with self._lock:
+            cur = self._conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(cur)
+            except Exception:
+                cur.execute("ROLLBACK")
+                raise
+            cur.execute("COMMIT")
+            return result
+
+    # Reads
+
+    def is_empty(self):
+        with self._lock:
+            for table in ("access_tokens", "accounts", "transactions", "insights"):
+                if self._conn.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone():
+                    return False
+        return True
+
+    def get_sync_cursor(self, access_token):
+        """Return the saved /transactions/sync cursor for an access token, if any"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT cursor FROM sync_cursors WHERE access_token = ?", (access_token,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def load(self):
+        """Load the full working set into the in-memory user data structure"""
+        data = empty_user_data()
+        with self._lock:
+            data["access_tokens"] = [
+                row[0] for row in self._conn.execute("SELECT access_token FROM access_tokens ORDER BY id")
+            ]
+            for row in self._conn.execute(f"SELECT {', '.join(ACCOUNT_COLUMNS)} FROM accounts ORDER BY rowid"):
+                data["accounts"].append(dict(zip(ACCOUNT_COLUMNS, row)))
+            table = data["transactions"]
+            # Histories only have a few hundred distinct category lists; decode each once
+            categories = {}
+            for row in self._conn.execute(f"SELECT {', '.join(TRANSACTION_COLUMNS)} FROM transactions"):
+                transaction_id, account_id, amount, date, name, category, merchant_name = row
+                decoded = categories.get(category)
+                if decoded is None:
+                    decoded = categories[category] = tuple(json.loads(category))
+                table.put(transaction_id, account_id, amount, date, name, decoded, merchant_name)
+            # Bounded by the retention policy, and read in generated_at order off its index
+            data["insights"] = InsightsHistory(
+                (generated_at, kind, json.loads(payload)) for generated_at, kind, payload in self._conn.execute(
+                    "SELECT generated_at, kind, payload FROM insights ORDER BY generated_at"
+                )
+            )
+        return data
+
+    # Writes
+
+    def add_access_token(self, access_token):
+        self._write(lambda cur: _write_access_token(cur, access_token))
+
+    def replace_accounts(self, access_token, accounts):
+        """Upsert the accounts of one access token and drop the ones that disappeared"""
+        self._write(lambda cur: _write_accounts(cur, access_token, accounts))
+
+    def apply_transaction_changes(self, upserts=(), removed_ids=(), access_token=None, cursor=None):
+        """
+        Upsert added/modified transactions and delete removed ones in one transaction.
+
+        When a sync cursor is given it is saved in the same transaction, so the
+        stored rows and the cursor can never disagree after a crash.
+        """
+        cursors = {access_token: cursor} if access_token and cursor else {}
+        self._write(lambda cur: _write_transaction_changes(cur, upserts, removed_ids, cursors))
+
+    def write_insights(self, rows=(), removed=()):
+        self._write(lambda cur: _write_insights(cur, rows, removed))
+
+    def clear(self):
+        self._write(_write_clear)
+
+    def apply_batch(self, batch):
+        """Apply a coalesced WriteBatch (see journal.py) in a single transaction"""
+        def write(cur):
+            if batch.clear:
+                _write_clear(cur)
+            for access_token in batch.access_tokens:
+                _write_access_token(cur, access_token)
+            for access_token, accounts in batch.accounts.items():
+                _write_accounts(cur, access_token, accounts)
+            _write_transaction_changes(cur, list(batch.upserts.values()), list(batch.removed_ids), batch.cursors)
+            _write_insights(cur, list(batch.insight_rows.values()), list(batch.removed_insights))
+        self._write(write)
+
+    def checkpoint(self):
+        """Fold the SQLite WAL back into the main database file"""
+        with self._lock:
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def import_user_data(self, data):
+        """Bulk-load a legacy user data dict"""
+        def write(cur):
+            for access_token in data.get("access_tokens", []):
+                _write_access_token(cur, access_token)
+            cur.executemany(UPSERT_ACCOUNT, [_account_row(a) for a in data.get("accounts", [])])
+            cur.executemany(UPSERT_TRANSACTION, [_transaction_row(t) for t in data.get("transactions", [])])
+            # Legacy data holds whole snapshots; only what the retention policy keeps is stored
+            history = history_from_snapshots(data.get("insights", []))
+            _write_insights(cur, history.rows(), ())
+        self._write(write)
+
+    def migrate_from_json(self, json_path):
+        """
+        One-time migration from the legacy user_data.json file.
+
+        Only runs when the database is still empty; the JSON file is renamed
+        afterwards so it is never imported twice.
+        """
+        if not os.path.exists(json_path) or not self.is_empty():
+            return False
+        try:
+            with open(json_path, 'r') as f:
+                data = json.load(f)
+        except (json.JSONDecodeError, IOError):
+            log.warning("json_migration_skipped", path=json_path, reason="unreadable")
+            return False
+        self.import_user_data(data)
+        os.replace(json_path, json_path + ".migrated")
+        log.info("json_migrated", path=json_path, transactions=len(data.get("transactions", [])))
+        return True
+
+
+ITEM_SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    access_token TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    item_id TEXT,
+    created_at TEXT NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_items_item_id ON items (item_id);
+CREATE INDEX IF NOT EXISTS idx_items_user_id ON items (user_id);
+"""
+
+
+class ItemRegistry:
+    """
+    Which user and access token every linked Plaid Item belongs to.
+
+    User data is partitioned per user, but webhooks only carry an item_id and
+    the refresh scheduler needs every Item without loading every partition,
+    so this small index is shared by all users.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(ITEM_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def add(self, user_id, access_token, item_id=None):
+        """Register an Item; an item_id learned later fills in a missing one"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO items (access_token, user_id, item_id, created_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (access_token) DO UPDATE SET user_id = excluded.user_id, "
+                "item_id = COALESCE(excluded.item_id, items.item_id)",
+                (access_token, user_id, item_id, datetime.now().isoformat()),
+            )
+
+    def find(self, item_id):
+        """(user_id, access_token) of an Item, or None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT user_id, access_token FROM items WHERE item_id = ?", (item_id,)
+            ).fetchone()
+        return tuple(row) if row else None
+
+    def items(self):
+        """Every registered (user_id, access_token)"""
+        with self._lock:
+            return [tuple(row) for row in self._conn.execute("SELECT user_id, access_token FROM items")]
+
+    def remove_user(self, user_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM items WHERE user_id = ?", (user_id,))
@@ -0,0 +1,20 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+# The backend is a flat set of modules, imported the way main.py imports them
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def main(tmp_path_factory):
+    """The API module, with its databases in a temporary directory"""
+    data = tmp_path_factory.mktemp("data")
+    os.environ.update({
+        "USER_DATA_DB": str(data / "user_data.db"),
+        "USER_DATA_DIR": str(data / "users"),
+        "ITEM_REGISTRY_DB": str(data / "plaid_items.db"),
+    })
+    return importlib.import_module("main")
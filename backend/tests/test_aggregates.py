@@ -0,0 +1,82 @@
+from aggregates import InsightsAggregator
+from recurring import is_subscription_like
+
+
+def transaction(transaction_id, name, amount, category, date="2024-01-05", merchant_name=None, **adjustment):
+    return {
+        "transaction_id": transaction_id,
+        "account_id": "acct",
+        "amount": amount,
+        "date": date,
+        "name": name,
+        "category": category,
+        "merchant_name": merchant_name,
+        **adjustment,
+    }
+
+
+HISTORY = [
+    transaction("coffee", "Coffee", 4.35, ["Food"], "2024-01-03", "Blue Bottle"),
+    transaction("groceries", "Groceries", 82.1, ["Shops"], "2024-01-09", "Whole Foods"),
+    transaction("flight", "Flight", 420.0, ["Travel"], "2024-02-11", "Delta"),
+    transaction("paycheck", "Payroll", -2500.0, ["Transfer"], "2024-01-15"),
+    transaction("refund", "Refund", -0.1, [], "2024-02-02"),
+]
+
+
+def test_running_totals_match_a_rebuild():
+    aggregator = InsightsAggregator()
+    aggregator.rebuild(HISTORY[:2])
+    changed = dict(HISTORY[1], amount=90.0)
+    aggregator.apply(upserts=[changed] + HISTORY[2:], removed_ids=["coffee"])
+    current = [changed] + HISTORY[2:]
+    assert aggregator.verify(current) == []
+    assert aggregator.total_spending == 51000
+    assert aggregator.total_income == 250010
+    assert aggregator.spending_by_category() == {"Shops": 90.0, "Travel": 420.0}
+    assert aggregator.monthly_spending() == {"2024-01": 90.0, "2024-02": 420.0}
+
+
+def test_removing_everything_returns_to_empty():
+    aggregator = InsightsAggregator()
+    aggregator.rebuild(HISTORY)
+    # Cents are exact, so adding and subtracting leaves nothing behind
+    for _ in range(3):
+        aggregator.apply(upserts=HISTORY)
+    aggregator.apply(removed_ids=[t["transaction_id"] for t in HISTORY] + ["unknown"])
+    assert aggregator.state() == InsightsAggregator().state()
+
+
+NETFLIX = transaction("netflix", "Netflix", 15.49, ["Service", "Subscription"])
+GYM = transaction("gym", "City Gym", 45.0, ["Recreation"])
+SOFTWARE = transaction("software", "Annual Software Subscription", 240.0, ["Service"])
+MORTGAGE = transaction("mortgage", "Mortgage Payment", 3416.03, ["Payment", "Mortgage"], "2024-02-01",
+                       original_date="2024-01-30", date_adjusted=True, payment_type="mortgage")
+RENT = transaction("rent", "Landlord LLC", 95.0, ["Rent"], "2024-02-01",
+                   original_date="2024-01-31", date_adjusted=True, payment_type="recurring_monthly")
+UTILITY = transaction("utility", "PG&E", 60.0, ["Service", "Utilities"])
+STORAGE = transaction("storage", "Storage Unit", 120.0, ["Service"])
+
+
+def test_subscription_like():
+    assert [t["transaction_id"] for t in (NETFLIX, GYM, SOFTWARE, MORTGAGE, RENT, UTILITY, STORAGE)
+            if is_subscription_like(t)] == ["netflix", "gym", "software"]
+
+
+def test_counts_split_configured_and_detected_adjustments():
+    transactions = [NETFLIX, GYM, SOFTWARE, MORTGAGE, RENT, UTILITY, STORAGE]
+    aggregator = InsightsAggregator(lambda transaction_id: True)
+    aggregator.rebuild(transactions)
+    assert aggregator.subscription_count == 3
+    assert aggregator.adjusted_count == 1
+    assert aggregator.recurring_adjusted_count == 1
+
+    aggregator.apply(removed_ids=["rent", "netflix"])
+    assert (aggregator.subscription_count, aggregator.recurring_adjusted_count) == (2, 0)
+    assert aggregator.verify([t for t in transactions if t["transaction_id"] not in ("rent", "netflix")]) == []
+
+
+def test_only_recurring_charges_are_subscriptions():
+    aggregator = InsightsAggregator(lambda transaction_id: transaction_id == "gym")
+    aggregator.rebuild([NETFLIX, GYM])
+    assert aggregator.subscription_count == 1
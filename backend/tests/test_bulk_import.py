@@ -0,0 +1,148 @@
+import pytest
+
+from bulk_import import MAX_IMPORT_ERRORS, RecordParser, parse_amount, parse_stream
+from partitions import UserPartition
+
+NDJSON_ROWS = [
+    '{"date": "2024-01-02", "name": "Coffee", "amount": "4.50"}',
+    '{"date": "2024-01-02", "name": "Bad", "amount": "nan"}',
+    '{"date": "2024-01-03", "name": "Bad", "amount": NaN}',
+    '{"date": "2024-01-03", "name": "Bad", "amount": "-inf"}',
+    '{"date": "2024-01-03", "name": "Bad", "amount": Infinity}',
+    '{"date": "2024-01-04", "name": "Bad", "debit": "1e308", "credit": "-1e308"}',
+    '{"date": "2024-01-05", "name": "Rent", "debit": "1,200.00"}',
+]
+
+
+@pytest.mark.parametrize("value, expected", [
+    (12.5, 12.5), (3, 3.0), ("1,234.56", 1234.56), ("$12.50", 12.5), ("(12.50)", -12.5), (" 7 ", 7.0),
+])
+def test_parse_amount(value, expected):
+    assert parse_amount(value) == expected
+
+
+@pytest.mark.parametrize("value", ["nan", "NaN", "inf", "-inf", "Infinity", float("nan"), float("inf"), "1e999",
+                                   1e300, True, "", "abc", [1], {"value": 1}])
+def test_parse_amount_rejects(value):
+    with pytest.raises(ValueError):
+        parse_amount(value)
+
+
+def test_non_finite_amounts_are_row_errors():
+    parser = RecordParser("ndjson")
+    transactions = parser.feed("\n".join(NDJSON_ROWS) + "\n") + parser.close()
+    assert [t["name"] for t in transactions] == ["Coffee", "Rent"]
+    assert parser.records == len(NDJSON_ROWS)
+    assert parser.rejected == 5
+    assert [e["record"] for e in parser.errors] == [2, 3, 4, 5, 6]
+    assert all("invalid amount" in e["error"] for e in parser.errors)
+
+
+def test_csv_in_pieces_with_quoted_newlines():
+    text = (
+        "Date,Description,Debit,Credit,Category\n"
+        '2024-02-01,"Grocery\nStore",52.10,,Shops; Groceries\n'
+        "2024-02-02,Paycheck,,2000.00,Transfer\n"
+        "2024-02-03,Broken,nan,,\n"
+    )
+    parser = RecordParser("csv")
+    transactions = []
+    for start in range(0, len(text), 7):
+        transactions.extend(parser.feed(text[start:start + 7].encode()))
+    transactions.extend(parser.close())
+    assert [(t["name"], t["amount"], t["category"]) for t in transactions] == [
+        ("Grocery\nStore", 52.1, ["Shops", "Groceries"]),
+        ("Paycheck", -2000.0, ["Transfer"]),
+    ]
+    assert parser.rejected == 1
+
+
+def test_content_ids_are_stable_and_tell_duplicates_apart():
+    rows = '{"date": "2024-03-01", "name": "Coffee", "amount": 3}\n' * 2
+
+    def ids():
+        parser = RecordParser("ndjson")
+        return [t["transaction_id"] for t in parser.feed(rows)]
+
+    first = ids()
+    assert len(set(first)) == 2
+    assert ids() == first
+
+
+def test_bad_rows_and_other_errors():
+    parser = RecordParser("ndjson", date_format="%m/%d/%Y", negate=True)
+    transactions = parser.feed(
+        '{"date": "03/04/2024", "name": "Refund", "amount": -10, "id": "t1"}\n'
+        "not json\n"
+        "[1, 2]\n"
+        '{"date": "2024-13-01", "name": "Bad date", "amount": 1}\n'
+        '{"name": "No date", "amount": 1}\n'
+    )
+    assert [(t["transaction_id"], t["date"], t["amount"]) for t in transactions] == [("t1", "2024-03-04", 10.0)]
+    assert parser.rejected == 4
+    with pytest.raises(ValueError):
+        RecordParser("xlsx")
+
+
+def test_import_round_trip_skips_non_finite_rows(tmp_path):
+    db = str(tmp_path / "user.db")
+    partition = UserPartition("tester", db, db + ".journal")
+    parser = RecordParser("ndjson")
+    for chunk in parse_stream(parser, [("\n".join(NDJSON_ROWS) + "\n").encode()], size=1):
+        partition.import_transactions(chunk)
+    assert len(partition.user_data["transactions"]) == 2
+    partition.store.close()
+
+    reloaded = UserPartition("tester", db, db + ".journal")
+    assert sorted(t["amount"] for t in reloaded.user_data["transactions"]) == [4.5, 1200.0]
+    reloaded.store.close()
+
+
+def test_utf8_split_across_pieces_and_bom():
+    data = "\ufeffdate,name,amount\n2024-04-01,Caf\u00e9 Noir,3.20\n".encode()
+    split = data.index("\u00e9".encode()) + 1
+    parser = RecordParser("csv")
+    transactions = parser.feed(data[:split]) + parser.feed(data[split:]) + parser.close()
+    assert [t["name"] for t in transactions] == ["Caf\u00e9 Noir"]
+
+
+def test_ndjson_last_line_without_newline_waits_for_close():
+    parser = RecordParser("ndjson")
+    assert parser.feed('{"date": "2024-01-01", "name": "A", "amount": 1}') == []
+    assert [t["name"] for t in parser.close()] == ["A"]
+
+
+def test_ofx_style_columns():
+    parser = RecordParser("csv", account_id="checking")
+    transactions = parser.feed(
+        "FITID,DTPOSTED,TRNAMT,MEMO\n"
+        "abc123,20240105120000[-5:EST],-42.00,Gas\n"
+        "\n"
+    ) + parser.close()
+    assert [(t["transaction_id"], t["date"], t["amount"], t["account_id"]) for t in transactions] == [
+        ("abc123", "2024-01-05", -42.0, "checking"),
+    ]
+
+
+def test_errors_beyond_the_cap_are_only_counted():
+    parser = RecordParser("ndjson")
+    parser.feed("oops\n" * (MAX_IMPORT_ERRORS + 5))
+    assert parser.rejected == MAX_IMPORT_ERRORS + 5
+    assert len(parser.errors) == MAX_IMPORT_ERRORS
+
+
+def test_parse_stream_chunks():
+    rows = "".join(f'{{"date": "2024-01-01", "name": "N{i}", "amount": {i}}}\n' for i in range(7))
+    chunks = list(parse_stream(RecordParser("ndjson"), [rows[:30], rows[30:]], size=3))
+    assert [len(chunk) for chunk in chunks] == [3, 3, 1]
+
+
+def test_wrongly_typed_fields_are_row_errors():
+    parser = RecordParser("ndjson")
+    transactions = parser.feed(
+        '{"date": "2024-01-02", "name": "List amount", "amount": [1]}\n'
+        '{"date": "2024-01-02", "name": "Number category", "amount": 1, "category": 5}\n'
+        '{"date": "2024-01-02", "name": "Fine", "amount": 1, "category": ["Food"]}\n'
+    )
+    assert [t["name"] for t in transactions] == ["Fine"]
+    assert [e["error"] for e in parser.errors] == ["invalid amount [1]", "invalid category 5"]
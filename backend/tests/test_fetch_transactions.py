@@ -0,0 +1,21 @@
+import pytest
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture
+def client(main, monkeypatch):
+    monkeypatch.setattr(main, "DEFAULT_USER_HOSTS", frozenset({"testclient"}))
+    return TestClient(main.app)
+
+
+@pytest.mark.parametrize("backfill_days", [-5, 731, 99999])
+def test_backfill_days_out_of_range(client, backfill_days):
+    response = client.post("/fetch_transactions", params={"backfill_days": backfill_days})
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("backfill_days", [0, 1, 730])
+def test_backfill_days_in_range(client, backfill_days):
+    # The default user has no Items, so nothing reaches Plaid
+    response = client.post("/fetch_transactions", params={"backfill_days": backfill_days})
+    assert response.status_code == 200
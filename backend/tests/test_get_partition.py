@@ -0,0 +1,36 @@
+import pytest
+from fastapi.testclient import TestClient
+
+OFF_LOOPBACK = ("10.0.0.5", 50000)
+PROXY = ("10.0.0.2", 50000)
+
+
+@pytest.fixture
+def trusted(main, monkeypatch):
+    monkeypatch.setattr(main, "DEFAULT_USER_HOSTS", frozenset({"127.0.0.1"}))
+    monkeypatch.setattr(main, "TRUSTED_PROXY_HOSTS", frozenset({PROXY[0]}))
+    monkeypatch.setattr(main, "USER_ID_SECRET", "s3cret")
+
+
+def status(main, client, **headers):
+    return TestClient(main.app, client=client).get("/accounts", headers=headers).status_code
+
+
+def test_loopback_gets_the_default_user(main, trusted):
+    assert status(main, ("127.0.0.1", 50000)) == 200
+    assert status(main, ("127.0.0.1", 50000), **{"X-User-Id": "alice"}) == 200
+
+
+def test_off_loopback_cannot_claim_a_user(main, trusted):
+    assert status(main, OFF_LOOPBACK) == 401
+    assert status(main, OFF_LOOPBACK, **{"X-User-Id": "default"}) == 401
+    assert status(main, OFF_LOOPBACK, **{"X-User-Id": "alice"}) == 401
+    assert status(main, OFF_LOOPBACK, **{"X-User-Id": "alice", "X-Proxy-Secret": "wrong"}) == 401
+
+
+def test_trusted_proxy_or_secret_may_set_the_user(main, trusted):
+    assert status(main, PROXY, **{"X-User-Id": "alice"}) == 200
+    assert status(main, OFF_LOOPBACK, **{"X-User-Id": "alice", "X-Proxy-Secret": "s3cret"}) == 200
+    # Even a trusted proxy can't hand out the default user
+    assert status(main, PROXY, **{"X-User-Id": "default"}) == 401
+    assert status(main, PROXY) == 401
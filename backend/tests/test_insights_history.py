@@ -0,0 +1,131 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from insights_history import (
+    DELTA, FULL, InsightsHistory, compose, diff, history_from_snapshots, parse_bound, parse_retention, patch,
+)
+
+START = datetime(2024, 1, 1)
+
+
+def snapshot(i, generated_at=None):
+    """Insights-shaped dict where a few fields change from one i to the next"""
+    return {
+        "generated_at": (generated_at or START + timedelta(hours=i)).isoformat(),
+        "total_spending": 100.0 + i,
+        "savings_rate": 10.0 if i % 3 else 12.5,
+        "spending_by_category": {"Food": 50.0 + i, "Travel": 20.0, **({"Shops": float(i)} if i % 2 else {})},
+        "recommendations": ["a", "b"] if i % 4 else ["a"],
+        **({"note": "odd"} if i % 5 == 1 else {}),
+    }
+
+
+@pytest.mark.parametrize("previous, current", [
+    ({}, {"a": 1}),
+    ({"a": 1}, {}),
+    ({"a": 1, "b": {"x": 1, "y": 2}}, {"a": 1, "b": {"x": 1, "z": 3}}),
+    ({"b": {"x": {"deep": 1}}}, {"b": {"x": {"deep": 2, "new": 0}}}),
+    ({"b": {"x": 1}}, {"b": [1, 2]}),
+    ({"b": [1, 2]}, {"b": {"x": 1}}),
+    ({"a": None}, {"a": 0}),
+])
+def test_diff_then_patch_round_trips(previous, current):
+    delta = diff(previous, current)
+    assert patch(previous, delta) == current
+    assert diff(current, current) == {}
+
+
+def test_patch_leaves_its_input_alone():
+    previous = {"a": 1, "m": {"x": 1}}
+    patch(previous, diff(previous, {"m": {"x": 2}}))
+    assert previous == {"a": 1, "m": {"x": 1}}
+
+
+def test_compose_matches_applying_in_turn():
+    rng = random.Random(7)
+    states = [snapshot(rng.randrange(40)) for _ in range(30)]
+    for first, second, third in zip(states, states[1:], states[2:]):
+        composed = compose(diff(first, second), diff(second, third))
+        assert patch(first, composed) == third
+
+
+def test_append_stores_keyframes_and_deltas():
+    history = InsightsHistory(keyframe_every=4, retention="3650d:0")
+    for i in range(10):
+        history.append(snapshot(i))
+    assert history.kinds == [FULL, DELTA, DELTA, DELTA] * 2 + [FULL, DELTA]
+    assert history.latest() == snapshot(9)
+    assert history.recent(3) == [snapshot(i) for i in range(7, 10)]
+    assert history.range() == [snapshot(i) for i in range(10)]
+
+
+def test_range_bounds_and_fields():
+    history = InsightsHistory(keyframe_every=3, retention="3650d:0")
+    for i in range(48):
+        history.append(snapshot(i))
+    second_day = history.range("2024-01-02", "2024-01-02")
+    assert [s["total_spending"] for s in second_day] == [100.0 + i for i in range(24, 48)]
+    assert history.range("2024-01-01T05:00:00", "2024-01-01T06:00:00", fields=["savings_rate"]) == [
+        {"generated_at": snapshot(i)["generated_at"], "savings_rate": snapshot(i)["savings_rate"]} for i in (5, 6)
+    ]
+    assert history.range("2024-02-01") == []
+
+
+def test_retention_keeps_one_per_window_and_rebuilds_the_rest():
+    history = InsightsHistory(keyframe_every=5, retention="6h:0,3650d:1d")
+    removed_all = []
+    for i in range(24 * 4):
+        _, removed = history.append(snapshot(i))
+        removed_all.extend(removed)
+    # The last six hours whole, before that the latest snapshot of each day
+    # (the last day's being the one just outside six hours)
+    kept = [snapshot(i) for i in (23, 47, 71, 89)] + [snapshot(i) for i in range(90, 96)]
+    assert history.range() == kept
+    assert len(removed_all) == 96 - len(kept)
+    assert history.kinds[0] == FULL
+
+
+def test_max_snapshots_drops_oldest():
+    history = InsightsHistory(keyframe_every=4, retention="3650d:0", max_snapshots=5)
+    for i in range(12):
+        history.append(snapshot(i))
+    assert history.range() == [snapshot(i) for i in range(7, 12)]
+
+
+def test_rows_reload_into_the_same_history():
+    history = InsightsHistory(keyframe_every=4, retention="12h:0,3650d:1d")
+    stored = {}
+    for i in range(60):
+        rows, removed = history.append(snapshot(i))
+        for generated_at in removed:
+            stored.pop(generated_at, None)
+        for row in rows:
+            stored[row[0]] = row
+    reloaded = InsightsHistory(sorted(stored.values()), keyframe_every=4, retention="12h:0,3650d:1d")
+    assert reloaded.range() == history.range()
+
+
+def test_clock_stepping_back_keeps_order():
+    history = InsightsHistory(retention="3650d:0")
+    history.append(snapshot(1))
+    late = snapshot(2, generated_at=START)
+    history.append(late)
+    assert history.times == sorted(history.times)
+    assert history.latest()["generated_at"] > snapshot(1)["generated_at"]
+
+
+def test_history_from_snapshots_sorts_and_skips_duplicates():
+    snapshots = [snapshot(3), snapshot(1), snapshot(1), snapshot(2)]
+    history = history_from_snapshots(snapshots)
+    assert [s["total_spending"] for s in history.range()] == [101.0, 102.0, 103.0]
+
+
+def test_parse_helpers():
+    assert parse_retention("30d:1h, 1d:0") == [(86400, 0), (30 * 86400, 3600)]
+    assert parse_bound("2024-01-02") == "2024-01-02"
+    with pytest.raises(ValueError):
+        parse_bound("2024-01-02T00:00:00+02:00")
+    with pytest.raises(ValueError):
+        parse_bound("yesterday")
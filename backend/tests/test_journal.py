@@ -0,0 +1,208 @@
+import asyncio
+import glob
+import json
+import os
+import sqlite3
+
+from journal import JournaledStore, WriteBatch
+from storage import TransactionStore
+
+
+def transaction(transaction_id, amount=10.0, day="2024-01-15"):
+    return {
+        "transaction_id": transaction_id, "account_id": "acc", "amount": amount, "date": day,
+        "name": f"Payee {transaction_id}", "category": ["Shops"], "merchant_name": None,
+    }
+
+
+def open_store(tmp_path, **kwargs):
+    db = str(tmp_path / "user.db")
+    return JournaledStore(TransactionStore(db), db + ".journal", flush_interval=0, **kwargs)
+
+
+def stored_ids(journaled):
+    return sorted(journaled.store.load()["transactions"].ids())
+
+
+def failed_entries(journaled):
+    records = []
+    for path in sorted(glob.glob(journaled.path + ".*.failed")):
+        with open(path, encoding="utf-8") as f:
+            records.extend(json.loads(line) for line in f)
+    return records
+
+
+def test_write_batch_coalesces():
+    batch = WriteBatch()
+    batch.add({"op": "transactions", "upserts": [transaction("a"), transaction("b")], "removed_ids": []})
+    batch.add({"op": "transactions", "upserts": [transaction("a", 20.0)], "removed_ids": ["b"],
+               "access_token": "tok", "cursor": "c1"})
+    assert batch.upserts["a"]["amount"] == 20.0
+    assert batch.removed_ids == {"b"} and "b" not in batch.upserts
+    assert batch.cursors == {"tok": "c1"}
+    batch.add({"op": "clear"})
+    assert batch.clear and not batch.upserts and not batch.cursors
+
+
+def test_writes_survive_reopen(tmp_path):
+    journaled = open_store(tmp_path)
+    journaled.add_access_token("tok")
+    journaled.apply_transaction_changes([transaction("a"), transaction("b")], [], "tok", "c1")
+    journaled.apply_transaction_changes([], ["a"])
+    journaled.close()
+
+    reopened = open_store(tmp_path)
+    data = reopened.load()
+    assert list(data["transactions"].ids()) == ["b"]
+    assert data["access_tokens"] == ["tok"]
+    assert reopened.get_sync_cursor("tok") == "c1"
+    reopened.close()
+
+
+def test_replay_applies_journal_left_by_crash(tmp_path):
+    journaled = open_store(tmp_path)
+
+    async def crash():
+        journaled.start()
+        journaled.apply_transaction_changes([transaction("a")], [], "tok", "c2")
+        # Acknowledged (in the journal) but never flushed to SQLite
+        await journaled.commit()
+        journaled._task.cancel()
+
+    asyncio.run(crash())
+    assert stored_ids(journaled) == []
+    journaled._journal.close()
+    journaled.store.close()
+
+    reopened = open_store(tmp_path)
+    assert stored_ids(reopened) == ["a"]
+    assert reopened.get_sync_cursor("tok") == "c2"
+    reopened.close()
+
+
+def test_commit_shares_one_write(tmp_path):
+    journaled = open_store(tmp_path)
+    writes = []
+    write = journaled._write
+    journaled._write = lambda entries: (writes.append(len(entries)), write(entries))
+
+    async def run():
+        journaled.start()
+        for i in range(5):
+            journaled.apply_transaction_changes([transaction(f"t{i}")], [])
+        await asyncio.gather(*(journaled.commit() for _ in range(5)))
+        await journaled.stop()
+
+    asyncio.run(run())
+    assert writes == [5]
+    assert len(stored_ids(journaled)) == 5
+    journaled.close()
+
+
+def test_bad_entry_is_set_aside_and_later_writes_applied(tmp_path):
+    journaled = open_store(tmp_path)
+
+    async def run():
+        journaled.start()
+        journaled.apply_transaction_changes([transaction("good-1")], [])
+        # NaN is stored as NULL, which the amount column refuses
+        journaled.apply_transaction_changes([transaction("bad", float("nan"))], [])
+        journaled.apply_transaction_changes([transaction("good-2")], [])
+        await journaled.flush_async()
+        journaled.apply_transaction_changes([transaction("good-3")], [])
+        await journaled.stop()
+
+    asyncio.run(run())
+    assert stored_ids(journaled) == ["good-1", "good-2", "good-3"]
+    assert journaled.quarantined == 1 and journaled.flush_failures == 0
+    [record] = failed_entries(journaled)
+    assert record["entry"]["upserts"][0]["transaction_id"] == "bad"
+    assert "NOT NULL" in record["error"]
+    assert not glob.glob(journaled.path + ".*.flushing")
+    journaled.close()
+
+
+def test_transient_failure_is_retried(tmp_path):
+    journaled = open_store(tmp_path)
+    apply_batch = journaled.store.apply_batch
+    failures = []
+
+    def flaky(batch):
+        if not failures:
+            failures.append(1)
+            raise sqlite3.OperationalError("database is locked")
+        apply_batch(batch)
+    journaled.store.apply_batch = flaky
+
+    async def run():
+        journaled.start()
+        journaled.apply_transaction_changes([transaction("a")], [], "tok", "c3")
+        await journaled.flush_async()
+        # Still queued, and its cursor still visible
+        assert journaled.flush_failures == 1 and len(journaled._sealed) == 1
+        assert journaled.get_sync_cursor("tok") == "c3"
+        await journaled.flush_async()
+        await journaled.stop()
+
+    asyncio.run(run())
+    assert stored_ids(journaled) == ["a"]
+    assert journaled.flush_failures == 0 and journaled.quarantined == 0
+    journaled.close()
+
+
+def test_flush_loop_survives_unexpected_errors(tmp_path, monkeypatch):
+    journaled = open_store(tmp_path)
+    replace = os.replace
+    failures = []
+
+    def flaky_replace(src, dst):
+        if not failures:
+            failures.append(1)
+            raise OSError("disk full")
+        replace(src, dst)
+    monkeypatch.setattr(os, "replace", flaky_replace)
+
+    async def run():
+        journaled.start()
+        journaled.apply_transaction_changes([transaction("a")], [])
+        await journaled.commit()
+        for _ in range(100):
+            if stored_ids(journaled) == ["a"]:
+                break
+            await asyncio.sleep(0.01)
+        assert not journaled._task.done()
+        journaled.apply_transaction_changes([transaction("b")], [])
+        await journaled.stop()
+
+    asyncio.run(run())
+    assert failures and "disk full" in journaled.last_error
+    assert stored_ids(journaled) == ["a", "b"]
+    journaled.close()
+
+
+def test_replay_of_bad_journal_does_not_raise(tmp_path):
+    db = str(tmp_path / "user.db")
+    TransactionStore(db).close()
+    entries = [
+        {"op": "transactions", "upserts": [transaction("a")], "removed_ids": []},
+        {"op": "no-such-op"},
+        {"op": "transactions", "upserts": [transaction("bad", float("nan"))], "removed_ids": []},
+        {"op": "transactions", "upserts": [transaction("b")], "removed_ids": []},
+    ]
+    with open(db + ".journal.00000000000000000001.flushing", "w", encoding="utf-8") as f:
+        f.writelines(json.dumps(entry) + "\n" for entry in entries[:2])
+    with open(db + ".journal", "w", encoding="utf-8") as f:
+        f.writelines(json.dumps(entry) + "\n" for entry in entries[2:])
+        f.write('{"op": "transac')
+
+    journaled = JournaledStore(TransactionStore(db), db + ".journal")
+    assert stored_ids(journaled) == ["a", "b"]
+    # One side file per journal file
+    assert journaled.quarantined == 2
+    assert [r["entry"]["op"] for r in failed_entries(journaled)] == ["no-such-op", "transactions"]
+    journaled.close()
+
+    # The side files are left alone, and counted again on the next open
+    reopened = JournaledStore(TransactionStore(db), db + ".journal")
+    assert stored_ids(reopened) == ["a", "b"] and reopened.quarantined == 2
+    reopened.close()
@@ -0,0 +1,27 @@
+from types import SimpleNamespace
+
+from plaid_gateway import PlaidGateway
+
+
+class CountingClient:
+    def __init__(self):
+        self.calls = []
+
+    def accounts_get(self, request):
+        self.calls.append("accounts_get")
+        return SimpleNamespace(balance=len(self.calls))
+
+    def institutions_get(self, request):
+        self.calls.append("institutions_get")
+        return SimpleNamespace(count=len(self.calls))
+
+
+def test_balances_are_never_served_from_the_cache():
+    client = CountingClient()
+    gateway = PlaidGateway(client, cache_ttl=60, hedge_after=0)
+    request = SimpleNamespace(access_token="access-1")
+    assert [gateway.accounts_get(request).balance for _ in range(2)] == [1, 2]
+    # Reference data still is
+    institutions = SimpleNamespace(count=10)
+    assert gateway.institutions_get(institutions) is gateway.institutions_get(institutions)
+    assert client.calls == ["accounts_get", "accounts_get", "institutions_get"]
@@ -0,0 +1,57 @@
+import asyncio
+import itertools
+
+import pytest
+
+from partitions import UserPartition
+
+ids = itertools.count()
+
+
+def transaction(amount=10.0):
+    return {
+        "transaction_id": f"t{next(ids)}", "account_id": "acct", "amount": amount, "date": "2024-01-05",
+        "name": "Coffee", "category": ["Food"], "merchant_name": None,
+    }
+
+
+class SyncDuringRun:
+    """Runs jobs in-process; the first `syncs` of them see a sync land while they run"""
+
+    def __init__(self, partition, syncs):
+        self.partition = partition
+        self.syncs = syncs
+        self.runs = 0
+
+    async def run(self, key, fn, *args, timeout=None):
+        self.runs += 1
+        result = fn(lambda: None, *args)
+        if self.runs <= self.syncs:
+            self.partition.import_transactions([transaction()])
+        await asyncio.sleep(0)
+        return result
+
+
+@pytest.fixture
+def partition(tmp_path):
+    db = str(tmp_path / "user.db")
+    partition = UserPartition("tester", db, db + ".journal")
+    partition.import_transactions([transaction(), transaction(-100.0)])
+    yield partition
+    partition.store.close()
+
+
+def test_rebuild_retries_when_a_sync_lands(main, partition, monkeypatch):
+    fake = SyncDuringRun(partition, syncs=1)
+    monkeypatch.setattr(main, "analytics", fake)
+    key, _, rebuilt = asyncio.run(main.rebuild_aggregates(partition))
+    assert fake.runs == 2
+    assert key == partition.adjusted_key()
+    assert rebuilt.total_spending == 2000
+
+
+def test_rebuild_gives_up_when_data_keeps_changing(main, partition, monkeypatch):
+    fake = SyncDuringRun(partition, syncs=main.AGGREGATE_REBUILD_ATTEMPTS)
+    monkeypatch.setattr(main, "analytics", fake)
+    assert asyncio.run(main.rebuild_aggregates(partition)) is None
+    assert fake.runs == main.AGGREGATE_REBUILD_ATTEMPTS
@@ -0,0 +1,96 @@
+from early_payments import detect_early_payments
+from txtable import TransactionTable
+
+RENT_RULE = {"rent": {"amount": 1500.0, "keywords": ["rent"], "days_early": 2, "tolerance": 1.0}}
+
+
+def transaction(transaction_id, date, amount=10.0, name="Coffee", category=("Food",), merchant_name=None):
+    return {
+        "transaction_id": transaction_id,
+        "account_id": "acct",
+        "amount": amount,
+        "date": date,
+        "name": name,
+        "category": list(category),
+        "merchant_name": merchant_name,
+    }
+
+
+def ids(rows):
+    return [row["transaction_id"] for row in rows]
+
+
+def test_order_is_newest_first_then_id():
+    table = TransactionTable([
+        transaction("b", "2024-01-02"), transaction("a", "2024-01-02"), transaction("c", "2024-01-05"),
+    ])
+    assert ids(table) == ["c", "b", "a"]
+    assert table[0]["transaction_id"] == "c"
+    assert ids(table[1:]) == ["b", "a"]
+
+
+def test_rows_read_like_dicts():
+    table = TransactionTable([transaction("a", "2024-01-02", 4.5, "Latte", ("Food", "Coffee"), "Blue Bottle")])
+    row = table.get("a")
+    assert dict(row) == {
+        "transaction_id": "a", "account_id": "acct", "amount": 4.5, "date": "2024-01-02", "name": "Latte",
+        "category": ("Food", "Coffee"), "merchant_name": "Blue Bottle",
+    }
+    assert row.get("date_adjusted", False) is False
+    assert table.get("missing") is None
+
+
+def test_remove_recycles_rows():
+    table = TransactionTable([transaction(f"t{i}", f"2024-01-{i + 1:02d}") for i in range(5)])
+    table.remove(["t1", "t3", "never-there"])
+    assert len(table) == 3
+    assert ids(table) == ["t4", "t2", "t0"]
+    assert table.get("t1") is None
+
+    table.upsert([transaction("n1", "2024-02-01", name="New"), transaction("n2", "2023-12-31")])
+    # Freed slots are reused before the columns grow
+    assert len(table._ids) == 5
+    assert ids(table) == ["n1", "t4", "t2", "t0", "n2"]
+    assert table.get("n1")["name"] == "New"
+
+
+def test_upsert_overwrites_in_place():
+    table = TransactionTable([transaction("a", "2024-01-02")])
+    table.upsert([transaction("a", "2024-03-01", amount=99.0)])
+    assert len(table._ids) == 1
+    assert (table.get("a")["amount"], table.get("a")["date"]) == (99.0, "2024-03-01")
+    assert len(table) == 1
+
+
+def test_adjusted_overlay():
+    table = TransactionTable([transaction("rent", "2024-01-30", 1500.0, "Rent"), transaction("coffee", "2024-01-10")])
+    adjusted = detect_early_payments(table, RENT_RULE)
+    rent, coffee = adjusted
+    assert (rent["date"], rent["original_date"], rent["payment_type"], rent["date_adjusted"]) == (
+        "2024-02-01", "2024-01-30", "rent", True,
+    )
+    assert "payment_type" not in coffee
+    # The table itself is untouched
+    assert table.get("rent")["date"] == "2024-01-30"
+
+
+def test_snapshot_round_trip_keeps_rows_and_free_slots():
+    table = TransactionTable([transaction(f"t{i}", f"2024-01-{i % 28 + 1:02d}", amount=i, merchant_name=f"m{i % 3}")
+                              for i in range(50)])
+    freed = {table.row_number("t7"), table.row_number("t8")}
+    table.remove(["t7", "t8"])
+    restored = TransactionTable.from_snapshot(table.snapshot())
+    assert [dict(row) for row in restored] == [dict(row) for row in table]
+    restored.upsert([transaction("new", "2024-02-01")])
+    assert restored.row_number("new") in freed
+
+
+def test_pinned_view_survives_recycled_rows():
+    table = TransactionTable([transaction("rent", "2024-01-30", 1500.0, "Rent"), transaction("coffee", "2024-01-10")])
+    pinned = detect_early_payments(table, RENT_RULE).pinned()
+    before = [dict(row) for row in pinned]
+    # A removal followed by an insert reuses the row the pinned view still reads
+    table.remove(["rent"])
+    table.upsert([transaction("other", "2024-01-31", 1.0, "Other")])
+    assert [dict(row) for row in pinned] == before
+    assert table.get("rent") is None and pinned.get("rent") is not None
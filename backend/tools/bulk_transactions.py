@@ -0,0 +1,113 @@
+"""
+Bulk import and export of transaction history.
+
+    python tools/bulk_transactions.py import history.csv
+    python tools/bulk_transactions.py import history.ndjson --user-id alice
+    python tools/bulk_transactions.py import statement.csv --negate --date-format %m/%d/%Y
+    python tools/bulk_transactions.py import history.csv --db user_data.db
+    python tools/bulk_transactions.py export all.csv
+
+import streams the file to a running backend's /import_transactions, which
+parses it as it arrives and applies it in chunks. With --db it writes
+straight into that SQLite store instead, at disk speed; only do that while
+the backend is stopped, since a running one would not see the rows.
+
+export streams /transactions_adjusted?format=ndjson|csv into a file without
+holding the history in memory on either side.
+
+The format follows the file extension (.csv, anything else is NDJSON)
+unless --format is given.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import urllib.parse
+import urllib.request
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+READ_SIZE = 1 << 20
+
+
+def file_format(path, explicit):
+    if explicit:
+        return explicit
+    return "csv" if path.lower().endswith(".csv") else "ndjson"
+
+
+def import_via_api(args, fmt):
+    params = {"format": fmt, "account_id": args.account_id, "negate": str(args.negate).lower()}
+    if args.date_format:
+        params["date_format"] = args.date_format
+    headers = {"Content-Type": "text/csv" if fmt == "csv" else "application/x-ndjson",
+               "Content-Length": str(os.path.getsize(args.path))}
+    if args.user_id:
+        headers["X-User-Id"] = args.user_id
+    with open(args.path, "rb") as body:
+        # A file body is sent in blocks, never read whole
+        request = urllib.request.Request(
+            f"{args.base_url}/import_transactions?{urllib.parse.urlencode(params)}",
+            data=body, headers=headers, method="POST",
+        )
+        with urllib.request.urlopen(request) as response:
+            return json.loads(response.read())
+
+
+def import_into_db(args, fmt):
+    sys.path.insert(0, BACKEND_DIR)
+    from bulk_import import RecordParser, parse_stream
+    from journal import JournaledStore
+    from storage import TransactionStore
+
+    # Opening the journaled store replays anything a crashed backend left behind first
+    store = JournaledStore(TransactionStore(args.db), args.db + ".journal")
+    parser = RecordParser(fmt, args.account_id, args.date_format, args.negate)
+    written = chunks = 0
+    try:
+        with open(args.path, "rb") as source:
+            for chunk in parse_stream(parser, iter(lambda: source.read(READ_SIZE), b"")):
+                # Upserts on transaction_id, so re-imported rows are overwritten, not duplicated
+                store.store.apply_transaction_changes(chunk)
+                written += len(chunk)
+                chunks += 1
+    finally:
+        store.close()
+    return {"records": parser.records, "written": written, "rejected": parser.rejected,
+            "errors": parser.errors, "chunks": chunks}
+
+
+def export(args, fmt):
+    headers = {"X-User-Id": args.user_id} if args.user_id else {}
+    url = f"{args.base_url}/transactions_adjusted?{urllib.parse.urlencode({'format': fmt})}"
+    with urllib.request.urlopen(urllib.request.Request(url, headers=headers)) as response, \
+            open(args.path, "wb") as target:
+        shutil.copyfileobj(response, target, READ_SIZE)
+    return {"path": args.path, "bytes": os.path.getsize(args.path)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=("import", "export"))
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=("ndjson", "csv"))
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--user-id", help="X-User-Id to import into / export from")
+    parser.add_argument("--db", help="import straight into this SQLite store (backend must be stopped)")
+    parser.add_argument("--account-id", default="imported", help="account for rows without an account column")
+    parser.add_argument("--date-format", help="strptime format for non-ISO dates, e.g. %%m/%%d/%%Y")
+    parser.add_argument("--negate", action="store_true", help="the file has spending as negative amounts")
+    args = parser.parse_args()
+
+    fmt = file_format(args.path, args.format)
+    if args.command == "export":
+        result = export(args, fmt)
+    elif args.db:
+        result = import_into_db(args, fmt)
+    else:
+        result = import_via_api(args, fmt)
+    print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
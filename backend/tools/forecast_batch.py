@@ -0,0 +1,97 @@
+"""
+Cash-flow forecasts for every user, computed offline in parallel.
+
+    python tools/forecast_batch.py --out forecasts.ndjson
+    python tools/forecast_batch.py --days 90 --workers 8 --users-dir users --db user_data.db
+
+Reads each user's SQLite store directly (<users-dir>/<user_id>.db, plus
+--db as the default user's when it exists) and writes one NDJSON line per
+user: {"user_id", "forecast"} in the /forecast response shape, or
+{"user_id", "error"} when that user's store could not be forecast. Users
+are spread over worker processes; each loads, forecasts and serializes one
+user at a time, so memory stays at one history per worker.
+
+Writes still in a running backend's journal are not seen until it flushes
+them to the database.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from forecast import FORECAST_MAX_DAYS, build_forecast, trim  # noqa: E402
+from partitions import DEFAULT_USER_ID, USER_DATA_DIR  # noqa: E402
+from recurring import RecurringDetector  # noqa: E402
+from storage import TransactionStore  # noqa: E402
+
+
+def user_stores(users_dir, default_db):
+    """[(user_id, database path)] of every store to forecast"""
+    stores = []
+    if default_db and os.path.exists(default_db):
+        stores.append((DEFAULT_USER_ID, default_db))
+    if os.path.isdir(users_dir):
+        for name in sorted(os.listdir(users_dir)):
+            if name.endswith(".db"):
+                stores.append((name[:-3], os.path.join(users_dir, name)))
+    return stores
+
+
+def forecast_user(user_id, db_path, as_of, days):
+    """(ok, output line) for a user"""
+    try:
+        store = TransactionStore(db_path)
+        try:
+            user_data = store.load()
+        finally:
+            store.close()
+        recurring = RecurringDetector()
+        recurring.rebuild(user_data["transactions"])
+        forecast = build_forecast(user_data["accounts"], user_data["transactions"], recurring, as_of, days)
+        return True, json.dumps({"user_id": user_id, "forecast": trim(forecast, days)})
+    except Exception as e:
+        return False, json.dumps({"user_id": user_id, "error": str(e)})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days", type=int, default=30, help=f"forecast length, 1 to {FORECAST_MAX_DAYS}")
+    parser.add_argument("--users-dir", default=USER_DATA_DIR)
+    parser.add_argument("--db", default=os.getenv("USER_DATA_DB", "user_data.db"), help="the default user's store")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--out", help="output file (default: stdout)")
+    args = parser.parse_args()
+    if not 1 <= args.days <= FORECAST_MAX_DAYS:
+        parser.error(f"--days must be between 1 and {FORECAST_MAX_DAYS}")
+
+    stores = user_stores(args.users_dir, args.db)
+    as_of = date.today().toordinal()
+    start = time.perf_counter()
+    failed = 0
+    out = open(args.out, "w") if args.out else sys.stdout
+    try:
+        with ProcessPoolExecutor(max(1, args.workers)) as executor:
+            results = executor.map(
+                forecast_user, *zip(*stores), [as_of] * len(stores), [args.days] * len(stores),
+                chunksize=max(1, len(stores) // (4 * max(1, args.workers))),
+            ) if stores else []
+            for ok, line in results:
+                failed += not ok
+                out.write(line + "\n")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    elapsed = time.perf_counter() - start
+    print(f"{len(stores)} users ({failed} failed) in {elapsed:.2f} s, "
+          f"{len(stores) / elapsed if elapsed else 0:.0f} users/s", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,62 @@
+"""
+Send a Plaid-style webhook to a locally running backend.
+
+Stands in for Plaid when developing against the sandbox or a fake Plaid
+server, e.g.
+
+    python tools/send_webhook.py --item-id <item_id>
+    python tools/send_webhook.py --item-id <item_id> --wait
+
+--wait polls the queued refresh job until it finishes.
+"""
+import argparse
+import json
+import time
+import urllib.request
+
+
+def post(url, payload):
+    request = urllib.request.Request(
+        url, data=json.dumps(payload).encode(), headers={"Content-Type": "application/json"}, method="POST"
+    )
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+
+def get(url, headers):
+    with urllib.request.urlopen(urllib.request.Request(url, headers=headers)) as response:
+        return json.loads(response.read())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--item-id", required=True)
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--type", default="TRANSACTIONS", dest="webhook_type")
+    parser.add_argument("--code", default="SYNC_UPDATES_AVAILABLE", dest="webhook_code")
+    parser.add_argument("--wait", action="store_true", help="poll the refresh job until it finishes")
+    parser.add_argument("--user-id", help="X-User-Id the Item belongs to, needed with --wait")
+    args = parser.parse_args()
+
+    result = post(f"{args.base_url}/plaid/webhook", {
+        "webhook_type": args.webhook_type,
+        "webhook_code": args.webhook_code,
+        "item_id": args.item_id,
+        "initial_update_complete": True,
+        "historical_update_complete": True,
+    })
+    print(json.dumps(result))
+
+    job_id = result.get("job_id")
+    if args.wait and job_id:
+        headers = {"X-User-Id": args.user_id} if args.user_id else {}
+        while True:
+            job = get(f"{args.base_url}/refresh_jobs/{job_id}", headers)
+            if job["status"] not in ("queued", "running"):
+                print(json.dumps(job))
+                break
+            time.sleep(0.2)
+
+
+if __name__ == "__main__":
+    main()
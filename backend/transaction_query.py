@@ -0,0 +1,134 @@
+import base64
+import csv
+import io
+import json
+
+from schemas import dumps
+
+MAX_PAGE_SIZE = 1000
+STREAM_CHUNK_SIZE = 500
+# Export columns, in TransactionOut order; category lists are joined with "; "
+CSV_COLUMNS = (
+    "transaction_id", "account_id", "amount", "date", "name", "category", "merchant_name",
+    "original_date", "date_adjusted", "payment_type",
+)
+
+
+def sort_key(transaction):
+    """Order transactions newest first; transaction_id breaks ties so cursors are stable"""
+    return (transaction.get("original_date") or transaction["date"], transaction["transaction_id"])
+
+
+def encode_cursor(transaction):
+    raw = json.dumps(list(sort_key(transaction))).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Return the (date, transaction_id) position a cursor points at, or raise ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        date, transaction_id = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise ValueError("invalid cursor") from e
+    if not isinstance(date, str) or not isinstance(transaction_id, str):
+        raise ValueError("invalid cursor")
+    return date, transaction_id
+
+
+def build_filter(start_date=None, end_date=None, account_id=None, category=None, merchant=None,
+                 min_amount=None, max_amount=None, adjusted_only=False):
+    """
+    Turn the query parameters into a single predicate, or None when nothing
+    is filtered. Dates compare against the adjusted date the client sees.
+    """
+    checks = []
+    if start_date:
+        checks.append(lambda t: t["date"] >= start_date)
+    if end_date:
+        checks.append(lambda t: t["date"] <= end_date)
+    if account_id:
+        checks.append(lambda t: t["account_id"] == account_id)
+    if category:
+        category_lower = category.lower()
+        checks.append(lambda t: any(c.lower() == category_lower for c in t.get("category") or []))
+    if merchant:
+        merchant_lower = merchant.lower()
+        checks.append(lambda t: (t.get("merchant_name") or "").lower() == merchant_lower)
+    if min_amount is not None:
+        checks.append(lambda t: t["amount"] >= min_amount)
+    if max_amount is not None:
+        checks.append(lambda t: t["amount"] <= max_amount)
+    if adjusted_only:
+        checks.append(lambda t: t.get("date_adjusted", False))
+
+    if not checks:
+        return None
+    return lambda t: all(check(t) for check in checks)
+
+
+def _start_index(transactions, cursor):
+    """First index strictly after the cursor position in a newest-first list"""
+    position = decode_cursor(cursor)
+    lo, hi = 0, len(transactions)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if sort_key(transactions[mid]) >= position:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def paginate(transactions, limit, cursor=None, predicate=None):
+    """
+    Return (page, next_cursor) from a list sorted by sort_key, newest first.
+
+    Seeking to the cursor is a binary search; filtering only scans until the
+    page is full.
+    """
+    start = _start_index(transactions, cursor) if cursor else 0
+    page = []
+    for i in range(start, len(transactions)):
+        transaction = transactions[i]
+        if predicate is None or predicate(transaction):
+            page.append(transaction)
+            if len(page) == limit:
+                has_more = i + 1 < len(transactions)
+                return page, encode_cursor(transaction) if has_more else None
+    return page, None
+
+
+def iter_ndjson(transactions, serialize, predicate=None):
+    """Yield newline-delimited JSON in chunks without materializing the whole body"""
+    lines = []
+    for transaction in transactions:
+        if predicate is not None and not predicate(transaction):
+            continue
+        lines.append(dumps(serialize(transaction)))
+        if len(lines) >= STREAM_CHUNK_SIZE:
+            yield b"\n".join(lines) + b"\n"
+            lines = []
+    if lines:
+        yield b"\n".join(lines) + b"\n"
+
+
+def iter_csv(transactions, serialize, predicate=None):
+    """Yield CSV, header first, in chunks without materializing the whole body"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(CSV_COLUMNS)
+    rows = 0
+    for transaction in transactions:
+        if predicate is not None and not predicate(transaction):
+            continue
+        out = serialize(transaction)
+        out["category"] = "; ".join(out["category"])
+        writer.writerow([out[column] for column in CSV_COLUMNS])
+        rows += 1
+        if rows >= STREAM_CHUNK_SIZE:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+            rows = 0
+    yield buffer.getvalue().encode()
@@ -0,0 +1,361 @@
+import pickle
+import sys
+from array import array
+from collections.abc import Mapping, Sequence
+from datetime import date
+from functools import lru_cache
+
+BASE_KEYS = ("transaction_id", "account_id", "amount", "date", "name", "category", "merchant_name")
+ADJUSTMENT_KEYS = ("original_date", "payment_type", "date_adjusted")
+# Ids and names per piece of TransactionTable.snapshot()
+SNAPSHOT_PIECE_ROWS = 20_000
+
+
+@lru_cache(maxsize=16384)
+def date_to_day(date_str):
+    return date.fromisoformat(date_str).toordinal()
+
+
+@lru_cache(maxsize=16384)
+def day_to_date(day):
+    return date.fromordinal(day).isoformat()
+
+
+class _Dictionary:
+    """Dictionary-encodes repeated values into small integer codes"""
+
+    __slots__ = ("values", "codes")
+
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+
+    def encode(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+class TransactionRow(Mapping):
+    """
+    Read-only dict-like view of one row of a TransactionTable.
+
+    Behaves like the transaction dicts used elsewhere: `row["amount"]`,
+    `row.get("date_adjusted", False)`, `dict(row)`. Adjustment keys only
+    exist when the row carries an early payment overlay.
+    """
+
+    __slots__ = ("_table", "_row", "_adjustment")
+
+    def __init__(self, table, row, adjustment=None):
+        self._table = table
+        self._row = row
+        # (days shifted, payment_type) from an AdjustedTransactions overlay
+        self._adjustment = adjustment
+
+    @property
+    def transaction_id(self):
+        return self._table._ids[self._row]
+
+    @property
+    def account_id(self):
+        return self._table._accounts.values[self._table._account[self._row]]
+
+    @property
+    def amount(self):
+        return self._table._amount[self._row]
+
+    @property
+    def original_date(self):
+        return day_to_date(self._table._day[self._row])
+
+    @property
+    def date(self):
+        day = self._table._day[self._row]
+        if self._adjustment is not None:
+            day += self._adjustment[0]
+        return day_to_date(day)
+
+    @property
+    def name(self):
+        return self._table._names[self._row]
+
+    @property
+    def category(self):
+        return self._table._categories.values[self._table._category[self._row]]
+
+    @property
+    def merchant_name(self):
+        code = self._table._merchant[self._row]
+        return None if code < 0 else self._table._merchants.values[code]
+
+    def __getitem__(self, key):
+        if key in BASE_KEYS:
+            return getattr(self, key)
+        if self._adjustment is not None:
+            if key == "original_date":
+                return self.original_date
+            if key == "payment_type":
+                return self._adjustment[1]
+            if key == "date_adjusted":
+                return True
+        raise KeyError(key)
+
+    def __iter__(self):
+        yield from BASE_KEYS
+        if self._adjustment is not None:
+            yield from ADJUSTMENT_KEYS
+
+    def __len__(self):
+        return len(BASE_KEYS) + (len(ADJUSTMENT_KEYS) if self._adjustment is not None else 0)
+
+    def copy(self):
+        return dict(self)
+
+    def __repr__(self):
+        return f"TransactionRow({dict(self)!r})"
+
+
+class TransactionTable(Sequence):
+    """
+    Column-oriented store for the in-memory transaction history.
+
+    Dates are int day ordinals, amounts a float64 array, and accounts,
+    merchants and category lists are dictionary-encoded; names are interned.
+    Deleted rows are recycled. Iteration and indexing go newest first (by
+    date, then transaction_id) and yield TransactionRow views, so code
+    written against the old list of dicts keeps working.
+    """
+
+    def __init__(self, transactions=()):
+        self._ids = []
+        self._account = array("l")
+        self._amount = array("d")
+        self._day = array("l")
+        self._names = []
+        self._category = array("l")
+        self._merchant = array("l")
+        self._accounts = _Dictionary()
+        self._categories = _Dictionary()
+        self._merchants = _Dictionary()
+        self._index = {}
+        self._free = []
+        self._order = None
+        self.upsert(transactions)
+
+    # Writes
+
+    def upsert(self, transactions):
+        """Insert or overwrite rows by transaction_id"""
+        for transaction in transactions:
+            self.put(
+                transaction["transaction_id"],
+                transaction["account_id"],
+                transaction["amount"],
+                transaction.get("original_date") or transaction["date"],
+                transaction["name"],
+                transaction.get("category") or (),
+                transaction.get("merchant_name"),
+            )
+
+    def put(self, transaction_id, account_id, amount, date_str, name, category, merchant_name):
+        values = (
+            self._accounts.encode(account_id),
+            float(amount),
+            date_to_day(date_str),
+            sys.intern(name),
+            self._categories.encode(tuple(category)),
+            -1 if merchant_name is None else self._merchants.encode(merchant_name),
+        )
+        row = self._index.get(transaction_id)
+        if row is None:
+            if self._free:
+                row = self._free.pop()
+                self._ids[row] = transaction_id
+            else:
+                row = len(self._ids)
+                self._ids.append(transaction_id)
+                self._account.append(0)
+                self._amount.append(0.0)
+                self._day.append(0)
+                self._names.append("")
+                self._category.append(0)
+                self._merchant.append(-1)
+            self._index[transaction_id] = row
+        (self._account[row], self._amount[row], self._day[row],
+         self._names[row], self._category[row], self._merchant[row]) = values
+        self._order = None
+
+    def remove(self, transaction_ids):
+        for transaction_id in transaction_ids:
+            row = self._index.pop(transaction_id, None)
+            if row is not None:
+                self._ids[row] = None
+                self._names[row] = ""
+                self._free.append(row)
+                self._order = None
+
+    # Reads
+
+    def order(self):
+        """Physical row numbers, newest first"""
+        if self._order is None:
+            ids, day = self._ids, self._day
+            self._order = array("l", sorted(self._index.values(), key=lambda r: (day[r], ids[r]), reverse=True))
+        return self._order
+
+    def amounts(self):
+        """The amount column in iteration order"""
+        amount = self._amount
+        return [amount[r] for r in self.order()]
+
+    def records(self):
+        """(transaction_id, day, amount, merchant or name) per row, in no particular order"""
+        amount, day, names = self._amount, self._day, self._names
+        merchant, merchants = self._merchant, self._merchants.values
+        for transaction_id, r in self._index.items():
+            code = merchant[r]
+            yield transaction_id, day[r], amount[r], names[r] if code < 0 else merchants[code]
+
+    def texts(self):
+        """(transaction_id, day, name, merchant_name, category) per row, in no particular order"""
+        day, names = self._day, self._names
+        merchant, merchants = self._merchant, self._merchants.values
+        category, categories = self._category, self._categories.values
+        for transaction_id, r in self._index.items():
+            code = merchant[r]
+            yield transaction_id, day[r], names[r], None if code < 0 else merchants[code], categories[category[r]]
+
+    def window(self, first_day):
+        """(transaction_id, account_id, day, amount) of rows dated first_day or later, newest first"""
+        ids, day, amount = self._ids, self._day, self._amount
+        account, accounts = self._account, self._accounts.values
+        for r in self.order():
+            if day[r] < first_day:
+                break
+            yield ids[r], accounts[account[r]], day[r], amount[r]
+
+    def snapshot(self):
+        """
+        The table as pickled pieces for from_snapshot(), e.g. in another
+        process. The columns go as they are (arrays as raw buffers), which is
+        far smaller and faster than a list of dicts. Pieces are produced one
+        at a time and hold at most SNAPSHOT_PIECE_ROWS ids and names each, so
+        a caller on the event loop can pause between them; the columns are
+        copied up front, so the snapshot stays consistent meanwhile.
+        """
+        ids, names = list(self._ids), list(self._names)
+        yield pickle.dumps((
+            array("l", self._account), array("d", self._amount), array("l", self._day),
+            array("l", self._category), array("l", self._merchant), list(self._accounts.values),
+            list(self._categories.values), list(self._merchants.values), list(self._free),
+        ), protocol=pickle.HIGHEST_PROTOCOL)
+        for start in range(0, len(ids), SNAPSHOT_PIECE_ROWS):
+            end = start + SNAPSHOT_PIECE_ROWS
+            yield pickle.dumps((ids[start:end], names[start:end]), protocol=pickle.HIGHEST_PROTOCOL)
+
+    def copy(self):
+        """
+        An in-memory copy with the same row numbers, which later writes to
+        this table don't affect. The dictionaries only ever grow, so their
+        values are shared.
+        """
+        table = TransactionTable.__new__(TransactionTable)
+        table._ids, table._names = list(self._ids), list(self._names)
+        table._account, table._amount = array("l", self._account), array("d", self._amount)
+        table._day, table._category = array("l", self._day), array("l", self._category)
+        table._merchant = array("l", self._merchant)
+        table._accounts, table._categories, table._merchants = self._accounts, self._categories, self._merchants
+        table._index = dict(self._index)
+        table._free = list(self._free)
+        # Replaced rather than modified on writes, so it can be shared too
+        table._order = self._order
+        return table
+
+    @classmethod
+    def from_snapshot(cls, pieces):
+        table = cls()
+        pieces = iter(pieces)
+        (table._account, table._amount, table._day, table._category, table._merchant,
+         accounts, categories, merchants, table._free) = pickle.loads(next(pieces))
+        for dictionary, values in ((table._accounts, accounts), (table._categories, categories),
+                                   (table._merchants, merchants)):
+            dictionary.values = values
+            dictionary.codes = {value: code for code, value in enumerate(values)}
+        for piece in pieces:
+            ids, names = pickle.loads(piece)
+            table._ids.extend(ids)
+            table._names.extend(sys.intern(name) for name in names)
+        table._index = {transaction_id: r for r, transaction_id in enumerate(table._ids) if transaction_id is not None}
+        return table
+
+    def row_number(self, transaction_id):
+        """Physical row number of a transaction, or None"""
+        return self._index.get(transaction_id)
+
+    def get(self, transaction_id):
+        row = self._index.get(transaction_id)
+        return None if row is None else TransactionRow(self, row)
+
+    def ids(self):
+        return self._index.keys()
+
+    def __len__(self):
+        return len(self._index)
+
+    def __getitem__(self, i):
+        order = self.order()
+        if isinstance(i, slice):
+            return [TransactionRow(self, r) for r in order[i]]
+        return TransactionRow(self, order[i])
+
+    def __iter__(self):
+        for r in self.order():
+            yield TransactionRow(self, r)
+
+
+class AdjustedTransactions(Sequence):
+    """
+    The table seen through an early payment overlay.
+
+    The overlay maps physical rows to (days shifted, payment_type); nothing is
+    copied. The row order is fixed when the view is created.
+    """
+
+    def __init__(self, table, overlay):
+        self.table = table
+        self.overlay = overlay
+        self._order = table.order()
+
+    def __len__(self):
+        return len(self._order)
+
+    def _row(self, r):
+        return TransactionRow(self.table, r, self.overlay.get(r))
+
+    def get(self, transaction_id):
+        row = self.table.row_number(transaction_id)
+        return None if row is None else self._row(row)
+
+    def pinned(self):
+        """
+        The same view over a copy of the table, for readers that run outside
+        the partition lock (e.g. a streamed response): removals recycle rows,
+        so the live table can change under them.
+        """
+        view = AdjustedTransactions.__new__(AdjustedTransactions)
+        view.table = self.table.copy()
+        view.overlay = self.overlay
+        view._order = self._order
+        return view
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._row(r) for r in self._order[i]]
+        return self._row(self._order[i])
+
+    def __iter__(self):
+        for r in self._order:
+            yield self._row(r)
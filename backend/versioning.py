@@ -0,0 +1,65 @@
+import uuid
+
+from fastapi import Request, Response
+
+
+class DataVersions:
+    """
+    Generation counters for each part of the user data.
+
+    Every write path bumps the counters of what it changed; read endpoints
+    key their caches and ETags on the counters they depend on. Keys carry a
+    per-process epoch so an ETag from before a restart never matches.
+    """
+
+    PARTS = ("transactions", "accounts", "insights")
+
+    def __init__(self):
+        self.epoch = uuid.uuid4().hex[:8]
+        self.counters = {part: 0 for part in self.PARTS}
+
+    def bump(self, *parts):
+        for part in parts or self.PARTS:
+            self.counters[part] += 1
+
+    def key(self, *parts):
+        return (self.epoch, *(self.counters[part] for part in parts))
+
+
+def make_etag(name, key):
+    """Weak ETag for a resource derived from a version key"""
+    return f'W/"{name}-' + "-".join(str(v) for v in key) + '"'
+
+
+class VersionedCache:
+    """Holds one computed value and recomputes it only when its version key changes"""
+
+    def __init__(self):
+        self._key = None
+        self._value = None
+
+    def get(self, key, compute):
+        if self._key != key:
+            self._value = compute()
+            self._key = key
+        return self._value
+
+    def clear(self):
+        self._key = None
+        self._value = None
+
+
+def etag_matches(request: Request, etag: str):
+    """Check an If-None-Match header against the current ETag"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # Weak comparison: W/"x" and "x" are the same resource version
+    candidates = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return etag.removeprefix("W/") in candidates
+
+
+def not_modified(etag: str):
+    return Response(status_code=304, headers={"ETag": etag})